@@ -0,0 +1,404 @@
+##
+## DigestBloomFilter.py
+##      - A Bloom filter of the registered contents (the sizes with md1 and
+##        the sizes with all the checksums) persisted next to the database,
+##        telling which files are definitely not registered.
+##
+
+
+# import of required modules {{{
+import hashlib
+import math
+import os
+import struct
+
+# advisory file locks are available on POSIX systems only {{{
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+# }}}
+# }}}
+
+
+# class DigestBloomFilter() {{{
+class DigestBloomFilter(object):
+    # DOC {{{
+    """A Bloom filter of the registered contents: every entry adds the key of
+    its size and md1 and the key of its whole content (the size and all the
+    checksums). A file whose key is not in the filter is definitely not
+    registered, so it is not looked up in the database. A key in the filter
+    is registered with the probability of FALSE_POSITIVE_RATE at worst (up
+    to the capacity) and has to be looked up.
+
+    The filter is persisted next to the database: a header (the magic, the
+    capacity, the number of the entries in the database and their highest
+    fileId) followed by the bits. It is built from the database (see
+    build()) and the stored entries are added to the file (see
+    addToFile()). It is up to date if the database has still the same number
+    of entries and the same highest fileId (the entries are never deleted
+    and their contents never change) and it is not over its capacity (see
+    isUpToDate()), otherwise it is built again.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the suffix of the filter file path next to the database
+    SUFFIX              = ".bloom"
+
+    # the header: the magic, the capacity, the number of entries in the database and their highest fileId
+    HEADER_STRUCT       = struct.Struct(">8sQQQ32x")
+
+    # the magic at the beginning of the file (with the version of the format)
+    MAGIC               = b"REGFBLM\x01"
+
+    # the probability of a false positive at the capacity
+    FALSE_POSITIVE_RATE = 0.01
+
+    # the smallest capacity (the number of entries) of a built filter, it is built for twice the entries otherwise
+    MIN_CAPACITY        = 100000
+
+    # the DBFile columns a filter is built from
+    COLUMNS             = ("fileId", "fileSize", "md1", "md5", "ed2k")
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, capacity, dbFiles = 0, maxFileId = 0, bits = None):
+        # DOC {{{
+        """Initializes the filter of the capacity.
+
+        Parameters
+
+            capacity -- the number of entries (two keys each) the filter is
+                sized for
+
+            dbFiles -- (optional) the number of the entries in the filter
+
+            maxFileId -- (optional) the highest fileId of the entries in the
+                filter
+
+            bits -- (optional) a bytearray of the bits of the filter (empty
+                if None)
+        """
+        # }}}
+
+        # CODE {{{
+        self.capacity   = capacity
+        self.dbFiles    = dbFiles
+        self.maxFileId  = maxFileId
+
+        # the number of bits and hashes (the optimal ones for two keys per entry) {{{
+        self.bitCount   = max(8, math.ceil(-2 * capacity * math.log(DigestBloomFilter.FALSE_POSITIVE_RATE) / (math.log(2) ** 2)))
+        self.hashCount  = max(1, round(self.bitCount / (2 * capacity) * math.log(2)))
+        # }}}
+
+        self.bits       = bits if (bits is not None) else bytearray((self.bitCount + 7) // 8)
+        # }}}
+
+
+    @staticmethod
+    def build(dbFileRecords, dbFiles):
+        # DOC {{{
+        """Returns a new DigestBloomFilter() of the DBFileRecord()s (having
+        the COLUMNS at least) sized for twice the entries.
+
+        Parameters
+
+            dbFileRecords -- an iterable of all DBFileRecord()s in the
+                database
+
+            dbFiles -- the expected number of the DBFileRecord()s
+        """
+        # }}}
+
+        # CODE {{{
+        bloomFilter = DigestBloomFilter(max(DigestBloomFilter.MIN_CAPACITY, 2 * dbFiles))
+
+        for dbFileRecord in dbFileRecords:
+            bloomFilter.add(dbFileRecord)
+
+        return bloomFilter
+        # }}}
+
+
+    @staticmethod
+    def read(path):
+        # DOC {{{
+        """Returns the DigestBloomFilter() read from the file.
+
+        Raises OSError() if the file could not be read and ValueError() if
+        it is not a filter.
+
+        Parameters
+
+            path -- the path of the filter file
+        """
+        # }}}
+
+        # CODE {{{
+        with open(path, "rb") as file_:
+            return DigestBloomFilter._readFile(file_)
+        # }}}
+
+
+    @staticmethod
+    def addToFile(path, dbFiles):
+        # DOC {{{
+        """Adds the stored DBFile()s to the filter file (if there is one). The
+        file is locked, so the parallel processes add their DBFile()s one
+        after another.
+
+        Raises OSError() if the file could not be written.
+
+        Parameters
+
+            path -- the path of the filter file
+
+            dbFiles -- an iterable of the stored DBFile()s (with their
+                fileIds)
+        """
+        # }}}
+
+        # CODE {{{
+        try:
+            file_ = open(path, "r+b")
+        except FileNotFoundError:
+            return
+
+        with file_:
+            # lock the file for this process {{{
+            if (fcntl is not None):
+                fcntl.flock(file_.fileno(), fcntl.LOCK_EX)
+            # }}}
+
+            # read the filter as it is now, the file is built again if it is not valid {{{
+            try:
+                bloomFilter = DigestBloomFilter._readFile(file_)
+            except ValueError:
+                return
+            # }}}
+
+            for dbFile in dbFiles:
+                bloomFilter.add(dbFile)
+
+            # write the bits before the header, so the header never counts the entries missing in the bits {{{
+            file_.seek(DigestBloomFilter.HEADER_STRUCT.size)
+            file_.write(bloomFilter.bits)
+            file_.flush()
+            file_.seek(0)
+            file_.write(bloomFilter._packHeader())
+            file_.flush()
+            # }}}
+        # }}}
+
+
+    def write(self, path):
+        # DOC {{{
+        """Writes the filter to a temporary file that replaces the file at
+        the path.
+
+        Parameters
+
+            path -- the path of the filter file
+        """
+        # }}}
+
+        # CODE {{{
+        temporaryPath = path + ".tmp"
+
+        try:
+            with open(temporaryPath, "wb") as file_:
+                file_.write(self._packHeader())
+                file_.write(self.bits)
+
+            os.replace(temporaryPath, path)
+        except:
+            if (os.path.exists(temporaryPath)):
+                os.remove(temporaryPath)
+            raise
+        # }}}
+
+
+    def isUpToDate(self, dbFiles, maxFileId):
+        # DOC {{{
+        """Returns True if the filter has all the entries of the database in
+        its current state and it is not over its capacity.
+
+        Parameters
+
+            dbFiles -- the number of the entries in the database
+
+            maxFileId -- the highest fileId in the database (None if empty)
+        """
+        # }}}
+
+        # CODE {{{
+        return ((self.dbFiles == dbFiles) and (self.maxFileId == (maxFileId or 0)) and (self.dbFiles <= self.capacity))
+        # }}}
+
+
+    def add(self, dbFile):
+        # DOC {{{
+        """Adds the keys of the DBFile() (or a DBFileRecord() having the
+        COLUMNS) to the filter.
+
+        Parameters
+
+            dbFile -- the DBFile() to add
+        """
+        # }}}
+
+        # CODE {{{
+        for key in (
+                DigestBloomFilter._formatKey(dbFile.fileSize, dbFile.md1),
+                DigestBloomFilter._formatKey(dbFile.fileSize, dbFile.md1, dbFile.md5, dbFile.ed2k),
+        ):
+            for bitIndex in self._determineBitIndexes(key):
+                self.bits[bitIndex >> 3] |= 1 << (bitIndex & 7)
+
+        self.dbFiles = self.dbFiles + 1
+        self.maxFileId = max(self.maxFileId, dbFile.fileId or 0)
+        # }}}
+
+
+    def mightContainSizeAndMD1(self, fileSize, md1):
+        # DOC {{{
+        """Returns False if there is definitely no entry of the size and the
+        MD5 sum of the first megabyte, True if there might be one.
+
+        Parameters
+
+            fileSize -- the size of the file in bytes
+
+            md1 -- the MD5 sum of the first megabyte of the file
+        """
+        # }}}
+
+        # CODE {{{
+        return self._contains(DigestBloomFilter._formatKey(fileSize, md1))
+        # }}}
+
+
+    def mightContainContent(self, fileSize, md1, md5, ed2k):
+        # DOC {{{
+        """Returns False if there is definitely no entry of the content, True
+        if there might be one.
+
+        Parameters
+
+            fileSize -- the size of the file in bytes
+
+            md1 -- the MD5 sum of the first megabyte of the file
+
+            md5 -- the MD5 sum of the entire file
+
+            ed2k -- the ED2K sum of the entire file
+        """
+        # }}}
+
+        # CODE {{{
+        return self._contains(DigestBloomFilter._formatKey(fileSize, md1, md5, ed2k))
+        # }}}
+
+
+    @staticmethod
+    def _readFile(file_):
+        # DOC {{{
+        """Returns the DigestBloomFilter() read from the open file (from its
+        beginning).
+
+        Raises ValueError() if the file is not a filter.
+
+        Parameters
+
+            file_ -- the filter file open for reading in the binary mode
+        """
+        # }}}
+
+        # CODE {{{
+        file_.seek(0)
+        header = file_.read(DigestBloomFilter.HEADER_STRUCT.size)
+
+        if (len(header) != DigestBloomFilter.HEADER_STRUCT.size):
+            raise ValueError("The file '{}' is not a Bloom filter!".format(file_.name))
+
+        magic, capacity, dbFiles, maxFileId = DigestBloomFilter.HEADER_STRUCT.unpack(header)
+        bloomFilter = DigestBloomFilter(capacity, dbFiles, maxFileId, bytearray(file_.read()))
+
+        if ((magic != DigestBloomFilter.MAGIC) or (len(bloomFilter.bits) != (bloomFilter.bitCount + 7) // 8)):
+            raise ValueError("The file '{}' is not a Bloom filter!".format(file_.name))
+
+        return bloomFilter
+        # }}}
+
+
+    def _packHeader(self):
+        # DOC {{{
+        """Returns the header of the filter file.
+        """
+        # }}}
+
+        # CODE {{{
+        return DigestBloomFilter.HEADER_STRUCT.pack(DigestBloomFilter.MAGIC, self.capacity, self.dbFiles, self.maxFileId)
+        # }}}
+
+
+    @staticmethod
+    def _formatKey(fileSize, *checksums):
+        # DOC {{{
+        """Returns the key (bytes) of the size and the checksums.
+
+        Parameters
+
+            fileSize -- the size of the file in bytes
+
+            *checksums -- the checksums (md1 or md1, md5 and ed2k)
+        """
+        # }}}
+
+        # CODE {{{
+        return ":".join(str(value) for value in (fileSize,) + checksums).encode("utf-8")
+        # }}}
+
+
+    def _determineBitIndexes(self, key):
+        # DOC {{{
+        """Returns an iterator of the indexes of the bits of the key (double
+        hashing of the two halves of its BLAKE2 digest).
+
+        Parameters
+
+            key -- the key (bytes)
+        """
+        # }}}
+
+        # CODE {{{
+        digest = hashlib.blake2b(key, digest_size = 16).digest()
+        hash1 = int.from_bytes(digest[:8], "big")
+        hash2 = int.from_bytes(digest[8:], "big") | 1
+
+        return ((hash1 + ii * hash2) % self.bitCount for ii in range(self.hashCount))
+        # }}}
+
+
+    def _contains(self, key):
+        # DOC {{{
+        """Returns True if all the bits of the key are set.
+
+        Parameters
+
+            key -- the key (bytes)
+        """
+        # }}}
+
+        # CODE {{{
+        bits = self.bits
+
+        return all(bits[bitIndex >> 3] & (1 << (bitIndex & 7)) for bitIndex in self._determineBitIndexes(key))
+        # }}}
+
+
+    # }}}
+# }}}
@@ -0,0 +1,470 @@
+##
+## DigestCatalog.py
+##      - A compact binary catalog of the registered contents (sizes and
+##        checksums with the IDs) sorted by size and md1, looked up by
+##        a binary search in the memory mapped file.
+##
+
+
+# import of required modules {{{
+import mmap
+import os
+import struct
+
+from db.DBFileRecord import DBFileRecord
+# }}}
+
+
+# class DigestCatalog() {{{
+class DigestCatalog(object):
+    # DOC {{{
+    """A compact binary catalog of the registered contents written from the
+    database (see write()) and looked up without it.
+
+    The file starts with a header (the magic, the number of records, the
+    number of the entries in the database and their highest fileId when it
+    was written) followed by fixed-width records sorted by (size, md1, md5,
+    ed2k, fileId):
+
+        size (8 bytes, big-endian), md1, md5, ed2k (16 bytes each), fileId
+        (8 bytes, big-endian)
+
+    An entry missing a valid md5 or ed2k is written as a partial record: its
+    md5 and ed2k are zeros and its fileId has the PARTIAL_FLAG, so it
+    answers containsSizeAndMD1() but never matches a content. An entry
+    missing a valid size or md1 is not written at all, so the catalog is
+    complete (and exact) only if it has a record of every entry (see
+    isComplete()).
+
+    The big-endian size and the raw digests compare as bytes in the same
+    order as the values, so a lookup is a binary search of the key bytes in
+    the memory mapped file. The file is mapped read-only, so any number of
+    processes share it in the page cache. It is written to a temporary file
+    that replaces the old one, so it can be refreshed while it is in use.
+
+    The catalog is up to date if the database has still the same number of
+    entries and the same highest fileId (the entries are never deleted and
+    their contents never change, see isUpToDate()).
+
+    A batch of contents is matched at once by NumPy if it is installed: the
+    records are viewed as a structured array (without copying) and the keys
+    are joined by a sorted search (see findContents()).
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the suffix of the catalog file path next to the database
+    SUFFIX              = ".catalog"
+
+    # the header: the magic, the number of records, the number of entries in the database and their highest fileId
+    HEADER_STRUCT       = struct.Struct(">8sQQQ32x")
+
+    # the magic at the beginning of the file (with the version of the format)
+    MAGIC               = b"REGFCAT\x02"
+
+    # a record: size, md1, md5, ed2k and fileId
+    RECORD_STRUCT       = struct.Struct(">Q16s16s16sQ")
+
+    # the flag of the fileId of a partial record (the size and md1 of an entry missing a valid md5 or ed2k)
+    PARTIAL_FLAG        = 1 << 63
+
+    # the DBFile columns a catalog is written from
+    COLUMNS             = ("fileId", "fileSize", "md1", "md5", "ed2k")
+
+    # the NumPy fields of a record: the key of the content (size, md1, md5 and ed2k) and the fileId
+    RECORD_FIELDS       = [('content', 'S56'), ('fileId', '>u8')]
+
+    # NumPy is optional and imported on the first batch, so it does not slow
+    # down the start (None until then, False if it is not installed, see
+    # _importNumPy())
+    _numpy              = None
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, path):
+        # DOC {{{
+        """Opens the catalog and maps it to the memory.
+
+        Raises OSError() if the file could not be opened and ValueError() if
+        it is not a catalog.
+
+        Parameters
+
+            path -- the path of the catalog file
+        """
+        # }}}
+
+        # CODE {{{
+        self.path = path
+
+        # the records as a NumPy array (viewed on the first batch, see findContents())
+        self._records = None
+
+        # map the whole file read-only {{{
+        with open(path, "rb") as file_:
+            fileSize = os.fstat(file_.fileno()).st_size
+
+            if (fileSize < DigestCatalog.HEADER_STRUCT.size):
+                raise ValueError("The file '{}' is not a catalog!".format(path))
+
+            self._mmap = mmap.mmap(file_.fileno(), 0, access = mmap.ACCESS_READ)
+        # }}}
+
+        # read the header and check the size of the records {{{
+        magic, self.records, self.dbFiles, self.maxFileId = DigestCatalog.HEADER_STRUCT.unpack_from(self._mmap, 0)
+
+        if ((magic != DigestCatalog.MAGIC) or
+                (fileSize != DigestCatalog.HEADER_STRUCT.size + self.records * DigestCatalog.RECORD_STRUCT.size)):
+            self.close()
+            raise ValueError("The file '{}' is not a catalog!".format(path))
+        # }}}
+        # }}}
+
+
+    def close(self):
+        # DOC {{{
+        """Unmaps the catalog.
+        """
+        # }}}
+
+        # CODE {{{
+        # the mapping can't be closed while the array is viewing it
+        self._records = None
+
+        self._mmap.close()
+        # }}}
+
+
+    def isUpToDate(self, dbFiles, maxFileId):
+        # DOC {{{
+        """Returns True if the catalog has been written from the database in
+        its current state (the entries are only added).
+
+        Parameters
+
+            dbFiles -- the number of the entries in the database
+
+            maxFileId -- the highest fileId in the database (None if empty)
+        """
+        # }}}
+
+        # CODE {{{
+        return ((self.dbFiles == dbFiles) and (self.maxFileId == (maxFileId or 0)))
+        # }}}
+
+
+    def isComplete(self):
+        # DOC {{{
+        """Returns True if the catalog has a record of every entry in the
+        database (none of them was missing a valid size or md1), so it
+        answers exactly as the database would.
+        """
+        # }}}
+
+        # CODE {{{
+        return (self.records == self.dbFiles)
+        # }}}
+
+
+    def containsSizeAndMD1(self, fileSize, md1):
+        # DOC {{{
+        """Returns True if there is a record of the size and the MD5 sum of
+        the first megabyte, False otherwise.
+
+        Parameters
+
+            fileSize -- the size of the file in bytes
+
+            md1 -- the MD5 sum of the first megabyte of the file
+        """
+        # }}}
+
+        # CODE {{{
+        key = self._packKey(fileSize, md1)
+
+        if (key is None):
+            return False
+
+        index = self._bisect(key)
+
+        return ((index < self.records) and (self._readKey(index, len(key)) == key))
+        # }}}
+
+
+    def findContent(self, fileSize, md1, md5, ed2k):
+        # DOC {{{
+        """Returns a DBFileRecord() (with the fileId, the size and the
+        checksums only) of the first registered entry of the content or None
+        if the content is not in the catalog.
+
+        Parameters
+
+            fileSize -- the size of the file in bytes
+
+            md1 -- the MD5 sum of the first megabyte of the file
+
+            md5 -- the MD5 sum of the entire file
+
+            ed2k -- the ED2K sum of the entire file
+        """
+        # }}}
+
+        # CODE {{{
+        key = self._packKey(fileSize, md1, md5, ed2k)
+
+        if (key is None):
+            return None
+
+        index = self._bisect(key)
+
+        if ((index == self.records) or (self._readKey(index, len(key)) != key)):
+            return None
+
+        fileId = DigestCatalog.RECORD_STRUCT.unpack_from(self._mmap, self._determineOffset(index))[4]
+
+        # a partial record is not a content
+        if (fileId & DigestCatalog.PARTIAL_FLAG):
+            return None
+
+        return DBFileRecord(fileId, None, None, None, fileSize, md1, md5, ed2k, None, None)
+        # }}}
+
+
+    def findContents(self, contents):
+        # DOC {{{
+        """Returns a list of DBFileRecord()s (see findContent()) or None of
+        the contents in their order. If NumPy is installed the contents are
+        matched at once: the keys are joined with the records by a sorted
+        search, otherwise they are looked up one by one.
+
+        Parameters
+
+            contents -- a list of (fileSize, md1, md5, ed2k,) tuples
+        """
+        # }}}
+
+        # CODE {{{
+        numpy = DigestCatalog._importNumPy()
+
+        # look the contents up one by one without NumPy (or records) {{{
+        if ((numpy is None) or (self.records == 0)):
+            return [self.findContent(*content) for content in contents]
+        # }}}
+
+        # view the records as an array (the mapping is not copied) {{{
+        if (self._records is None):
+            self._records = numpy.frombuffer(self._mmap, dtype = numpy.dtype(DigestCatalog.RECORD_FIELDS),
+                    count = self.records, offset = DigestCatalog.HEADER_STRUCT.size)
+        # }}}
+
+        # join the keys with the records (the first record not lower than the key is the first entry of the content if it has the key) {{{
+        keys = [self._packKey(*content) for content in contents]
+        keyArray = numpy.array([(key if (key is not None) else b"") for key in keys], dtype = 'S56')
+
+        indexes = numpy.minimum(numpy.searchsorted(self._records['content'], keyArray), self.records - 1)
+        fileIds = self._records['fileId'][indexes]
+        found = ((self._records['content'][indexes] == keyArray) & (fileIds < DigestCatalog.PARTIAL_FLAG))
+        # }}}
+
+        return [
+                DBFileRecord(fileId, None, None, None, fileSize, md1, md5, ed2k, None, None)
+                if ((key is not None) and (isFound)) else None
+                for key, isFound, fileId, (fileSize, md1, md5, ed2k) in zip(keys, found.tolist(), fileIds.tolist(), contents)
+        ]
+        # }}}
+
+
+    @staticmethod
+    def _importNumPy():
+        # DOC {{{
+        """Returns the NumPy module (imported on the first call) or None if
+        it is not installed.
+        """
+        # }}}
+
+        # CODE {{{
+        if (DigestCatalog._numpy is None):
+            try:
+                import numpy
+                DigestCatalog._numpy = numpy
+            except ImportError:
+                DigestCatalog._numpy = False
+
+        return DigestCatalog._numpy or None
+        # }}}
+
+
+    @staticmethod
+    def write(path, dbFileRecords):
+        # DOC {{{
+        """Writes the catalog of the DBFileRecord()s (having the COLUMNS
+        at least) to a temporary file that replaces the file at the path.
+        Returns a tuple (records, dbFiles,): the number of the written
+        records and the number of the DBFileRecord()s (the ones missing a
+        valid size or md1 are not written, the ones missing a valid md5 or
+        ed2k are written as partial records).
+
+        Parameters
+
+            path -- the path of the catalog file
+
+            dbFileRecords -- an iterable of all DBFileRecord()s in the
+                database ordered by fileSize
+        """
+        # }}}
+
+        # CODE {{{
+        temporaryPath = path + ".tmp"
+        records = dbFiles = maxFileId = 0
+
+        try:
+            with open(temporaryPath, "wb") as file_:
+                # the header is written when the numbers are known
+                file_.write(bytes(DigestCatalog.HEADER_STRUCT.size))
+
+                # the records of a size (sorted by the rest of the record once the size is complete) {{{
+                sizeRecords = []
+                previousFileSize = None
+
+                for dbFileRecord in dbFileRecords:
+                    dbFiles = dbFiles + 1
+                    maxFileId = max(maxFileId, dbFileRecord.fileId)
+
+                    if (dbFileRecord.fileSize != previousFileSize):
+                        file_.write(b"".join(sorted(sizeRecords)))
+                        sizeRecords = []
+                        previousFileSize = dbFileRecord.fileSize
+
+                    key = DigestCatalog._packKey(dbFileRecord.fileSize, dbFileRecord.md1, dbFileRecord.md5, dbFileRecord.ed2k)
+                    fileId = dbFileRecord.fileId
+
+                    # write the size and md1 at least (with zeros instead of the missing checksums) {{{
+                    if (key is None):
+                        key = DigestCatalog._packKey(dbFileRecord.fileSize, dbFileRecord.md1)
+                        fileId = fileId | DigestCatalog.PARTIAL_FLAG
+
+                        if (key is not None):
+                            key = key + bytes(32)
+                    # }}}
+
+                    if (key is not None):
+                        sizeRecords.append(key + struct.pack(">Q", fileId))
+                        records = records + 1
+
+                file_.write(b"".join(sorted(sizeRecords)))
+                # }}}
+
+                # write the header and sync the file before it replaces the old one {{{
+                file_.seek(0)
+                file_.write(DigestCatalog.HEADER_STRUCT.pack(DigestCatalog.MAGIC, records, dbFiles, maxFileId))
+                file_.flush()
+                os.fsync(file_.fileno())
+                # }}}
+
+            os.replace(temporaryPath, path)
+        except:
+            if (os.path.exists(temporaryPath)):
+                os.remove(temporaryPath)
+            raise
+
+        return (records, dbFiles,)
+        # }}}
+
+
+    @staticmethod
+    def _packKey(fileSize, *checksums):
+        # DOC {{{
+        """Returns the key (the beginning of a record) of the size and the
+        checksums (hex strings) or None if the size or any of the checksums
+        is not valid.
+
+        Parameters
+
+            fileSize -- the size of the file in bytes
+
+            *checksums -- the checksums in the order of the record (md1,
+                md5, ed2k)
+        """
+        # }}}
+
+        # CODE {{{
+        try:
+            digests = [bytes.fromhex(checksum) for checksum in checksums]
+            key = struct.pack(">Q", fileSize)
+        except (TypeError, ValueError, struct.error):
+            return None
+
+        if (any(len(digest) != 16 for digest in digests)):
+            return None
+
+        return key + b"".join(digests)
+        # }}}
+
+
+    @staticmethod
+    def _determineOffset(index):
+        # DOC {{{
+        """Returns the offset of the record of the index in the file.
+
+        Parameters
+
+            index -- the index of the record
+        """
+        # }}}
+
+        # CODE {{{
+        return DigestCatalog.HEADER_STRUCT.size + index * DigestCatalog.RECORD_STRUCT.size
+        # }}}
+
+
+    def _readKey(self, index, length):
+        # DOC {{{
+        """Returns the key of the length at the beginning of the record of
+        the index.
+
+        Parameters
+
+            index -- the index of the record
+
+            length -- the length of the key
+        """
+        # }}}
+
+        # CODE {{{
+        offset = self._determineOffset(index)
+
+        return self._mmap[offset:offset + length]
+        # }}}
+
+
+    def _bisect(self, key):
+        # DOC {{{
+        """Returns the index of the first record whose key is not lower than
+        the specified one (the number of records if there is no such
+        record).
+
+        Parameters
+
+            key -- the key to look for
+        """
+        # }}}
+
+        # CODE {{{
+        low, high = 0, self.records
+
+        while (low < high):
+            middle = (low + high) // 2
+
+            if (self._readKey(middle, len(key)) < key):
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+        # }}}
+
+
+    # }}}
+# }}}
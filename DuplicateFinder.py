@@ -0,0 +1,265 @@
+##
+## DuplicateFinder.py
+##      - Finds files with the same content in the file system using the
+##        cascade of MySum's states: the files are grouped by size, then by
+##        the MD5 of the first megabyte and only then by the full checksums.
+##
+
+
+# import of required modules {{{
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from FileDiscovery import FileDiscovery
+from MySum import MySum
+# }}}
+
+
+# class DuplicateFinder() {{{
+class DuplicateFinder(object):
+    # DOC {{{
+    """Finds files with the same content in the file system using the cascade
+    of MySum's states, so only a small part of the data is read:
+
+        1) the files are grouped by their size (known from the directory
+           scan without reading anything)
+
+        2) the MD5 of the first megabyte (md1) is determined only for the
+           files sharing the size with another file
+
+        3) the full checksums (MD5 and ED2K) are determined only for the
+           files sharing md1 with another file (and larger than a megabyte,
+           otherwise md1 is the MD5 of the whole file already)
+
+    The files are discovered by FileDiscovery(), so the ignored files and
+    directories are skipped. Hardlinks (paths to the same inode, also the
+    symbolic links to files) are treated as one file, which is read once and
+    reported with all its paths. The checksums are determined in parallel.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the size of the part of the file md1 is determined from (see MySum)
+    MD1_SIZE                    = 1024 * 1024
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, paths, workers = None, ignoreRules = None, ignoredNames = ()):
+        # DOC {{{
+        """Initializes the instance and stores the parameters.
+
+        Parameters
+
+            paths -- an iterable of paths of directories (scanned
+                recursively) and files to look for duplicates in
+
+            workers -- (optional) the number of threads determining the
+                checksums (ThreadPoolExecutor's default if None)
+
+            ignoreRules -- (optional) the IgnoreRules() applied in all the
+                scanned directories (see FileDiscovery())
+
+            ignoredNames -- (optional) an iterable of names of the files
+                skipped in the scanned directories
+        """
+        # }}}
+
+        # CODE {{{
+        # store the parameters {{{
+        self.paths          = list(paths)
+        self.workers        = workers
+        self.ignoreRules    = ignoreRules
+        self.ignoredNames   = ignoredNames
+        # }}}
+
+        # initialize the statistics {{{
+        # the number of found files (paths) and the number of distinct ones (inodes)
+        self.foundFiles     = 0
+        self.foundInodes    = 0
+
+        # the total size of the distinct found files
+        self.foundBytes     = 0
+
+        # the number of bytes the checksums have been determined from
+        self.readBytes      = 0
+
+        # the number of the skipped (ignored) files and directories
+        self.skippedEntries = 0
+
+        # a list of paths that could not be read or scanned
+        self.failedPaths    = []
+        # }}}
+        # }}}
+
+
+    def iterateDuplicates(self):
+        # DOC {{{
+        """Returns an iterator of (fileSize, files,) tuples where the files
+        is a list of at least two files with the same content and every file
+        is a list of its paths (hardlinks).
+        """
+        # }}}
+
+        # CODE {{{
+        # 1) group the inodes by size, the files (lists of paths) sharing the size with another are the candidates {{{
+        files = [
+                paths
+                for pathsByInodes in self._scan().values() if (len(pathsByInodes) > 1)
+                for paths in pathsByInodes.values()
+        ]
+        # }}}
+
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            # 2) determine md1 of all the candidates (from their first paths) and group them by it {{{
+            mySums = list(executor.map(self._determineMD1, (paths[0] for paths in files)))
+
+            self.readBytes = self.readBytes + sum(min(mySum.fileSize, DuplicateFinder.MD1_SIZE) for mySum in mySums if (mySum is not None))
+
+            md1Groups = self._groupByChecksums(files, mySums, ('md1',))
+            # }}}
+
+            # 3) determine the full checksums of all md1 collisions larger than md1 at once {{{
+            futureGroups = [
+                    (files, [executor.submit(self._determineChecksums, mySum) for mySum in mySums],)
+                    for fileSize, files, mySums in md1Groups if (fileSize > DuplicateFinder.MD1_SIZE)
+            ]
+            # }}}
+
+            # return the md1 collisions not larger than md1 right away (md1 is the MD5 of the whole file) {{{
+            for fileSize, files, mySums in md1Groups:
+                if (fileSize <= DuplicateFinder.MD1_SIZE):
+                    yield (fileSize, files)
+            # }}}
+
+            # return the others grouped by the full checksums as they are determined {{{
+            for files, futures in futureGroups:
+                mySums = [future.result() for future in futures]
+
+                self.readBytes = self.readBytes + sum(mySum.fileSize for mySum in mySums if (mySum is not None))
+
+                for fileSize, duplicateFiles, duplicateMySums in self._groupByChecksums(files, mySums, ('md5', 'ed2k',)):
+                    yield (fileSize, duplicateFiles)
+            # }}}
+        # }}}
+
+
+    def _scan(self):
+        # DOC {{{
+        """Scans the paths recursively (see FileDiscovery()) and returns a
+        dictionary of dictionaries of lists of paths by the inodes ((st_dev,
+        st_ino,)) by the sizes.
+        """
+        # }}}
+
+        # CODE {{{
+        pathsByInodesBySizes = dict()
+        fileDiscovery = FileDiscovery(self.paths, ignoreRules = self.ignoreRules, ignoredNames = self.ignoredNames)
+
+        for path, stat in fileDiscovery.iterateFilesAndStats():
+            if (stat is None):
+                self.failedPaths.append(path)
+                continue
+
+            # add the file to the dictionary (unless it has been added already) {{{
+            pathsByInodes = pathsByInodesBySizes.setdefault(stat.st_size, dict())
+            inode = (stat.st_dev, stat.st_ino,)
+
+            if (inode not in pathsByInodes):
+                self.foundInodes = self.foundInodes + 1
+                self.foundBytes = self.foundBytes + stat.st_size
+                pathsByInodes[inode] = []
+
+            if (path not in pathsByInodes[inode]):
+                self.foundFiles = self.foundFiles + 1
+                pathsByInodes[inode].append(path)
+            # }}}
+
+        self.skippedEntries = fileDiscovery.skippedEntries
+        self.failedPaths.extend(fileDiscovery.failedPaths)
+
+        return pathsByInodesBySizes
+        # }}}
+
+
+    def _determineMD1(self, path):
+        # DOC {{{
+        """Returns a MySum() of the file with md1 determined or None if the
+        file could not be read.
+
+        Parameters
+
+            path -- the path of the file
+        """
+        # }}}
+
+        # CODE {{{
+        mySum = MySum(path)
+
+        try:
+            mySum.determineSizeAndMD1()
+        except OSError:
+            self.failedPaths.append(path)
+            return None
+
+        return mySum
+        # }}}
+
+
+    def _determineChecksums(self, mySum):
+        # DOC {{{
+        """Returns the MySum() with MD5 and ED2K determined or None if the
+        file could not be read.
+
+        Parameters
+
+            mySum -- a MySum() with md1 determined
+        """
+        # }}}
+
+        # CODE {{{
+        try:
+            mySum.determineMD5AndED2K()
+        except OSError:
+            self.failedPaths.append(mySum.file_)
+            return None
+
+        return mySum
+        # }}}
+
+
+    @staticmethod
+    def _groupByChecksums(files, mySums, attributeNames):
+        # DOC {{{
+        """Returns a list of (fileSize, files, mySums,) tuples of the groups
+        of at least two files with the same size and checksums.
+
+        Parameters
+
+            files -- an iterable of files (lists of paths)
+
+            mySums -- an iterable of the respective MySum()s (or None for the
+                files that could not be read)
+
+            attributeNames -- the names of MySum()'s checksum attributes to
+                compare
+        """
+        # }}}
+
+        # CODE {{{
+        groups = dict()
+
+        for paths, mySum in zip(files, mySums):
+            if (mySum is not None):
+                key = (mySum.fileSize,) + tuple(getattr(mySum, attributeName) for attributeName in attributeNames)
+                groups.setdefault(key, ([], [],))
+                groups[key][0].append(paths)
+                groups[key][1].append(mySum)
+
+        return [(key[0], groupFiles, groupMySums) for key, (groupFiles, groupMySums) in groups.items() if (len(groupFiles) > 1)]
+        # }}}
+
+
+    # }}}
+# }}}
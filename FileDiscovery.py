@@ -0,0 +1,732 @@
+##
+## FileDiscovery.py
+##      - Discovers the files to process (register, check or import) from
+##        the paths of directories, files and wildcards: the directories are
+##        scanned in parallel and the files are provided as they are found,
+##        the ignored and filtered out files are skipped during the scan.
+##
+
+
+# import of required modules {{{
+import collections
+import glob
+import itertools
+import os
+import threading
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+from IgnoreRules import IgnoreRules
+# }}}
+
+
+# class FileDiscovery() {{{
+class FileDiscovery(object):
+    # DOC {{{
+    """Discovers the files to process from the paths of directories (scanned
+    recursively), files and wildcards and from the listed paths of
+    directories and files (read lazily, in batches, e.g. from a pipe).
+
+    The directories are scanned by os.scandir() (the dirents provide the
+    types, so only the files are stat()ed) in parallel, every scanned
+    directory schedules the scans of its subdirectories right away while
+    fewer than MAX_SCANS_AHEAD scans are scheduled or finished and not
+    provided yet, the others are scheduled as the provision catches up (so
+    the memory does not grow with the tree). The files are provided
+    directory by directory (in the order of os.walk(), top-down, every
+    directory's files together) as soon as the directory is scanned, so the
+    processing does not wait for the whole tree.
+
+    The number of the found files and their total size (of every inode just
+    once, hardlinks are processed once) grow while the scan goes on, they
+    are final when isComplete is True.
+
+    Symbolic links to directories are not followed (as os.walk() does not),
+    symbolic links to files are provided as files.
+
+    The files and directories in the scanned directories are skipped if
+    they are ignored by the IgnoreRules() of the configuration or of the
+    .regfileignore files of the directory and its parents (an ignored
+    directory is not scanned at all) or if their name is one of the ignored
+    names. All the files (including the given ones) are skipped if they do
+    not pass the filters (the size, the modification time and the
+    extension).
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the number of the given paths scanned by one task
+    PATHS_BATCH_SIZE            = 1000
+
+    # the number of the batches of the given paths scheduled ahead of the ones being provided
+    SCHEDULED_BATCHES           = 4
+
+    # the number of the directories' scans scheduled or finished ahead of the ones being provided
+    MAX_SCANS_AHEAD             = 256
+
+    # the scan of a directory not scheduled yet (because of MAX_SCANS_AHEAD)
+    _DeferredScan               = collections.namedtuple("_DeferredScan", ("directory", "ignoreRules",))
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, paths, listedPaths = None, cwd = None, workers = None, ignoreRules = None, ignoredNames = (), recordedNames = (),
+            minSize = None, maxSize = None, minMTime = None, maxMTime = None, extensions = None):
+        # DOC {{{
+        """Initializes the instance and stores the parameters.
+
+        Parameters
+
+            paths -- an iterable of paths of directories, files and wildcards
+
+            listedPaths -- (optional) an iterable of paths of directories and
+                files (taken literally, without wildcards) provided after the
+                paths, it is consumed lazily as the files are provided
+
+            cwd -- (optional) the directory the relative paths are relative
+                to (the current working directory if None)
+
+            workers -- (optional) the number of threads scanning the
+                directories (ThreadPoolExecutor's default if None)
+
+            ignoreRules -- (optional) the IgnoreRules() applied in all the
+                scanned directories (before the .regfileignore files)
+
+            ignoredNames -- (optional) an iterable of names of the files
+                skipped in the scanned directories
+
+            recordedNames -- (optional) an iterable of names of the files
+                whose presence in the scanned directories having any found
+                files is recorded (see popRecordedNames(), the consumer is
+                expected to pop the names of each such directory)
+
+            minSize, maxSize -- (optional) the smallest and the largest size
+                of the files in bytes
+
+            minMTime, maxMTime -- (optional) the earliest and the latest
+                modification time of the files (a timestamp)
+
+            extensions -- (optional) an iterable of the allowed extensions of
+                the files (without the dot, in any case)
+        """
+        # }}}
+
+        # CODE {{{
+        # store the parameters {{{
+        self.paths          = list(paths)
+        self.listedPaths    = listedPaths if (listedPaths is not None) else ()
+        self.cwd            = cwd if (cwd is not None) else os.getcwd()
+        self.workers        = workers
+        self.ignoreRules    = ignoreRules
+        self.ignoredNames   = frozenset(ignoredNames)
+        self.recordedNames  = frozenset(recordedNames)
+        self.minSize        = minSize
+        self.maxSize        = maxSize
+        self.minMTime       = minMTime
+        self.maxMTime       = maxMTime
+        self.extensions     = frozenset(extension.lower().lstrip(".") for extension in extensions) if (extensions is not None) else None
+        # }}}
+
+        # initialize the statistics {{{
+        # the number of the found files and their total size (of every inode just once)
+        self.foundFiles     = 0
+        self.foundBytes     = 0
+
+        # the number of the skipped (ignored or filtered out) files and directories
+        self.skippedEntries = 0
+
+        # True when every directory has been scanned (the statistics are final)
+        self.isComplete     = False
+
+        # a list of paths of directories that could not be scanned
+        self.failedPaths    = []
+        # }}}
+
+        # initialize the internals {{{
+        # a lock guarding the statistics and the inodes updated by the scanning threads
+        self._lock          = threading.Lock()
+
+        # (st_dev, st_ino,) of the found files with hardlinks
+        self._inodes        = set()
+
+        # the number of the scans scheduled (or deferred) but not finished yet
+        self._pendingScans  = 0
+
+        # the number of the directories' scans scheduled or finished whose items have not been provided yet
+        self._scansAhead    = 0
+
+        # sets of the recorded names of the files present in the scanned directories with found files by the directories (until popped)
+        self._recordedNamesByDirectories = dict()
+
+        # tuples of IgnoreRules() applying to the contents of the directories by the directories (see _determineParentIgnoreRules())
+        self._ignoreRulesByDirectories = dict()
+
+        # True when the iteration has been finished or abandoned (the scans still pending are skipped)
+        self._stopped       = False
+        # }}}
+        # }}}
+
+
+    def iterateFiles(self):
+        # DOC {{{
+        """Returns an iterator of the absolute paths of the found files in
+        the order of the given (and listed) paths and os.walk() (top-down)
+        within the directories.
+        """
+        # }}}
+
+        # CODE {{{
+        return (file_ for file_, stat in self.iterateFilesAndStats())
+        # }}}
+
+
+    def iterateFilesAndStats(self):
+        # DOC {{{
+        """Returns an iterator of (file_, stat,) tuples of the absolute paths
+        of the found files and their os.stat_result()s (or None for the files
+        that could not be stat()ed) in the order of iterateFiles().
+        """
+        # }}}
+
+        # CODE {{{
+        executor = ThreadPoolExecutor(max_workers = self.workers)
+        self._stopped = False
+
+        # the scheduling itself counts as a pending scan, so the discovery is not complete before all the paths are scheduled
+        self._pendingScans = 1
+        self._scansAhead = 0
+
+        try:
+            batches = self._iterateBatches()
+            batchFutures = collections.deque()
+            batchesExhausted = False
+
+            while (True):
+                # keep a few batches of the given paths scheduled ahead {{{
+                while ((not batchesExhausted) and (len(batchFutures) < FileDiscovery.SCHEDULED_BATCHES)):
+                    batch = next(batches, None)
+
+                    if (batch is None):
+                        batchesExhausted = True
+                        self._finishScan()
+                    else:
+                        batchFutures.append(self._schedule(executor, self._scanPaths, executor, *batch))
+
+                if (not batchFutures):
+                    break
+                # }}}
+
+                # provide the files of the next batch as the scans finish, a directory is followed by its subdirectories {{{
+                # [items, position of the next item, position of the next item that may be a deferred scan] lists
+                itemLists = [[batchFutures.popleft().result(), 0, 0]]
+                self._scheduleDeferredScans(executor, itemLists)
+
+                while (itemLists):
+                    itemList = itemLists[-1]
+
+                    if (itemList[1] == len(itemList[0])):
+                        itemLists.pop()
+                        continue
+
+                    item = itemList[0][itemList[1]]
+                    itemList[1] = itemList[1] + 1
+
+                    # the provision has caught up with a deferred scan, it is waited for right away
+                    if (isinstance(item, FileDiscovery._DeferredScan)):
+                        with self._lock:
+                            self._scansAhead = self._scansAhead + 1
+
+                        item = self._schedule(executor, self._scanDirectory, executor, *item, isPending = True)
+
+                    if (isinstance(item, Future)):
+                        itemLists.append([item.result(), 0, 0])
+
+                        with self._lock:
+                            self._scansAhead = self._scansAhead - 1
+
+                        self._scheduleDeferredScans(executor, itemLists)
+                    else:
+                        yield item
+                # }}}
+        finally:
+            self._stopped = True
+            executor.shutdown(wait = True, cancel_futures = True)
+        # }}}
+
+
+    def popRecordedNames(self, directory):
+        # DOC {{{
+        """Returns a set of the recorded names of the files present in the
+        scanned directory (and forgets it) or None if the directory has not
+        been scanned, it has no found files or it has been popped already.
+
+        Parameters
+
+            directory -- the path of the directory (as provided with its
+                files)
+        """
+        # }}}
+
+        # CODE {{{
+        return self._recordedNamesByDirectories.pop(directory, None)
+        # }}}
+
+
+    def _iterateBatches(self):
+        # DOC {{{
+        """Returns an iterator of (paths, wildcards,) tuples of the batches of
+        the given paths (with wildcards) and of the listed paths (without
+        them).
+        """
+        # }}}
+
+        # CODE {{{
+        for paths, wildcards in ((iter(self.paths), True,), (iter(self.listedPaths), False,)):
+            while (True):
+                batch = list(itertools.islice(paths, FileDiscovery.PATHS_BATCH_SIZE))
+
+                if (not batch):
+                    break
+
+                yield (batch, wildcards,)
+        # }}}
+
+
+    def _scanPaths(self, executor, paths, wildcards):
+        # DOC {{{
+        """Expands the paths, adds their files (which pass the filters) to
+        the statistics and schedules the scans of their directories.
+
+        Returns a list of the items in the order of the paths: the (file_,
+        stat,) tuples of the files and the futures (or deferred scans) of the
+        directories' scans (see _scanDirectory()).
+
+        Parameters
+
+            executor -- the ThreadPoolExecutor() to schedule the scans to
+
+            paths -- a list of the paths of directories and files
+
+            wildcards -- True if the paths may contain wildcards (expanded by
+                glob), False if they are taken literally
+        """
+        # }}}
+
+        # CODE {{{
+        items = []
+        stats = []
+        skippedEntries = 0
+
+        try:
+            for path in paths:
+                if (self._stopped):
+                    break
+
+                if (wildcards):
+                    path = os.path.expanduser(path)
+
+                if (not os.path.isabs(path)):
+                    path = os.path.normpath(os.path.join(self.cwd, path))
+
+                # a directory is scanned recursively {{{
+                if (os.path.isdir(path)):
+                    items.append(self._scheduleOrDefer(executor, path, self._determineParentIgnoreRules(path)))
+                    continue
+                # }}}
+
+                # a file (or the files matching the wildcard) is taken if it passes the filters {{{
+                for file_ in (glob.iglob(path) if (wildcards) else ((path,) if (os.path.lexists(path)) else ())):
+                    stat = self._stat(file_)
+
+                    if (self._passesFilters(file_, stat)):
+                        items.append((file_, stat,))
+                        stats.append(stat)
+                    else:
+                        skippedEntries = skippedEntries + 1
+                # }}}
+        except RuntimeError:
+            # the executor has been shut down
+            pass
+
+        self._addStats(stats, skippedEntries)
+        self._finishScan()
+
+        return items
+        # }}}
+
+
+    def _scanDirectory(self, executor, directory, ignoreRules):
+        # DOC {{{
+        """Scans the directory, adds its files (which are not skipped) to the
+        statistics and schedules the scans of its subdirectories (which are
+        not ignored).
+
+        Returns a list of the items: the (file_, stat,) tuples of the files
+        followed by the futures (or deferred scans) of the subdirectories'
+        scans.
+
+        Parameters
+
+            executor -- the ThreadPoolExecutor() to schedule the scans to
+
+            directory -- the path of the directory
+
+            ignoreRules -- a tuple of IgnoreRules() applying to the directory
+                (of the configuration and of its parents in this order)
+        """
+        # }}}
+
+        # CODE {{{
+        files = []
+        subdirectoryFutures = []
+
+        if (self._stopped):
+            self._finishScan()
+            return files
+
+        # read the entries and the rules of the directory {{{
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            entries = []
+
+            with self._lock:
+                self.failedPaths.append(directory)
+
+        for entry in entries:
+            if ((entry.name == IgnoreRules.FILE_NAME) and (entry.is_file())):
+                directoryIgnoreRules = IgnoreRules.fromFile(entry.path)
+
+                if (directoryIgnoreRules is not None):
+                    ignoreRules = ignoreRules + (directoryIgnoreRules,)
+
+        # }}}
+
+        # sort the entries to files and subdirectories (the symbolic links to directories and the skipped entries are left out) {{{
+        subdirectories = []
+        stats = []
+        skippedEntries = 0
+
+        for entry in entries:
+            isDirectory = entry.is_dir()
+
+            if (isDirectory and entry.is_symlink()):
+                continue
+
+            if (((not isDirectory) and (entry.name in self.ignoredNames)) or (self._isIgnored(ignoreRules, entry.path, isDirectory))):
+                skippedEntries = skippedEntries + 1
+                continue
+
+            if (isDirectory):
+                subdirectories.append(entry.path)
+            else:
+                stat = self._stat(entry)
+
+                if (not self._passesFilters(entry.path, stat)):
+                    skippedEntries = skippedEntries + 1
+                    continue
+
+                files.append((entry.path, stat,))
+                stats.append(stat)
+        # }}}
+
+        # record the names only for a directory with files, their consumer pops them with its first file {{{
+        if ((self.recordedNames) and (files)):
+            self._recordedNamesByDirectories[directory] = frozenset(
+                    entry.name for entry in entries if ((entry.name in self.recordedNames) and (entry.is_file())))
+        # }}}
+
+        self._addStats(stats, skippedEntries)
+
+        # schedule (or defer) the scans of the subdirectories (unless the iteration has been stopped) {{{
+        try:
+            for subdirectory in subdirectories:
+                subdirectoryFutures.append(self._scheduleOrDefer(executor, subdirectory, ignoreRules))
+        except RuntimeError:
+            # the executor has been shut down
+            pass
+        # }}}
+
+        self._finishScan()
+
+        return files + subdirectoryFutures
+        # }}}
+
+
+    def _schedule(self, executor, scan, *args, isPending = False):
+        # DOC {{{
+        """Schedules the scan to the executor and counts it as pending.
+
+        Returns the future of the scan or raises RuntimeError() if the
+        executor has been shut down.
+
+        Parameters
+
+            executor -- the ThreadPoolExecutor() to schedule the scan to
+
+            scan -- the scanning method (_scanDirectory() or _scanPaths())
+
+            args -- the arguments of the scanning method
+
+            isPending -- (optional) True if the scan has been counted as
+                pending already (when it was deferred)
+        """
+        # }}}
+
+        # CODE {{{
+        if (not isPending):
+            with self._lock:
+                self._pendingScans = self._pendingScans + 1
+
+        try:
+            return executor.submit(scan, *args)
+        except RuntimeError:
+            with self._lock:
+                self._pendingScans = self._pendingScans - 1
+            raise
+        # }}}
+
+
+    def _scheduleOrDefer(self, executor, directory, ignoreRules):
+        # DOC {{{
+        """Schedules the scan of the directory if fewer than MAX_SCANS_AHEAD
+        scans are ahead of the provision, defers it otherwise (it is counted
+        as pending in both cases).
+
+        Returns the future of the scan or a _DeferredScan() or raises
+        RuntimeError() if the executor has been shut down.
+
+        Parameters
+
+            executor -- the ThreadPoolExecutor() to schedule the scan to
+
+            directory -- the path of the directory
+
+            ignoreRules -- a tuple of IgnoreRules() applying to the directory
+        """
+        # }}}
+
+        # CODE {{{
+        with self._lock:
+            self._pendingScans = self._pendingScans + 1
+
+            if (self._scansAhead >= FileDiscovery.MAX_SCANS_AHEAD):
+                return FileDiscovery._DeferredScan(directory, ignoreRules)
+
+            self._scansAhead = self._scansAhead + 1
+
+        return self._schedule(executor, self._scanDirectory, executor, directory, ignoreRules, isPending = True)
+        # }}}
+
+
+    def _scheduleDeferredScans(self, executor, itemLists):
+        # DOC {{{
+        """Schedules the deferred scans in the lists of items being provided
+        (the nearest to the provision first) while fewer than
+        MAX_SCANS_AHEAD scans are ahead of it.
+
+        Parameters
+
+            executor -- the ThreadPoolExecutor() to schedule the scans to
+
+            itemLists -- a list of [items, position, deferredPosition] lists
+                (see iterateFilesAndStats()), the items before the
+                deferredPosition are not deferred scans (it is advanced)
+        """
+        # }}}
+
+        # CODE {{{
+        for itemList in reversed(itemLists):
+            items = itemList[0]
+            position = max(itemList[1], itemList[2])
+
+            while (position < len(items)):
+                if (isinstance(items[position], FileDiscovery._DeferredScan)):
+                    with self._lock:
+                        if (self._scansAhead >= FileDiscovery.MAX_SCANS_AHEAD):
+                            itemList[2] = position
+                            return
+
+                        self._scansAhead = self._scansAhead + 1
+
+                    items[position] = self._schedule(executor, self._scanDirectory, executor, *items[position], isPending = True)
+
+                position = position + 1
+
+            itemList[2] = position
+        # }}}
+
+
+    def _finishScan(self):
+        # DOC {{{
+        """Counts a scan as finished, the discovery is complete when the last
+        pending scan finishes.
+        """
+        # }}}
+
+        # CODE {{{
+        with self._lock:
+            self._pendingScans = self._pendingScans - 1
+
+            if ((self._pendingScans == 0) and (not self._stopped)):
+                self.isComplete = True
+        # }}}
+
+
+    def _determineParentIgnoreRules(self, directory):
+        # DOC {{{
+        """Returns a tuple of IgnoreRules() applying to the directory: of the
+        configuration and of the .regfileignore files of its parents (from the
+        root of the file system). The rules of the parents are cached.
+
+        Parameters
+
+            directory -- the absolute path of the directory
+        """
+        # }}}
+
+        # CODE {{{
+        parent = os.path.dirname(directory)
+
+        # the root has only the rules of the configuration {{{
+        if (parent == directory):
+            return (self.ignoreRules,) if (self.ignoreRules is not None) else ()
+        # }}}
+
+        # the rules of the parent's content are the parent's rules and the rules of its .regfileignore file {{{
+        ignoreRules = self._ignoreRulesByDirectories.get(parent)
+
+        if (ignoreRules is None):
+            ignoreRules = self._determineParentIgnoreRules(parent)
+            parentIgnoreRules = IgnoreRules.fromFile(os.path.join(parent, IgnoreRules.FILE_NAME))
+
+            if (parentIgnoreRules is not None):
+                ignoreRules = ignoreRules + (parentIgnoreRules,)
+
+            self._ignoreRulesByDirectories[parent] = ignoreRules
+        # }}}
+
+        return ignoreRules
+        # }}}
+
+
+    @staticmethod
+    def _isIgnored(ignoreRules, path, isDirectory):
+        # DOC {{{
+        """Returns True if the path is ignored by the rules (the last
+        matching rule decides), False otherwise.
+
+        Parameters
+
+            ignoreRules -- a tuple of IgnoreRules() applying to the path (the
+                most specific last)
+
+            path -- the absolute path of the file or directory
+
+            isDirectory -- True if the path is a directory
+        """
+        # }}}
+
+        # CODE {{{
+        for rules in reversed(ignoreRules):
+            ignored = rules.match(path, isDirectory)
+
+            if (ignored is not None):
+                return ignored
+
+        return False
+        # }}}
+
+
+    def _passesFilters(self, path, stat):
+        # DOC {{{
+        """Returns True if the file passes the filters (the size, the
+        modification time and the extension), False otherwise. A file that
+        could not be stat()ed passes the size and time filters.
+
+        Parameters
+
+            path -- the path of the file
+
+            stat -- the os.stat_result() of the file (or None)
+        """
+        # }}}
+
+        # CODE {{{
+        if ((self.extensions is not None) and (os.path.splitext(path)[1][1:].lower() not in self.extensions)):
+            return False
+
+        if (stat is None):
+            return True
+
+        return not (
+                ((self.minSize is not None) and (stat.st_size < self.minSize)) or
+                ((self.maxSize is not None) and (stat.st_size > self.maxSize)) or
+                ((self.minMTime is not None) and (stat.st_mtime < self.minMTime)) or
+                ((self.maxMTime is not None) and (stat.st_mtime > self.maxMTime))
+        )
+        # }}}
+
+
+    def _addStats(self, stats, skippedEntries = 0):
+        # DOC {{{
+        """Adds the files to the statistics, the size of a file with
+        hardlinks is added only for the first of them.
+
+        Parameters
+
+            stats -- a list of os.stat_result()s (or None for the files that
+                could not be stat()ed)
+
+            skippedEntries -- (optional) the number of the skipped files and
+                directories
+        """
+        # }}}
+
+        # CODE {{{
+        with self._lock:
+            self.skippedEntries = self.skippedEntries + skippedEntries
+
+            for stat in stats:
+                self.foundFiles = self.foundFiles + 1
+
+                if (stat is None):
+                    continue
+
+                if (stat.st_nlink > 1):
+                    if ((stat.st_dev, stat.st_ino,) in self._inodes):
+                        continue
+
+                    self._inodes.add((stat.st_dev, stat.st_ino,))
+
+                self.foundBytes = self.foundBytes + stat.st_size
+        # }}}
+
+
+    @staticmethod
+    def _stat(file_):
+        # DOC {{{
+        """Returns the os.stat_result() of the file (following symbolic
+        links) or None if it could not be stat()ed.
+
+        Parameters
+
+            file_ -- an os.DirEntry() or a path of the file
+        """
+        # }}}
+
+        # CODE {{{
+        try:
+            if (isinstance(file_, os.DirEntry)):
+                return file_.stat()
+
+            return os.stat(file_)
+        except OSError:
+            return None
+        # }}}
+
+
+    # }}}
+# }}}
@@ -0,0 +1,234 @@
+##
+## IgnoreRules.py
+##      - Gitignore-style rules telling which files and directories are
+##        ignored when the files to process are discovered (see
+##        FileDiscovery).
+##
+
+
+# import of required modules {{{
+import os
+import re
+# }}}
+
+
+# class IgnoreRules() {{{
+class IgnoreRules(object):
+    # DOC {{{
+    """Gitignore-style rules of one .regfileignore file (or of the
+    configuration) telling which files and directories are ignored.
+
+    The rules are one pattern per line:
+
+        * empty lines and lines starting with '#' are skipped (use '\\#'
+          for a pattern starting with '#')
+
+        * '!' at the start negates the pattern, a path ignored by a previous
+          rule (of this or a parent directory) is not ignored if it matches
+          (use '\\!' for a pattern starting with '!')
+
+        * '/' at the end matches only directories
+
+        * a pattern containing '/' (other than at the end) is relative to the
+          directory of the rules, otherwise it matches the name in any depth
+
+        * '*' matches anything but '/', '?' any character but '/', '[...]' a
+          character of the range and '**' (a whole path component) anything
+          including '/'
+
+    The last matching rule decides, the rules of a directory are applied
+    after the rules of its parent. A content of an ignored directory is never
+    scanned, so it cannot be re-included by a negated pattern.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the name of the file with the rules of its directory (and subdirectories)
+    FILE_NAME                   = ".regfileignore"
+    # }}}
+
+
+    # METHODS {{{
+    @staticmethod
+    def fromFile(path):
+        # DOC {{{
+        """Returns IgnoreRules() read from the file relative to its directory
+        or None if the file could not be read.
+
+        Parameters
+
+            path -- the path of the .regfileignore file
+        """
+        # }}}
+
+        # CODE {{{
+        try:
+            with open(path, "r") as file_:
+                return IgnoreRules(os.path.dirname(path), file_.read().split("\n"))
+        except (OSError, UnicodeDecodeError):
+            return None
+        # }}}
+
+
+    @staticmethod
+    def fromConfig(ignoreConfig):
+        # DOC {{{
+        """Returns IgnoreRules() from the configuration (the patterns
+        containing '/' are relative to the root of the file system) or None if
+        there are no rules.
+
+        Parameters
+
+            ignoreConfig -- the value of the configuration option (one
+                pattern per line)
+        """
+        # }}}
+
+        # CODE {{{
+        ignoreRules = IgnoreRules(os.sep, ignoreConfig.split("\n"))
+
+        return ignoreRules if (ignoreRules.rules) else None
+        # }}}
+
+
+    def __init__(self, directory, lines):
+        # DOC {{{
+        """Initializes the instance and compiles the rules.
+
+        Raises ValueError() if a pattern could not be compiled.
+
+        Parameters
+
+            directory -- the absolute path of the directory the rules are
+                relative to
+
+            lines -- an iterable of the lines with the patterns
+        """
+        # }}}
+
+        # CODE {{{
+        # the prefix of the paths the rules apply to (the directory with the separator)
+        self.prefix = directory.rstrip(os.sep) + os.sep
+
+        # a list of (regularExpression, negated, directoryOnly,) tuples
+        self.rules = []
+
+        for line in lines:
+            rule = IgnoreRules._compileRule(line)
+
+            if (rule is not None):
+                self.rules.append(rule)
+        # }}}
+
+
+    def match(self, path, isDirectory):
+        # DOC {{{
+        """Returns True if the path is ignored by the rules, False if it is
+        explicitly not ignored (by a negated pattern) or None if no rule
+        matches it.
+
+        Parameters
+
+            path -- the absolute path of the file or directory (in the
+                directory of the rules)
+
+            isDirectory -- True if the path is a directory
+        """
+        # }}}
+
+        # CODE {{{
+        if (not path.startswith(self.prefix)):
+            return None
+
+        relativePath = path[len(self.prefix):]
+
+        for regularExpression, negated, directoryOnly in reversed(self.rules):
+            if ((isDirectory or (not directoryOnly)) and (regularExpression.fullmatch(relativePath))):
+                return (not negated)
+
+        return None
+        # }}}
+
+
+    @staticmethod
+    def _compileRule(line):
+        # DOC {{{
+        """Returns a (regularExpression, negated, directoryOnly,) tuple of
+        the line or None if the line has no pattern.
+
+        Parameters
+
+            line -- the line with the pattern
+        """
+        # }}}
+
+        # CODE {{{
+        # skip the empty lines and comments, determine the negation and the directory only flag {{{
+        pattern = line.rstrip("\r").rstrip(" ")
+
+        if ((not pattern) or (pattern.startswith("#"))):
+            return None
+
+        negated = pattern.startswith("!")
+
+        if (negated):
+            pattern = pattern[1:]
+        elif (pattern.startswith("\\#") or pattern.startswith("\\!")):
+            pattern = pattern[1:]
+
+        directoryOnly = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        if (not pattern):
+            return None
+        # }}}
+
+        # a pattern with '/' is relative to the directory of the rules, otherwise it matches in any depth {{{
+        anchored = ("/" in pattern)
+        pattern = pattern.lstrip("/")
+        # }}}
+
+        # translate the pattern to a regular expression {{{
+        regularExpression = "" if (anchored) else "(?:.*/)?"
+        ii = 0
+
+        while (ii < len(pattern)):
+            if (pattern.startswith("**/", ii) and ((ii == 0) or (pattern[ii - 1] == "/"))):
+                regularExpression = regularExpression + "(?:.*/)?"
+                ii = ii + 3
+            elif (pattern.startswith("**", ii) and ((ii == 0) or (pattern[ii - 1] == "/")) and (ii + 2 == len(pattern))):
+                regularExpression = regularExpression + ".*"
+                ii = ii + 2
+            elif (pattern[ii] == "*"):
+                regularExpression = regularExpression + "[^/]*"
+                ii = ii + 1
+            elif (pattern[ii] == "?"):
+                regularExpression = regularExpression + "[^/]"
+                ii = ii + 1
+            elif ((pattern[ii] == "[") and ("]" in pattern[ii + 2:])):
+                end = pattern.index("]", ii + 2)
+                characters = pattern[ii + 1:end]
+
+                if (characters.startswith("!")):
+                    characters = "^" + characters[1:]
+
+                regularExpression = regularExpression + "[" + characters.replace("\\", "\\\\") + "]"
+                ii = end + 1
+            elif ((pattern[ii] == "\\") and (ii + 1 < len(pattern))):
+                regularExpression = regularExpression + re.escape(pattern[ii + 1])
+                ii = ii + 2
+            else:
+                regularExpression = regularExpression + re.escape(pattern[ii])
+                ii = ii + 1
+        # }}}
+
+        try:
+            return (re.compile(regularExpression, re.DOTALL), negated, directoryOnly,)
+        except re.error as error:
+            raise ValueError("The ignore pattern '{}' is not valid: {}".format(line, error))
+        # }}}
+
+
+    # }}}
+# }}}
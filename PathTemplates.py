@@ -35,11 +35,24 @@
 class PathTemplates(object):
     # DOC {{{
     """Allows to determine groups and comments from the filename.
+
+    The patterns of the templates are combined into one regular expression
+    (an ordered alternation) that finds the first matching template in one
+    pass, so the templates before it are not tried one by one and a
+    filename no template matches is rejected at once. The combined
+    expression is not used (every template is tried) if a pattern refers to
+    its own groups or the patterns cannot be combined (e.g. they use global
+    flags or the same group names).
     """
     # }}}
 
 
     # STATIC VARIABLES {{{
+    # the name of the group of the combined expression wrapping the pattern of the template with the index
+    _COMBINED_GROUP_NAME        = "_pathTemplate{}"
+
+    # a compiled regular expression finding references to groups in a pattern (which change their meaning when combined)
+    _GROUP_REFERENCE_RE         = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
     # }}}
 
 
@@ -53,6 +66,10 @@ def fromConfig(pathTemplatesConfig):
         pathTemplates = PathTemplates();
 
         for pathTemplateConfig in pathTemplatesConfig.split("\n"):
+            # skip empty lines (and an empty configuration)
+            if (not pathTemplateConfig.strip()):
+                continue
+
             pathTemplates.append(PathTemplate.fromConfig(pathTemplateConfig))
 
         return pathTemplates
@@ -65,6 +82,9 @@ def __init__(self):
 
         # CODE {{{
         self.pathTemplates = []
+
+        # (pathTemplates, combinedPattern,) tuples of the templates applicable during the import (True) or otherwise (False)
+        self._combinedPatterns = dict()
         # }}}
 
 
@@ -74,6 +94,7 @@ def append(self, pathTemplate):
 
         # CODE {{{
         self.pathTemplates.append(pathTemplate)
+        self._combinedPatterns.clear()
         # }}}
 
 
@@ -87,8 +108,20 @@ def apply(self, fullFilename, argumentGroup, argumentComment, defaultGroup, defa
         templatesComments = []
         # }}}
 
+        # skip the templates before the first matching one (all of them if none matches) using the combined pattern {{{
+        pathTemplates, combinedPattern = self._determineCombinedPattern(import_)
+
+        if (combinedPattern is not None):
+            res = combinedPattern.match(fullFilename)
+
+            if (res is None):
+                pathTemplates = []
+            else:
+                pathTemplates = pathTemplates[int(res.lastgroup[len(PathTemplates._COMBINED_GROUP_NAME.format("")):]):]
+        # }}}
+
         # try to match and apply each template {{{
-        for pathTemplate in self.pathTemplates:
+        for pathTemplate in pathTemplates:
             # try to match and apply the current template
             (matched, templateGroup, templateComment,) = pathTemplate.apply(fullFilename, import_)
 
@@ -125,6 +158,63 @@ def apply(self, fullFilename, argumentGroup, argumentComment, defaultGroup, defa
         # }}}
 
 
+    def _determineCombinedPattern(self, import_):
+        # DOC {{{
+        """Returns a (pathTemplates, combinedPattern,) tuple of a list of the
+        templates applicable during the import (or otherwise) and the compiled
+        combined pattern of them or None if it cannot be used. The combined
+        pattern matches the filename if any template does and its last group
+        is the one of the first matching template.
+
+        Parameters
+
+            import_ -- whether or not the file is being imported or not
+        """
+        # }}}
+
+        # CODE {{{
+        if (import_ in self._combinedPatterns):
+            return self._combinedPatterns[import_]
+
+        # the templates applicable during the import (or otherwise) {{{
+        pathTemplates = [
+                pathTemplate
+                for pathTemplate in self.pathTemplates if (import_ or (not pathTemplate.options[PathTemplate.IMPORT_OPTION]))
+        ]
+        # }}}
+
+        # combine the patterns (searched ones prefixed by anything) to an ordered alternation of groups named by the indexes {{{
+        patterns = []
+
+        for ii, pathTemplate in enumerate(pathTemplates):
+            pattern = pathTemplate.pattern.pattern
+
+            if ((not isinstance(pattern, str)) or (pathTemplate.pattern.flags != re.UNICODE) or (PathTemplates._GROUP_REFERENCE_RE.search(pattern))):
+                patterns = None
+                break
+
+            if (pathTemplate.options[PathTemplate.SEARCH_OPTION]):
+                pattern = "(?s:.*?)(?:" + pattern + ")"
+
+            patterns.append("(?P<" + PathTemplates._COMBINED_GROUP_NAME.format(ii) + ">" + pattern + ")")
+        # }}}
+
+        # compile the combined pattern (if possible) {{{
+        combinedPattern = None
+
+        if (patterns):
+            try:
+                combinedPattern = re.compile("|".join(patterns))
+            except re.error:
+                pass
+        # }}}
+
+        self._combinedPatterns[import_] = (pathTemplates, combinedPattern,)
+
+        return self._combinedPatterns[import_]
+        # }}}
+
+
     # }}}
 # }}}
 
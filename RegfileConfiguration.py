@@ -63,18 +63,113 @@ class RegfileConfiguration(ConfigurationBase):
     )
     # }}}
 
+    # SQLite journal mode option {{{
+    JOURNAL_MODE = _RegfileConfigurationOption(
+            name                        = 'journalmode',
+            defaultValue                = RegfileConstants.JOURNAL_MODE_WAL,
+            sanitizeAndCheckFunction    = lambda option, value : ConfigurationUtils.stripSpacesMakeLowerCaseAndCheckSupport(
+                option          = option,
+                value           = value,
+                supportedValues = RegfileConstants.SUPPORTED_JOURNAL_MODE_VALUES,
+            ),
+    )
+    # }}}
+
+    # SQLite busy timeout (in milliseconds) option {{{
+    BUSY_TIMEOUT = _RegfileConfigurationOption(
+            name                        = 'busytimeout',
+            defaultValue                = '5000',
+            sanitizeAndCheckFunction    = lambda option, value: str(ConfigurationUtils.checkPositiveIntegerValue(option, value)),
+    )
+    # }}}
+
+    # the number of retries of a write to a database locked by another process option {{{
+    BUSY_RETRIES = _RegfileConfigurationOption(
+            name                        = 'busyretries',
+            defaultValue                = '5',
+            sanitizeAndCheckFunction    = lambda option, value: str(ConfigurationUtils.checkPositiveIntegerValue(option, value)),
+    )
+    # }}}
+
+    # SQLite page cache size (in KiB) for bulk operations option {{{
+    BULK_CACHE_SIZE = _RegfileConfigurationOption(
+            name                        = 'bulkcachesize',
+            defaultValue                = '262144',
+            sanitizeAndCheckFunction    = lambda option, value: str(ConfigurationUtils.checkPositiveIntegerValue(option, value)),
+    )
+    # }}}
+
+    # SQLite memory map size (in bytes) for read heavy operations option {{{
+    MMAP_SIZE = _RegfileConfigurationOption(
+            name                        = 'mmapsize',
+            defaultValue                = '268435456',
+            sanitizeAndCheckFunction    = lambda option, value: str(ConfigurationUtils.checkPositiveIntegerValue(option, value)),
+    )
+    # }}}
+
+    # full text search index option {{{
+    SEARCH_INDEX = _RegfileConfigurationOption(
+            name                        = 'searchindex',
+            defaultValue                = RegfileConstants.SEARCH_INDEX_YES,
+            sanitizeAndCheckFunction    = lambda option, value : ConfigurationUtils.stripSpacesMakeLowerCaseAndCheckSupport(
+                option          = option,
+                value           = value,
+                supportedValues = RegfileConstants.SUPPORTED_SEARCH_INDEX_VALUES,
+            ),
+    )
+    # }}}
+
+    # storage backend option {{{
+    BACKEND = _RegfileConfigurationOption(
+            name                        = 'backend',
+            defaultValue                = RegfileConstants.BACKEND_SQLALCHEMY,
+            sanitizeAndCheckFunction    = lambda option, value : ConfigurationUtils.stripSpacesMakeLowerCaseAndCheckSupport(
+                option          = option,
+                value           = value,
+                supportedValues = RegfileConstants.SUPPORTED_BACKEND_VALUES,
+            ),
+    )
+    # }}}
+
+    # Bloom filter option {{{
+    BLOOM_FILTER = _RegfileConfigurationOption(
+            name                        = 'bloomfilter',
+            defaultValue                = RegfileConstants.BLOOM_FILTER_YES,
+            sanitizeAndCheckFunction    = lambda option, value : ConfigurationUtils.stripSpacesMakeLowerCaseAndCheckSupport(
+                option          = option,
+                value           = value,
+                supportedValues = RegfileConstants.SUPPORTED_BLOOM_FILTER_VALUES,
+            ),
+    )
+    # }}}
+
     # path templates option {{{
     PATH_TEMPLATES = _RegfileConfigurationOption(
             name                        = 'pathtemplates',
     )
     # }}}
 
+    # ignore rules option {{{
+    IGNORE = _RegfileConfigurationOption(
+            name                        = 'ignore',
+    )
+    # }}}
+
     # a tuple of all general configuration options {{{
     GENERAL_CONFIGURATION_OPTIONS = (
             DB,
             LOG,
             PATH_TEMPLATES,
+            IGNORE,
             COMMIT,
+            JOURNAL_MODE,
+            BUSY_TIMEOUT,
+            BUSY_RETRIES,
+            BULK_CACHE_SIZE,
+            MMAP_SIZE,
+            SEARCH_INDEX,
+            BACKEND,
+            BLOOM_FILTER,
     )
     # }}}
     # }}}
@@ -100,11 +195,56 @@ def __init__(self, configurationPath = DEFAULT_PATH):
         super().__init__(
                 *RegfileConfiguration.GENERAL_CONFIGURATION_OPTIONS,
                 configurationPath   = configurationPath,
-                restrictions        = (ConfigurationBase.RESTRICT_SURPLUS | ConfigurationBase.RESTRICT_MISSING),
+                restrictions        = ConfigurationBase.RESTRICT_SURPLUS,
         )
         # }}}
         # }}}
 
 
+    def determineSQLitePragmas(self, profile):
+        # DOC {{{
+        """Returns a tuple of (pragma, value,) tuples to set up a SQLite
+        connection of the specified profile.
+
+        Parameters
+
+            profile -- one of RegfileConstants.DB_PROFILE_XXX
+        """
+        # }}}
+
+        # CODE {{{
+        # the synchronous mode: bulk doesn't wait for the disk, the others sync the commits (WAL just at checkpoints) {{{
+        if (profile == RegfileConstants.DB_PROFILE_BULK):
+            synchronous = 'OFF'
+        elif (self[RegfileConfiguration.JOURNAL_MODE] == RegfileConstants.JOURNAL_MODE_WAL):
+            synchronous = 'NORMAL'
+        else:
+            synchronous = 'FULL'
+        # }}}
+
+        # the settings of all profiles {{{
+        pragmas = [
+                ('journal_mode',    self[RegfileConfiguration.JOURNAL_MODE]),
+                ('busy_timeout',    self[RegfileConfiguration.BUSY_TIMEOUT]),
+                ('synchronous',     synchronous),
+        ]
+        # }}}
+
+        # bulk - use a large cache and keep temporary data in memory {{{
+        if (profile == RegfileConstants.DB_PROFILE_BULK):
+            pragmas.extend((
+                    ('cache_size',      '-' + self[RegfileConfiguration.BULK_CACHE_SIZE]),
+                    ('temp_store',      'MEMORY'),
+            ))
+        # }}}
+        # read - memory map the database {{{
+        elif (profile == RegfileConstants.DB_PROFILE_READ):
+            pragmas.append(('mmap_size', self[RegfileConfiguration.MMAP_SIZE]))
+        # }}}
+
+        return tuple(pragmas)
+        # }}}
+
+
     # }}}
 # }}}
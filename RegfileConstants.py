@@ -34,5 +34,76 @@ class RegfileConstants(object):
             COMMIT_PROBLEM,
     )
     # }}}
+
+    # journal mode values {{{
+    # wal - write ahead log, readers do not block the writer and vice versa
+    JOURNAL_MODE_WAL        = "wal"
+
+    # delete - rollback journal deleted after each transaction (SQLite's default)
+    JOURNAL_MODE_DELETE     = "delete"
+    # }}}
+
+    # a tuple of all supported values of journal mode {{{
+    SUPPORTED_JOURNAL_MODE_VALUES = (
+            JOURNAL_MODE_WAL,
+            JOURNAL_MODE_DELETE,
+    )
+    # }}}
+
+    # search index values {{{
+    # yes - maintain and use the full text search index of names, groups and comments
+    SEARCH_INDEX_YES        = "yes"
+
+    # no - query the names, groups and comments without an index
+    SEARCH_INDEX_NO         = "no"
+    # }}}
+
+    # a tuple of all supported values of search index {{{
+    SUPPORTED_SEARCH_INDEX_VALUES = (
+            SEARCH_INDEX_YES,
+            SEARCH_INDEX_NO,
+    )
+    # }}}
+
+    # storage backend values {{{
+    # sqlalchemy - the SQLAlchemy ORM (the reference implementation)
+    BACKEND_SQLALCHEMY      = "sqlalchemy"
+
+    # sqlite3 - the sqlite3 connection directly for matching, registering and updating the files
+    BACKEND_SQLITE3         = "sqlite3"
+    # }}}
+
+    # a tuple of all supported values of backend {{{
+    SUPPORTED_BACKEND_VALUES = (
+            BACKEND_SQLALCHEMY,
+            BACKEND_SQLITE3,
+    )
+    # }}}
+
+    # Bloom filter values {{{
+    # yes - maintain and use the Bloom filter of the registered contents next to the database
+    BLOOM_FILTER_YES        = "yes"
+
+    # no - look every file up in the database
+    BLOOM_FILTER_NO         = "no"
+    # }}}
+
+    # a tuple of all supported values of Bloom filter {{{
+    SUPPORTED_BLOOM_FILTER_VALUES = (
+            BLOOM_FILTER_YES,
+            BLOOM_FILTER_NO,
+    )
+    # }}}
+
+    # database connection profiles {{{
+    # default - safe settings for registering and updating
+    DB_PROFILE_DEFAULT      = "default"
+
+    # bulk - fast unsafe settings for rebuilding and importing
+    DB_PROFILE_BULK         = "bulk"
+
+    # read - settings for read heavy operations (queries and checks)
+    DB_PROFILE_READ         = "read"
+    # }}}
     # }}}
 # }}}
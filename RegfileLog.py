@@ -0,0 +1,791 @@
+##
+## RegfileLog.py
+##      - Reads, writes and formats regfile's log. The log records every
+##        change of the database and therefore doubles as its backup. A sparse
+##        sidecar index maps the times the log has been opened to byte offsets
+##        in the log.
+##
+
+
+# import of required modules {{{
+import bisect
+import contextlib
+import datetime
+import hashlib
+import heapq
+import os
+import re
+import tempfile
+
+# advisory file locks are available on POSIX systems only {{{
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+# }}}
+# }}}
+
+
+# class RegfileLog() {{{
+class RegfileLog(object):
+    # DOC {{{
+    """Reads, writes and formats regfile's log. The log records every change
+    of the database and therefore doubles as its backup.
+
+    Every time the log is opened for writing a COMMENT line with the current
+    time (ctime) is written first. The lines that follow (a segment) are
+    considered to be logged at that time. The index (the log path with the
+    INDEX_SUFFIX) holds a line "<ISO time> <offset>" for every segment, so
+    the segments of a time range can be found without scanning the log.
+
+    Several processes may append to the log at once. Every group of lines is
+    written under an exclusive advisory lock of the log and a new segment is
+    started if another process has appended to the log since the last group.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # line prefixes {{{
+    # a comment (e.g. the time the log has been opened)
+    COMMENT         = "# "
+
+    # a newly registered DBFile()
+    ADD             = "+  "
+
+    # a requested update of a DBFile() (not replayed)
+    UPDATE          = "!  "
+
+    # an updated DBFile() as it has been stored in the database
+    UPDATED         = "!! "
+    # }}}
+
+    # the format string of a DBFile() in the log {{{
+    DBFILE_FORMAT   = (
+            "DBF{fileId:06d}|n:{fileName}|" +
+            "g:{group}|c:{comment}|s:{fileSize}|" +
+            "md1:{md1}|md5:{md5}|ed2k:{ed2k}|"
+    )
+    # }}}
+
+    # the suffix of the time index file path
+    INDEX_SUFFIX    = ".idx"
+
+    # the number of the updates sorted in the memory at once (see iterateFinalDBFiles())
+    UPDATES_CHUNK_SIZE = 100000
+
+    # the format of the time in the COMMENT line opening a segment
+    TIME_FORMAT     = "%a %b %d %H:%M:%S %Y"
+
+    # regular expression to parse a DBFile() in the log {{{
+    DBFILE_RE       = re.compile(
+            r"^DBF(?P<fileId>\d*)\|" +
+            r"n:(?P<fileName>.*)\|" +
+            r"g:(?P<group>.*)\|" +
+            r"c:(?P<comment>.*)\|" +
+            r"s:(?P<fileSize>\d*)\|" +
+            r"md1:(?P<md1>.*)\|" +
+            r"md5:(?P<md5>.*)\|" +
+            r"ed2k:(?P<ed2k>.*)\|$"
+    )
+    # }}}
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, logFilePath):
+        # DOC {{{
+        """Initializes the instance, stores the parameters.
+
+        Parameters
+
+            logFilePath -- path of the log file
+        """
+        # }}}
+
+        # CODE {{{
+        # expand '~' to the home directory of the current user in the log path
+        self.logFilePath    = os.path.expanduser(logFilePath)
+
+        # the path of the time index
+        self.indexFilePath  = self.logFilePath + RegfileLog.INDEX_SUFFIX
+
+        # the log file opened for appending (opened on the first write)
+        self._logFile       = None
+
+        # the offset of the end of the last group written by this instance
+        self._endOffset     = None
+        # }}}
+
+
+    @staticmethod
+    def formatLines(prefix, dbFiles):
+        # DOC {{{
+        """Returns a list of log lines (without the new line character) of
+        the specified DBFile()s with the specified prefix.
+
+        Parameters
+
+            prefix -- a line prefix (ADD, UPDATE, UPDATED)
+
+            dbFiles -- an iterable of DBFile()s
+        """
+        # }}}
+
+        # CODE {{{
+        return [prefix + RegfileLog.formatDBFile(dbFile) for dbFile in dbFiles]
+        # }}}
+
+
+    def writeGroup(self, lines):
+        # DOC {{{
+        """Appends the lines to the log as one group: they are written at
+        once and the log is synced to the disk before returning. Write the
+        group of a database transaction before committing it, so a committed
+        change is never missing in the log.
+
+        The log is opened on the first write. A new segment is started on
+        the first write and whenever another process has appended to the log
+        since the last group, by writing the current time as a COMMENT and
+        by adding the segment to the time index.
+
+        Parameters
+
+            lines -- a list of lines to log (without the new line character)
+        """
+        # }}}
+
+        # CODE {{{
+        # return if there is nothing to write {{{
+        if (not lines):
+            return
+        # }}}
+
+        # open the log if it is not open yet {{{
+        if (self._logFile is None):
+            logFileCreated = (not os.path.exists(self.logFilePath))
+
+            self._logFile = open(self.logFilePath, "a")
+
+            # sync the directory so the new log itself survives a crash {{{
+            if ((logFileCreated) and (hasattr(os, "O_DIRECTORY"))):
+                directoryDescriptor = os.open(os.path.dirname(os.path.abspath(self.logFilePath)), os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(directoryDescriptor)
+                finally:
+                    os.close(directoryDescriptor)
+            # }}}
+        # }}}
+
+        # lock the log for this process {{{
+        if (fcntl is not None):
+            fcntl.flock(self._logFile.fileno(), fcntl.LOCK_EX)
+        # }}}
+
+        try:
+            # index the existing log first if there is no index yet {{{
+            if (not os.path.exists(self.indexFilePath)):
+                self.loadIndex()
+            # }}}
+
+            # the lines (and the segment start) to write at once
+            group = []
+
+            # the index line of a newly started segment
+            indexLine = None
+
+            # start a new segment if this is the first group or another process has appended since the last one {{{
+            self._logFile.seek(0, os.SEEK_END)
+
+            if (self._logFile.tell() != self._endOffset):
+                segmentTime     = datetime.datetime.now().replace(microsecond = 0)
+                segmentOffset   = self._logFile.tell()
+
+                group.append(RegfileLog.COMMENT + segmentTime.ctime() + "\n")
+                indexLine = "{} {}\n".format(segmentTime.isoformat(), segmentOffset)
+            # }}}
+
+            group.extend(line + "\n" for line in lines)
+
+            # write the whole group at once and sync it to the disk {{{
+            self._logFile.writelines(group)
+            self._logFile.flush()
+            os.fsync(self._logFile.fileno())
+            # }}}
+
+            self._endOffset = self._logFile.tell()
+
+            # add the new segment to the index {{{
+            if (indexLine is not None):
+                with open(self.indexFilePath, "a") as indexFile:
+                    indexFile.write(indexLine)
+            # }}}
+        finally:
+            # unlock the log {{{
+            if (fcntl is not None):
+                fcntl.flock(self._logFile.fileno(), fcntl.LOCK_UN)
+            # }}}
+        # }}}
+
+
+    @staticmethod
+    def lock(logFile):
+        # DOC {{{
+        """Locks the log exclusively by the specified open log file, so no
+        process writes to the log until the file is closed (see
+        writeGroup()).
+
+        Parameters
+
+            logFile -- the log file open in any mode
+        """
+        # }}}
+
+        # CODE {{{
+        if (fcntl is not None):
+            fcntl.flock(logFile.fileno(), fcntl.LOCK_EX)
+        # }}}
+
+
+    def close(self):
+        # DOC {{{
+        """Closes the log if it is open.
+        """
+        # }}}
+
+        # CODE {{{
+        if (self._logFile is not None):
+            self._logFile.close()
+            self._logFile = None
+        # }}}
+
+
+    @staticmethod
+    def _parseSegmentTime(line):
+        # DOC {{{
+        """Returns the time of the segment started by the specified log line
+        or None if the line does not start a segment.
+
+        Parameters
+
+            line -- a line from the log
+        """
+        # }}}
+
+        # CODE {{{
+        # return None if the line is not a comment {{{
+        if (not line.startswith(RegfileLog.COMMENT)):
+            return None
+        # }}}
+
+        # try to parse the time in the comment {{{
+        try:
+            return datetime.datetime.strptime(line[len(RegfileLog.COMMENT):].strip(), RegfileLog.TIME_FORMAT)
+        except ValueError:
+            return None
+        # }}}
+        # }}}
+
+
+    def loadIndex(self):
+        # DOC {{{
+        """Returns the time index as a list of tuples (time, offset,) ordered
+        by offset. Segments not indexed yet (e.g. logged before the index
+        existed) are found by scanning the log from the last indexed segment
+        and are added to the index. The index is rebuilt from the whole log
+        if it does not fit the log.
+        """
+        # }}}
+
+        # CODE {{{
+        # return an empty index if there is no log {{{
+        if (not os.path.exists(self.logFilePath)):
+            return []
+        # }}}
+
+        # read the index {{{
+        index = []
+
+        if (os.path.exists(self.indexFilePath)):
+            with open(self.indexFilePath, "r") as indexFile:
+                for line in indexFile:
+                    segmentTime, segmentOffset = line.split()
+                    index.append((datetime.datetime.strptime(segmentTime, "%Y-%m-%dT%H:%M:%S"), int(segmentOffset)))
+        # }}}
+
+        # scan the log from the last indexed segment for segments missing in the index {{{
+        missingSegments = []
+
+        with open(self.logFilePath, "rb") as logFile:
+            # drop the index if it does not fit the log (e.g. the log has been replaced) {{{
+            if (index):
+                logFile.seek(index[-1][1])
+
+                if (self._parseSegmentTime(logFile.readline().decode("utf-8")) != index[-1][0]):
+                    index = []
+                    os.remove(self.indexFilePath)
+            # }}}
+
+            # start right after the last indexed segment or at the beginning {{{
+            if (index):
+                offset = logFile.tell()
+            else:
+                offset = 0
+                logFile.seek(0)
+            # }}}
+
+            for line in logFile:
+                segmentTime = self._parseSegmentTime(line.decode("utf-8"))
+
+                if (segmentTime is not None):
+                    missingSegments.append((segmentTime, offset))
+
+                offset += len(line)
+        # }}}
+
+        # append the missing segments to the index {{{
+        if (missingSegments):
+            with open(self.indexFilePath, "a") as indexFile:
+                for segmentTime, segmentOffset in missingSegments:
+                    indexFile.write("{} {}\n".format(segmentTime.isoformat(), segmentOffset))
+
+            index.extend(missingSegments)
+        # }}}
+
+        return index
+        # }}}
+
+
+    def _determineOffsetRange(self, since = None, until = None):
+        # DOC {{{
+        """Returns a tuple (startOffset, endOffset,) of the part of the log
+        with the segments logged in the specified time range.
+
+        Parameters
+
+            since -- (optional) the earliest time of the segments (inclusive)
+
+            until -- (optional) the latest time of the segments (inclusive)
+        """
+        # }}}
+
+        # CODE {{{
+        index = self.loadIndex()
+
+        times = [segmentTime for segmentTime, segmentOffset in index]
+
+        # the first segment logged at or after since {{{
+        startPosition = 0 if (since is None) else bisect.bisect_left(times, since)
+        # }}}
+
+        # the first segment logged after until {{{
+        endPosition = len(index) if (until is None) else bisect.bisect_right(times, until)
+        # }}}
+
+        startOffset = index[startPosition][1] if (startPosition < len(index)) else os.path.getsize(self.logFilePath)
+        endOffset = index[endPosition][1] if (endPosition < len(index)) else os.path.getsize(self.logFilePath)
+
+        return (startOffset, max(startOffset, endOffset))
+        # }}}
+
+
+    def iterateLines(self, since = None, until = None):
+        # DOC {{{
+        """Returns a generator of the log lines (without the new line
+        character) of the segments logged in the specified time range. Only
+        that part of the log is read.
+
+        Parameters
+
+            since -- (optional) the earliest time of the segments (inclusive)
+
+            until -- (optional) the latest time of the segments (inclusive)
+        """
+        # }}}
+
+        # CODE {{{
+        startOffset, endOffset = self._determineOffsetRange(since, until)
+
+        with open(self.logFilePath, "rb") as logFile:
+            logFile.seek(startOffset)
+
+            while (logFile.tell() < endOffset):
+                yield logFile.readline().decode("utf-8").rstrip("\n")
+        # }}}
+
+
+    def determineDBFileAsOf(self, fileId, until = None):
+        # DOC {{{
+        """Returns the DBFile() of the specified fileId in the state it had at
+        the specified time according to the log or None if it has not been
+        added by then.
+
+        The added DBFile()s are ordered by fileId in the log, so the addition
+        is found by bisecting the log. Only the part of the log between the
+        addition and the end of the time range is then read for updates.
+
+        Parameters
+
+            fileId -- the ID of the DBFile()
+
+            until -- (optional) the time of the state, now if not specified
+        """
+        # }}}
+
+        # CODE {{{
+        startOffset, endOffset = self._determineOffsetRange(until = until)
+
+        with open(self.logFilePath, "rb") as logFile:
+            # find the addition of the DBFile() {{{
+            addedOffset = self._bisectAddedDBFile(logFile, fileId, 0, endOffset)
+
+            if (addedOffset is None):
+                return None
+
+            logFile.seek(addedOffset)
+            dbFile = self.parseDBFile(logFile.readline().decode("utf-8")[len(RegfileLog.ADD):])
+            # }}}
+
+            # apply the updates logged after the addition {{{
+            updatedPrefix = (RegfileLog.UPDATED + RegfileLog.DBFILE_FORMAT.split("|")[0].format(fileId = fileId) + "|")
+
+            while (logFile.tell() < endOffset):
+                line = logFile.readline().decode("utf-8")
+
+                if (line.startswith(updatedPrefix)):
+                    updatedDBFile   = self.parseDBFile(line[len(RegfileLog.UPDATED):])
+                    dbFile.fileName = updatedDBFile.fileName if updatedDBFile.fileName != "" else None
+                    dbFile.group    = updatedDBFile.group if updatedDBFile.group != "" else None
+                    dbFile.comment  = updatedDBFile.comment if updatedDBFile.comment != "" else None
+            # }}}
+        # }}}
+
+        return dbFile
+        # }}}
+
+
+    def _bisectAddedDBFile(self, logFile, fileId, lowOffset, highOffset):
+        # DOC {{{
+        """Returns the offset of the line adding the DBFile() of the specified
+        fileId in the specified part of the log or None if there is no such
+        line.
+
+        Parameters
+
+            logFile -- the log opened for reading bytes
+
+            fileId -- the ID of the added DBFile()
+
+            lowOffset -- the start of the searched part, a start of a line
+
+            highOffset -- the end of the searched part
+        """
+        # }}}
+
+        # CODE {{{
+        while (lowOffset < highOffset):
+            middleOffset = (lowOffset + highOffset) // 2
+
+            # move to the first line starting at or after the middle {{{
+            if (middleOffset > 0):
+                logFile.seek(middleOffset - 1)
+                logFile.readline()
+            else:
+                logFile.seek(0)
+            # }}}
+
+            # find the first added DBFile() starting before the high offset {{{
+            addedOffset = None
+            addedFileId = None
+
+            while (logFile.tell() < highOffset):
+                lineOffset = logFile.tell()
+                line = logFile.readline().decode("utf-8")
+
+                if (line.startswith(RegfileLog.ADD)):
+                    addedOffset = lineOffset
+                    addedFileId = int(RegfileLog.DBFILE_RE.match(line[len(RegfileLog.ADD):]).group("fileId"))
+                    break
+            # }}}
+
+            # continue in the first half if there is no addition in the second one {{{
+            if ((addedOffset is None) or (addedFileId > fileId)):
+                highOffset = middleOffset
+            # }}}
+            # or continue after the found addition if the DBFile() is added later {{{
+            elif (addedFileId < fileId):
+                lowOffset = logFile.tell()
+            # }}}
+            # otherwise the addition has been found {{{
+            else:
+                return addedOffset
+            # }}}
+
+        return None
+        # }}}
+
+
+    @staticmethod
+    def formatDBFile(dbFile):
+        # DOC {{{
+        """Returns a string representation of the specified DBFile() for the
+        log.
+
+        Parameters
+
+            dbFile -- a DBFile() or a DBFileRecord() to format
+        """
+        # }}}
+
+        # CODE {{{
+        return RegfileLog.DBFILE_FORMAT.format(
+                fileId      = dbFile.fileId if (dbFile.fileId is not None) else 0,
+                fileName    = dbFile.fileName,
+                group       = dbFile.group if (dbFile.group is not None) else "",
+                comment     = dbFile.comment if (dbFile.comment is not None) else "",
+                fileSize    = dbFile.fileSize,
+                md1         = dbFile.md1,
+                md5         = dbFile.md5,
+                ed2k        = dbFile.ed2k,
+        )
+        # }}}
+
+
+    @staticmethod
+    def parseDBFile(dbFileString):
+        # DOC {{{
+        """Returns a new DBFile() parsed from its string representation in the
+        log. Raises ValueError if the string is not a DBFile() representation.
+
+        Parameters
+
+            dbFileString -- a DBFile() formatted for the log (without the line
+                prefix)
+        """
+        # }}}
+
+        # CODE {{{
+        # try to match the string with the parsing regexp
+        match = RegfileLog.DBFILE_RE.match(dbFileString)
+
+        # raise an exception if the string did not match {{{
+        if (match is None):
+            raise ValueError("The string " + dbFileString + " doesnt match the logline!")
+        # }}}
+
+        # get the matched groups as a dict
+        matchGroups = match.groupdict()
+
+        # create the DBFile() (imported here, so the operations that do not parse the log do not import SQLAlchemy) {{{
+        from db.DBFile import DBFile
+
+        dbFile = DBFile(
+                fileId      = int(matchGroups['fileId']),
+                fileName    = matchGroups['fileName'],
+                fileSize    = int(matchGroups['fileSize']),
+                group       = matchGroups['group'],
+                comment     = matchGroups['comment'],
+                md1         = matchGroups['md1'],
+                md5         = matchGroups['md5'],
+                ed2k        = matchGroups['ed2k'],
+        )
+        # }}}
+
+        # make sure nothing has been lost in the parsing
+        assert (RegfileLog.formatDBFile(dbFile).strip() == dbFileString.strip())
+
+        # return the parsed DBFile()
+        return dbFile
+        # }}}
+
+
+    def iterateReplayedDBFiles(self):
+        # DOC {{{
+        """Returns a generator of tuples in the format (prefix, dbFile,) for
+        all the log lines which are replayed to rebuild the database, i.e. the
+        added (ADD) and updated (UPDATED) DBFile()s in the order of the log.
+        """
+        # }}}
+
+        # CODE {{{
+        with open(self.logFilePath, "r") as logFile:
+            for line in logFile:
+                # go over the replayed prefixes and yield the parsed DBFile() if the line has one of them {{{
+                for prefix in (RegfileLog.ADD, RegfileLog.UPDATED):
+                    if (line.startswith(prefix)):
+                        yield (prefix, RegfileLog.parseDBFile(line[len(prefix):]))
+                        break
+                # }}}
+        # }}}
+
+
+    def iterateFinalDBFiles(self):
+        # DOC {{{
+        """Returns a generator of DBFile()s in the state they would have in
+        a database rebuilt from the log, ordered by their fileId.
+
+        The log is read twice. The first pass sorts the updates by fileId
+        (and the order of the log) in chunks of UPDATES_CHUNK_SIZE, the
+        chunks are spilled to temporary files if there are more of them. The
+        second pass streams the added DBFile()s merged with the sorted
+        updates and applies the last update of each the same way
+        DBFileRegister.update(setall=True) would. So the memory is bounded by
+        the chunk, not by the size of the log. Raises ValueError if the added
+        DBFile()s are not ordered by their fileId in the log.
+        """
+        # }}}
+
+        # CODE {{{
+        with contextlib.ExitStack() as exitStack:
+            # an iterator of tuples (fileId, lineNumber, dbFileString,) of the updates ordered by fileId and lineNumber {{{
+            updates = heapq.merge(*self._sortUpdates(exitStack))
+            update = next(updates, None)
+            # }}}
+
+            # stream the added DBFile()s with the updates applied {{{
+            previousFileId = None
+
+            with open(self.logFilePath, "r") as logFile:
+                for lineNumber, line in enumerate(logFile):
+                    # skip anything but the added DBFile()s {{{
+                    if (not line.startswith(RegfileLog.ADD)):
+                        continue
+                    # }}}
+
+                    dbFile = RegfileLog.parseDBFile(line[len(RegfileLog.ADD):])
+
+                    # raise an exception if the log is not ordered by fileId {{{
+                    if ((previousFileId is not None) and (dbFile.fileId <= previousFileId)):
+                        raise ValueError("The log entry {} follows the entry {}, the log is not ordered!".format(
+                            dbFile.fileId,
+                            previousFileId,
+                        ))
+                    # }}}
+
+                    previousFileId = dbFile.fileId
+
+                    # find the last update of the DBFile() (skip the updates of the DBFile()s never added) {{{
+                    lastUpdate = None
+
+                    while ((update is not None) and (update[0] <= dbFile.fileId)):
+                        if (update[0] == dbFile.fileId):
+                            lastUpdate = update
+
+                        update = next(updates, None)
+                    # }}}
+
+                    # apply the last update if it has been logged after the addition {{{
+                    if ((lastUpdate is not None) and (lastUpdate[1] > lineNumber)):
+                        updatedDBFile = RegfileLog.parseDBFile(lastUpdate[2])
+
+                        dbFile.fileName = updatedDBFile.fileName if updatedDBFile.fileName != "" else None
+                        dbFile.group    = updatedDBFile.group if updatedDBFile.group != "" else None
+                        dbFile.comment  = updatedDBFile.comment if updatedDBFile.comment != "" else None
+                    # }}}
+
+                    yield dbFile
+            # }}}
+        # }}}
+
+
+    def _sortUpdates(self, exitStack):
+        # DOC {{{
+        """Returns a list of iterators of tuples (fileId, lineNumber,
+        dbFileString,) of the updates (UPDATED) in the log, each ordered by
+        fileId and lineNumber. The updates are sorted in chunks of
+        UPDATES_CHUNK_SIZE, every chunk but the last one is spilled to a
+        temporary file (closed by the exitStack).
+
+        Parameters
+
+            exitStack -- a contextlib.ExitStack() the temporary files are
+                entered into
+        """
+        # }}}
+
+        # CODE {{{
+        sortedChunks = []
+        chunk = []
+
+        with open(self.logFilePath, "r") as logFile:
+            for lineNumber, line in enumerate(logFile):
+                if (not line.startswith(RegfileLog.UPDATED)):
+                    continue
+
+                dbFileString = line[len(RegfileLog.UPDATED):].rstrip("\n")
+                match = RegfileLog.DBFILE_RE.match(dbFileString)
+
+                if (match is None):
+                    raise ValueError("The string " + dbFileString + " doesnt match the logline!")
+
+                chunk.append((int(match.group('fileId')), lineNumber, dbFileString))
+
+                # spill the full chunk sorted to a temporary file {{{
+                if (len(chunk) >= RegfileLog.UPDATES_CHUNK_SIZE):
+                    chunk.sort()
+                    chunkFile = exitStack.enter_context(tempfile.TemporaryFile(mode = "w+", encoding = "utf-8"))
+
+                    for fileId, updateLineNumber, updateString in chunk:
+                        chunkFile.write("{} {} {}\n".format(fileId, updateLineNumber, updateString))
+
+                    chunkFile.seek(0)
+                    sortedChunks.append(RegfileLog._iterateSpilledUpdates(chunkFile))
+                    chunk = []
+                # }}}
+
+        chunk.sort()
+        sortedChunks.append(iter(chunk))
+
+        return sortedChunks
+        # }}}
+
+
+    @staticmethod
+    def _iterateSpilledUpdates(chunkFile):
+        # DOC {{{
+        """Returns a generator of tuples (fileId, lineNumber, dbFileString,)
+        of the updates spilled to the temporary file (see _sortUpdates()).
+
+        Parameters
+
+            chunkFile -- the temporary file open for reading
+        """
+        # }}}
+
+        # CODE {{{
+        for line in chunkFile:
+            fileId, lineNumber, dbFileString = line.rstrip("\n").split(" ", 2)
+
+            yield (int(fileId), int(lineNumber), dbFileString)
+        # }}}
+
+
+    @staticmethod
+    def determineCountAndChecksum(dbFiles):
+        # DOC {{{
+        """Returns a tuple in the format (count, checksum,) where count is the
+        number of the specified DBFile()s and checksum is the MD5 hex digest
+        of their log representations. Both the database and the log can be
+        summarized this way and compared.
+
+        Parameters
+
+            dbFiles -- an iterable of DBFile()s (or DBFileRecord()s) ordered by
+                fileId
+        """
+        # }}}
+
+        # CODE {{{
+        count = 0
+        md5Hasher = hashlib.md5()
+
+        for dbFile in dbFiles:
+            count += 1
+            md5Hasher.update((RegfileLog.formatDBFile(dbFile) + "\n").encode("utf-8"))
+
+        return (count, md5Hasher.hexdigest())
+        # }}}
+
+
+    # }}}
+# }}}
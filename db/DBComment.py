@@ -0,0 +1,56 @@
+##
+## DBComment.py
+##      - SQLAlchemy ORM object representing a row in the "filecomment" table,
+##        i.e. a distinct comment of DBFile()s.
+##
+
+
+# import of required modules {{{
+import sqlalchemy
+
+from .DBBase import DBBase
+# }}}
+
+
+# class DBComment() {{{
+class DBComment(DBBase):
+    # DOC {{{
+    """SQLAlchemy ORM object representing a row in the "filecomment" table, i.e.
+    a distinct comment of DBFile()s. Every comment is stored just once and the
+    DBFile()s refer to it by its ID.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # SQLAlchemy table name
+    __tablename__ = "filecomment"
+
+    # SQLAlchemy columns {{{
+    # id (primary key)
+    commentId       = sqlalchemy.Column(name = 'id', type_ = sqlalchemy.Integer, primary_key = True)
+
+    # the comment (unique)
+    text            = sqlalchemy.Column(type_ = sqlalchemy.String, nullable = False, unique = True)
+    # }}}
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, text):
+        # DOC {{{
+        """Initializes the instance of the ORM representation of a comment.
+
+        Parameters
+
+            text -- the comment
+        """
+        # }}}
+
+        # CODE {{{
+        self.text           = text
+        # }}}
+
+
+    # }}}
+# }}}
@@ -2,16 +2,30 @@
 ## DBConnection.py
 ##      - Manages the connection to the SQLite database and provides means to
 ##        create a new session and to get a runtime context friendly session
-##        wrapper.
+##        wrapper. Every new SQLite connection is set up with the specified
+##        pragmas. Writes can be retried while another process holds the
+##        database's write lock. The optional full text search index is
+##        created or dropped as requested. A database of an older structure
+##        can be migrated.
 ##
 
 
 # import of required modules {{{
 import os
+import random
+import sqlite3
+import time
+from contextlib import closing
 from contextlib import contextmanager
 
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+
+from .DBFileSearchIndex import DBFileSearchIndex
+from .DBFileStatistics import DBFileStatistics
 # }}}
 
 
@@ -20,12 +34,50 @@ class DBConnection(object):
     # DOC {{{
     """Manages the connection to the SQLite database and provides means to
     create a new session and to get a runtime context friendly session wrapper.
+    Every new SQLite connection is set up with the specified pragmas.
+
+    Several processes may use the same database at once. In the WAL journal
+    mode readers never wait for the writer nor the other way round, but
+    there is only one writer at a time. Therefore the processes keep to this
+    contract:
+
+        - reads run outside of write transactions (SQLite autocommits them)
+
+        - all the writes of an operation are done at once in one short
+          transaction at its very end (e.g. the commit of a registration)
+
+        - the first write of a transaction (which acquires the write lock)
+          is wrapped in retryOnBusy(), it waits busy_timeout for the lock and
+          is retried with a backoff if the lock is still held
+
+        - anything that has to be ordered the same way as the database (the
+          log) is written after the first write and before the commit,
+          i.e. while the transaction holds the write lock
     """
     # }}}
 
 
+    # STATIC VARIABLES {{{
+    # the version of the database structure (SQLite's user_version), the
+    # databases of an older version have to be migrated (see migrate())
+    SCHEMA_VERSION                  = 1
+
+    # the names of the indexes of the older versions that are dropped
+    _OBSOLETE_INDEX_NAMES           = ('file_md5',)
+
+    # the initial and the maximal delay (in seconds) before retrying a write to a busy database
+    _BUSY_BACKOFF_INITIAL_DELAY     = 0.1
+    _BUSY_BACKOFF_MAXIMAL_DELAY     = 5.0
+
+    # SQLite's primary result codes meaning the database is locked by another connection {{{
+    _SQLITE_BUSY                    = 5
+    _SQLITE_LOCKED                  = 6
+    # }}}
+    # }}}
+
+
     # METHODS {{{
-    def __init__(self, sqliteFilePath, echoSQLCommands = False):
+    def __init__(self, sqliteFilePath, echoSQLCommands = False, pragmas = (), busyRetries = 0, fileSearchIndex = False, upgrade = True):
         # DOC {{{
         """Initializes the instance, creates the engine and session maker and
         creates the database structure if the SQLite file does not exists.
@@ -35,6 +87,20 @@ def __init__(self, sqliteFilePath, echoSQLCommands = False):
             sqliteFilePath -- path of the SQLite database file
 
             echoSQLCommands -- whether or not to print any issued SQL commands
+
+            pragmas -- (optional) an iterable of (pragma, value,) tuples to
+                set up every new SQLite connection with (see
+                RegfileConfiguration.determineSQLitePragmas())
+
+            busyRetries -- (optional) the number of times retryOnBusy()
+                retries an operation
+
+            fileSearchIndex -- (optional) whether to create (True) or drop
+                (False) the full text search index (see DBFileSearchIndex())
+
+            upgrade -- (optional) whether the connection may set the
+                database up (see _setUp()), a read-only one does not change
+                the database
         """
         # }}}
 
@@ -42,38 +108,601 @@ def __init__(self, sqliteFilePath, echoSQLCommands = False):
         # expand '~' to the home directory of the current user in the SQLite file path
         self._sqliteFilePath = os.path.expanduser(sqliteFilePath)
 
+        # store the pragmas
+        self._pragmas = tuple(pragmas)
+
+        # store the number of retries
+        self._busyRetries = busyRetries
+
+        # make a new database incrementally vacuumable {{{
+        # NOTE: possible only before any table is created and the journal mode is changed
+        if (not os.path.exists(self._sqliteFilePath)):
+            self._pragmas = (('auto_vacuum', 'INCREMENTAL'),) + self._pragmas
+        # }}}
+
         # create the database engine
         self._engine = create_engine('sqlite:///' + self._sqliteFilePath, echo = echoSQLCommands)
 
-        # create and bind the session maker
-        self._sessionMaker = sessionmaker(bind=self._engine)
+        # set up every new SQLite connection with the pragmas
+        event.listen(self._engine, "connect", self._setPragmas)
+
+        # store whether the full text search index is requested
+        self._fileSearchIndex = fileSearchIndex
+
+        # store whether the database may be set up
+        self._upgrade = upgrade
 
         # create the database schema if necessary
         self._createDBSchemaIfNecessary()
+
+        # determine the version of the database structure
+        self._schemaVersion = self._determineSchemaVersion()
+
+        # set the database up unless it has to be migrated first
+        self._hasFileSearchIndex = False
+        self._hasStatistics = False
+        if (not self.isOutdated):
+            self._setUp()
+
+        # create and bind the session maker, tell the sessions whether the full text search index is present
+        self._sessionMaker = sessionmaker(bind=self._engine, info={DBFileSearchIndex.SESSION_INFO_KEY : self._hasFileSearchIndex})
         # }}}
 
 
-    def _createDBSchemaIfNecessary(self):
+    def _setUp(self):
         # DOC {{{
-        """Creates the underlying database schema if the SQLite database file
-        does not exist.
+        """Sets the database of the current structure up: creates the missing
+        indexes and statistics and creates or drops the full text search index
+        as requested. Each change is done under the write lock only if it is
+        still necessary (see _upgradeIfNecessary()). A connection that may
+        not set the database up only detects the statistics and the full
+        text search index.
         """
         # }}}
 
         # CODE {{{
-        # return if the SQLite database file exists {{{
-        if (os.path.exists(self._sqliteFilePath)):
+        # detect the statistics and the full text search index without changing the database {{{
+        if (not self._upgrade):
+            with self._engine.connect() as connection:
+                self._hasStatistics = DBFileStatistics.exists(connection)
+                self._hasFileSearchIndex = DBFileSearchIndex.exists(connection)
+
             return
         # }}}
 
+        # create the indexes missing in a database created by an older version
+        self._upgradeIfNecessary(self._hasMissingIndexes, self._createMissingIndexes)
+
+        # create the statistics missing in a database created by an older version
+        self._upgradeIfNecessary(lambda connection: (not DBFileStatistics.exists(connection)), DBFileStatistics.create)
+        self._hasStatistics = True
+
+        # create or drop the full text search index as requested
+        self._hasFileSearchIndex = self._setUpFileSearchIndex(self._fileSearchIndex)
+        # }}}
+
+
+    def _determineSchemaVersion(self):
+        # DOC {{{
+        """Returns the version of the database structure (SQLite's
+        user_version).
+        """
+        # }}}
+
+        # CODE {{{
+        with self._engine.connect() as connection:
+            return connection.execute("PRAGMA user_version").scalar()
+        # }}}
+
+
+    @property
+    def isOutdated(self):
+        # DOC {{{
+        """Returns True if the database has an older structure and has to be
+        migrated (see migrate()), False otherwise.
+        """
+        # }}}
+
+        # CODE {{{
+        return (self._schemaVersion < DBConnection.SCHEMA_VERSION)
+        # }}}
+
+
+    def migrate(self):
+        # DOC {{{
+        """Migrates the database of an older structure to the current one
+        (and does nothing if it is current). The whole migration is done in
+        one transaction and the database is vacuumed afterwards.
+
+        Version 0 -> 1: the groups and the comments are moved from the "file"
+        table to the "filegroup" and the "filecomment" tables, the "file" table
+        refers to them by their IDs.
+        """
+        # }}}
+
+        # CODE {{{
+        # return if there is nothing to migrate {{{
+        if (not self.isOutdated):
+            return
+        # }}}
+
+        # import the DBBase declarative base and the DBFile to introduce it to the declarative base
+        from .DBBase import DBBase
+        from .DBFile import DBFile
+
+        with self._engine.connect() as connection:
+            # drop the full text search index referring to the old columns (it is rebuilt later)
+            DBFileSearchIndex.drop(connection)
+
+            with connection.begin():
+                # drop the old indexes (their names are reused) and move the old table aside {{{
+                for index in inspect(connection).get_indexes(DBFile.__tablename__):
+                    connection.execute('DROP INDEX "{}"'.format(index['name']))
+
+                connection.execute("ALTER TABLE file RENAME TO file_old")
+                # }}}
+
+                # create the current structure
+                DBBase.metadata.create_all(connection)
+
+                # move the distinct groups and comments to their tables {{{
+                connection.execute("""INSERT INTO filegroup (name)
+                        SELECT DISTINCT "group" FROM file_old WHERE "group" IS NOT NULL AND "group" != ''""")
+                connection.execute("""INSERT INTO filecomment (text)
+                        SELECT DISTINCT comment FROM file_old WHERE comment IS NOT NULL AND comment != ''""")
+                # }}}
+
+                # copy the files referring to their groups and comments {{{
+                connection.execute("""INSERT INTO file (idno, name, group_id, comment_id, size, md1, md5, ed2k)
+                        SELECT file_old.idno, file_old.name, filegroup.id, filecomment.id,
+                               file_old.size, file_old.md1, file_old.md5, file_old.ed2k
+                        FROM file_old
+                            LEFT JOIN filegroup ON filegroup.name = file_old."group"
+                            LEFT JOIN filecomment ON filecomment.text = file_old.comment
+                        ORDER BY file_old.idno""")
+                # }}}
+
+                # drop the old table and mark the structure current {{{
+                connection.execute("DROP TABLE file_old")
+                connection.execute("PRAGMA user_version = {}".format(DBConnection.SCHEMA_VERSION))
+                # }}}
+
+            # return the space of the old table to the file system
+            connection.execute("VACUUM")
+
+        # the database is current now, set it up
+        self._schemaVersion = DBConnection.SCHEMA_VERSION
+        self._setUp()
+        self._sessionMaker.configure(info={DBFileSearchIndex.SESSION_INFO_KEY : self._hasFileSearchIndex})
+        # }}}
+
+
+    def _createDBSchemaIfNecessary(self):
+        # DOC {{{
+        """Creates the underlying database schema if the SQLite database is
+        new (it has no tables). The schema is created under the write lock
+        unless another process has just created it (see
+        _upgradeIfNecessary()).
+        """
+        # }}}
+
+        # CODE {{{
         # import the DBBase declarative base
         from .DBBase import DBBase
 
         # import the DBFile to introduce it to the declarative base
         from .DBFile import DBFile              # pylint: disable=unused-variable
 
-        # create the schema (i.e. the SQLite file)
-        DBBase.metadata.create_all(self._engine)
+        # create the schema and mark its version {{{
+        def createDBSchema(connection):
+            DBBase.metadata.create_all(connection)
+            connection.execute("PRAGMA user_version = {}".format(DBConnection.SCHEMA_VERSION))
+        # }}}
+
+        self._upgradeIfNecessary(
+                lambda connection: (connection.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").scalar() == 0),
+                createDBSchema)
+        # }}}
+
+
+    def _upgradeIfNecessary(self, isNecessary, upgrade):
+        # DOC {{{
+        """Upgrades the database if it is necessary. It is checked without
+        any lock first. If the upgrade is necessary, a write transaction is
+        begun at once (see beginImmediate()), the database is checked again
+        (another process may have just upgraded it) and upgraded in the
+        transaction. The transaction is retried while the database is locked
+        (see retryOnBusy()).
+
+        Parameters
+
+            isNecessary -- a callable returning True if the upgrade is
+                necessary (called with an SQLAlchemy's Connection())
+
+            upgrade -- a callable upgrading the database (called with the
+                Connection() in the transaction)
+        """
+        # }}}
+
+        # CODE {{{
+        with self._engine.connect() as connection:
+            # return if there is nothing to upgrade {{{
+            if (not isNecessary(connection)):
+                return
+            # }}}
+
+            # upgrade the database under the write lock {{{
+            def upgradeInTransaction():
+                with connection.begin():
+                    DBConnection.beginImmediate(connection)
+
+                    if (isNecessary(connection)):
+                        upgrade(connection)
+
+            self.retryOnBusy(None, upgradeInTransaction)
+            # }}}
+        # }}}
+
+
+    @staticmethod
+    def _determineIndexNames(connection):
+        # DOC {{{
+        """Returns a tuple (the names of the missing indexes of the "file"
+        table, the names of the obsolete ones present in the database,).
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        # import the DBFile to get its table
+        from .DBFile import DBFile
+
+        existingIndexNames = set(index['name'] for index in inspect(connection).get_indexes(DBFile.__tablename__))
+
+        return (
+                set(index.name for index in DBFile.__table__.indexes).difference(existingIndexNames),
+                existingIndexNames.intersection(DBConnection._OBSOLETE_INDEX_NAMES),
+        )
+        # }}}
+
+
+    @staticmethod
+    def _hasMissingIndexes(connection):
+        # DOC {{{
+        """Returns True if any index of the "file" table is missing in the
+        database (e.g. created by an older version) or any obsolete one is
+        present.
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        return any(DBConnection._determineIndexNames(connection))
+        # }}}
+
+
+    @staticmethod
+    def _createMissingIndexes(connection):
+        # DOC {{{
+        """Creates the indexes of the "file" table that are missing in the
+        database (e.g. created by an older version) and drops the obsolete
+        ones.
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        # import the DBFile to get its table
+        from .DBFile import DBFile
+
+        missingIndexNames, obsoleteIndexNames = DBConnection._determineIndexNames(connection)
+
+        # create the missing ones {{{
+        for index in DBFile.__table__.indexes:
+            if (index.name in missingIndexNames):
+                index.create(connection)
+        # }}}
+
+        # drop the obsolete ones {{{
+        for indexName in obsoleteIndexNames:
+            connection.execute('DROP INDEX IF EXISTS "{}"'.format(indexName))
+        # }}}
+        # }}}
+
+
+    def _setUpFileSearchIndex(self, enabled):
+        # DOC {{{
+        """Creates the full text search index if it is enabled and missing or
+        drops it if it is disabled and present (so the triggers do not slow
+        writes down, see _upgradeIfNecessary()). Returns True if the index is
+        present afterwards, False otherwise (also if the SQLite does not
+        support it, any other error is raised).
+
+        Parameters
+
+            enabled -- whether the index should be present
+        """
+        # }}}
+
+        # CODE {{{
+        # create the missing index or drop the unwanted one, the SQLite may not support the index though {{{
+        try:
+            self._upgradeIfNecessary(
+                    lambda connection: (DBFileSearchIndex.exists(connection) != enabled),
+                    DBFileSearchIndex.create if enabled else DBFileSearchIndex.drop)
+        except OperationalError as error:
+            if (not DBFileSearchIndex.isUnsupportedError(error)):
+                raise
+        # }}}
+
+        with self._engine.connect() as connection:
+            return DBFileSearchIndex.exists(connection)
+        # }}}
+
+
+    @property
+    def hasStatistics(self):
+        # DOC {{{
+        """Returns True if the statistics are present in the database, False
+        otherwise (a database of an older version that has not been set up
+        yet, see _setUp()).
+        """
+        # }}}
+
+        # CODE {{{
+        return self._hasStatistics
+        # }}}
+
+
+    @property
+    def hasFileSearchIndex(self):
+        # DOC {{{
+        """Returns True if the full text search index is present in the
+        database, False otherwise.
+        """
+        # }}}
+
+        # CODE {{{
+        return self._hasFileSearchIndex
+        # }}}
+
+
+    def _setPragmas(self, dbapiConnection, connectionRecord):
+        # DOC {{{
+        """Sets the pragmas up on a new SQLite connection (a listener of the
+        engine's 'connect' event).
+
+        Parameters
+
+            dbapiConnection -- the new sqlite3 connection
+
+            connectionRecord -- SQLAlchemy's record of the connection in the
+                pool (unused)
+        """
+        # }}}
+
+        # CODE {{{
+        cursor = dbapiConnection.cursor()
+
+        for pragma, value in self._pragmas:
+            cursor.execute("PRAGMA {} = {}".format(pragma, value))
+
+        cursor.close()
+        # }}}
+
+
+    def retryOnBusy(self, session, operation, *args, **kwargs):
+        # DOC {{{
+        """Calls the operation with the specified arguments and returns its
+        result. If the operation fails because the database is locked by
+        another process, the session is rolled back and the operation is
+        retried after an exponentially growing randomized delay up to the
+        configured number of times.
+
+        NOTE: The operation must be repeatable after a rollback, i.e. it
+        NOTE: should do nothing else than the first writes of a transaction.
+
+        Parameters
+
+            session -- the session the operation uses (None if the
+                operation rolls its transaction back itself)
+
+            operation -- a callable to call
+
+            *args, **kwargs -- the arguments of the operation
+        """
+        # }}}
+
+        # CODE {{{
+        delay = DBConnection._BUSY_BACKOFF_INITIAL_DELAY
+
+        for retry in range(self._busyRetries + 1):
+            try:
+                return operation(*args, **kwargs)
+            except (OperationalError, sqlite3.OperationalError,) as error:
+                # raise the error if it is not caused by a lock or there are no retries left {{{
+                if ((not self._isBusyError(error)) or (retry == self._busyRetries)):
+                    raise
+                # }}}
+
+                # undo the failed operation, wait and retry {{{
+                if (session is not None):
+                    session.rollback()
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(2 * delay, DBConnection._BUSY_BACKOFF_MAXIMAL_DELAY)
+                # }}}
+        # }}}
+
+
+    @staticmethod
+    def beginImmediate(connection):
+        # DOC {{{
+        """Begins a write transaction at once (it takes the write lock of the
+        database before anything is read), so the transaction reads what the
+        other processes have committed and nobody else writes until it ends.
+        Raises an OperationalError() if the database is locked by another
+        process (see retryOnBusy()).
+
+        Parameters
+
+            connection -- the session or the connection to begin the
+                transaction in (with no transaction begun yet)
+        """
+        # }}}
+
+        # CODE {{{
+        connection.execute("BEGIN IMMEDIATE")
+        # }}}
+
+
+    @staticmethod
+    def _isBusyError(error):
+        # DOC {{{
+        """Returns True if the specified SQLAlchemy's (or sqlite3's)
+        OperationalError() has been caused by the database being locked by
+        another connection.
+
+        Parameters
+
+            error -- an OperationalError()
+        """
+        # }}}
+
+        # CODE {{{
+        # get the sqlite3's error wrapped by SQLAlchemy's one
+        error = getattr(error, "orig", error)
+
+        # use the SQLite's result code if available (Python 3.11+) {{{
+        errorCode = getattr(error, "sqlite_errorcode", None)
+
+        if (errorCode is not None):
+            return ((errorCode & 0xff) in (DBConnection._SQLITE_BUSY, DBConnection._SQLITE_LOCKED))
+        # }}}
+
+        # otherwise recognize the message
+        return ("locked" in str(error))
+        # }}}
+
+
+    def checkpoint(self):
+        # DOC {{{
+        """Moves all the changes from the write ahead log (if any) to the
+        database file, so the database file alone is complete (e.g. for a
+        backup copy).
+        """
+        # }}}
+
+        # CODE {{{
+        with self._engine.connect() as connection:
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        # }}}
+
+
+    def backUp(self, backupFilePath):
+        # DOC {{{
+        """Copies the database as it has been committed to the backup file (an
+        existing file is replaced) by the SQLite backup API. The others may
+        read and write the database meanwhile.
+
+        Parameters
+
+            backupFilePath -- the path of the backup file
+        """
+        # }}}
+
+        # CODE {{{
+        if (os.path.exists(backupFilePath)):
+            os.remove(backupFilePath)
+
+        with closing(sqlite3.connect(self._sqliteFilePath)) as sourceConnection:
+            with closing(sqlite3.connect(backupFilePath)) as backupConnection:
+                sourceConnection.backup(backupConnection)
+        # }}}
+
+
+    def replaceContent(self, sqliteFilePath):
+        # DOC {{{
+        """Replaces the whole database by the database in the SQLite file by
+        the SQLite backup API: its pages are copied in one write transaction,
+        so the readers see either the old or the new database and no trigger
+        fires. The database file stays in place, so its write ahead log stays
+        valid.
+
+        Raises an OperationalError() at once if the database is locked by
+        another process (see retryOnBusy(), the caller may hold other locks
+        that the other process is waiting for).
+
+        Parameters
+
+            sqliteFilePath -- the path of the SQLite database file to copy
+        """
+        # }}}
+
+        # CODE {{{
+        # give up the copy as soon as the database is busy (sqlite3 would retry it for ever) {{{
+        def abortIfBusy(status, remaining, total):
+            if (status in (DBConnection._SQLITE_BUSY, DBConnection._SQLITE_LOCKED)):
+                raise sqlite3.OperationalError("database is locked")
+        # }}}
+
+        with closing(sqlite3.connect(sqliteFilePath)) as sourceConnection:
+            with closing(sqlite3.connect(self._sqliteFilePath, timeout = 0)) as targetConnection:
+                sourceConnection.backup(targetConnection, progress = abortIfBusy)
+        # }}}
+
+
+    def maintain(self):
+        # DOC {{{
+        """Maintains the database: deletes the groups and the comments no file
+        refers to, updates the statistics of the query planner, returns free
+        pages to the file system and checks the
+        integrity of the database. Returns a list of the problems found by
+        the integrity check (empty if the database is OK).
+
+        The first maintenance of a database created without incremental
+        vacuum support vacuums the database completely to enable it.
+        """
+        # }}}
+
+        # CODE {{{
+        with self._engine.connect() as connection:
+            # delete the groups and the comments no file refers to anymore {{{
+            with connection.begin():
+                connection.execute("DELETE FROM filegroup WHERE id NOT IN (SELECT group_id FROM file WHERE group_id IS NOT NULL)")
+                connection.execute("DELETE FROM filecomment WHERE id NOT IN (SELECT comment_id FROM file WHERE comment_id IS NOT NULL)")
+            # }}}
+
+            # update the query planner's statistics
+            connection.execute("ANALYZE")
+
+            # free unused pages, enable the incremental vacuum first if necessary (INCREMENTAL == 2) {{{
+            if (connection.execute("PRAGMA auto_vacuum").scalar() != 2):
+                connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                connection.execute("VACUUM")
+            else:
+                # NOTE: every step of the pragma frees a page, so the statement
+                # NOTE: is run to completion on the underlying sqlite3 connection
+                connection.connection.execute("PRAGMA incremental_vacuum").fetchall()
+            # }}}
+
+            # check the integrity of the database
+            problems = [row[0] for row in connection.execute("PRAGMA integrity_check")]
+
+        # return the found problems ('ok' alone means no problem) {{{
+        if (problems == ['ok']):
+            return []
+        else:
+            return problems
+        # }}}
         # }}}
 
 
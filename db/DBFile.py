@@ -1,13 +1,18 @@
 ##
 ## DBFile.py
 ##      - SQLAlchemy ORM object representing a row in the "file" table.
+##        The group and the comment are stored in the "filegroup" and the
+##        "filecomment" tables and referred to by their IDs.
 ##
 
 
 # import of required modules {{{
 import sqlalchemy
+from sqlalchemy.orm import column_property
 
 from .DBBase import DBBase
+from .DBComment import DBComment
+from .DBGroup import DBGroup
 # }}}
 
 
@@ -15,6 +20,12 @@
 class DBFile(DBBase):
     # DOC {{{
     """SQLAlchemy ORM object representing a row in the "file" table.
+
+    The group and the comment are stored just once in the "filegroup" and the
+    "filecomment" tables (see DBGroup() and DBComment()) and the row refers to
+    them by groupId and commentId. The group and comment attributes load them
+    transparently, but they are not persisted by themselves: whoever stores
+    a DBFile() sets groupId and commentId accordingly (see DBFileRegister()).
     """
     # }}}
 
@@ -23,6 +34,17 @@ class DBFile(DBBase):
     # SQLAlchemy table name
     __tablename__ = "file"
 
+    # SQLAlchemy indexes (for matching the files by size and checksums, querying and ordering) {{{
+    __table_args__ = (
+            sqlalchemy.Index('file_size_md1', 'size', 'md1'),
+            sqlalchemy.Index('file_content', 'md5', 'size', 'ed2k'),
+            sqlalchemy.Index('file_ed2k', 'ed2k'),
+            sqlalchemy.Index('file_name', 'name'),
+            sqlalchemy.Index('file_group', 'group_id'),
+            sqlalchemy.Index('file_comment', 'comment_id'),
+    )
+    # }}}
+
     # SQLAlchemy columns {{{
     # id (primary key)
     fileId          = sqlalchemy.Column(name = 'idno', type_ = sqlalchemy.Integer, primary_key = True)
@@ -30,11 +52,11 @@ class DBFile(DBBase):
     # filename
     fileName        = sqlalchemy.Column(name = 'name', type_ = sqlalchemy.String)
 
-    # group
-    group           = sqlalchemy.Column(type_ = sqlalchemy.String)
+    # the id of the group (see DBGroup)
+    groupId         = sqlalchemy.Column(sqlalchemy.ForeignKey(DBGroup.groupId), name = 'group_id', type_ = sqlalchemy.Integer, nullable = True)
 
-    # comment
-    comment         = sqlalchemy.Column(type_ = sqlalchemy.String)
+    # the id of the comment (see DBComment)
+    commentId       = sqlalchemy.Column(sqlalchemy.ForeignKey(DBComment.commentId), name = 'comment_id', type_ = sqlalchemy.Integer, nullable = True)
 
     # size in bytes
     fileSize        = sqlalchemy.Column(name = 'size', type_ = sqlalchemy.Integer)
@@ -48,12 +70,27 @@ class DBFile(DBBase):
     # ED2K checksum
     ed2k            = sqlalchemy.Column(type_ = sqlalchemy.String)
     # }}}
+
+    # SQLAlchemy properties loading the group and the comment by their ids {{{
+    # NOTE: the values set to them are kept through flushes (they are not
+    # NOTE: expired), so a stored DBFile() doesn't have to be refreshed
+    group           = column_property(
+            sqlalchemy.select([DBGroup.name]).where(DBGroup.groupId == groupId).correlate_except(DBGroup).as_scalar(),
+            expire_on_flush = False,
+    )
+
+    comment         = column_property(
+            sqlalchemy.select([DBComment.text]).where(DBComment.commentId == commentId).correlate_except(DBComment).as_scalar(),
+            expire_on_flush = False,
+    )
+    # }}}
     # }}}
 
 
     # METHODS {{{
     def __init__(self, fileId=None, fileName=None, group=None, comment=None,
-                 fileSize=None, md1=None, md5=None, ed2k=None):
+                 fileSize=None, md1=None, md5=None, ed2k=None, groupId=None,
+                 commentId=None):
         # DOC {{{
         """Initializes the instance of the ORM representation of registered
         file.
@@ -75,6 +112,10 @@ def __init__(self, fileId=None, fileName=None, group=None, comment=None,
             md5 -- (optional) the MD5 of the entire file
 
             ed2k -- (optional) the ED2K sum of the entire file
+
+            groupId -- (optional) the ID of the group in the DB
+
+            commentId -- (optional) the ID of the comment in the DB
         """
         # }}}
 
@@ -94,6 +135,8 @@ def __init__(self, fileId=None, fileName=None, group=None, comment=None,
         self.md1            = md1
         self.md5            = md5
         self.ed2k           = ed2k
+        self.groupId        = groupId
+        self.commentId      = commentId
         # }}}
         # }}}
 
@@ -1,20 +1,23 @@
 ##
 ## DBFileQueryArguments.py
-##      - Provides storage for filter values of queries about DBFile()s.
+##      - Provides storage for filter values, ordering and paging of queries
+##        about DBFile()s.
 ##
 
 
 # class DBFileQueryArguments() {{{
 class DBFileQueryArguments(object):
     # DOC {{{
-    """Provides storage for filter values of queries about DBFile()s.
+    """Provides storage for filter values, ordering and paging of queries
+    about DBFile()s.
     """
     # }}}
 
 
     # STATIC VARIABLES {{{
     # prevent assignment/creation of any other instance attributes than those listed
-    __slots__   = [ 'fileId', 'fileName', 'group', 'comment', 'fileSize', 'md1', 'md5', 'ed2k',]
+    __slots__   = [ 'fileId', 'fileName', 'group', 'comment', 'fileSize', 'md1', 'md5', 'ed2k',
+                    'minFileSize', 'maxFileSize', 'orderBy', 'descending', 'limit', 'offset', 'afterFileId',]
 
     # sentinel representing undefined value (to allow e.g. None and empty strings as valid values)
     _UNDEFINED  = object()
@@ -25,7 +28,10 @@ class DBFileQueryArguments(object):
     def __init__(self, fileId = _UNDEFINED, fileName = _UNDEFINED,
                  group = _UNDEFINED, comment = _UNDEFINED,
                  fileSize = _UNDEFINED, md1 = _UNDEFINED, md5 = _UNDEFINED,
-                 ed2k = _UNDEFINED):
+                 ed2k = _UNDEFINED, minFileSize = _UNDEFINED,
+                 maxFileSize = _UNDEFINED, orderBy = _UNDEFINED,
+                 descending = _UNDEFINED, limit = _UNDEFINED,
+                 offset = _UNDEFINED, afterFileId = _UNDEFINED):
         # DOC {{{
         """Initializes the instance, stores the parameters.
 
@@ -55,6 +61,27 @@ def __init__(self, fileId = _UNDEFINED, fileName = _UNDEFINED,
             ed2k -- (optional) the ED2K sum of the entire file of a DBFile() to
                 match as is
 
+            minFileSize -- (optional) the smallest size of a file of a
+                DBFile() to match
+
+            maxFileSize -- (optional) the largest size of a file of a
+                DBFile() to match
+
+            orderBy -- (optional) the key of the column to order the
+                DBFile()s by (see DBFileRegister.ORDER_BY_COLUMNS), by
+                fileId if undefined
+
+            descending -- (optional) whether to order the DBFile()s in the
+                descending order
+
+            limit -- (optional) the maximal number of DBFile()s to return
+
+            offset -- (optional) the number of the first DBFile()s to skip
+
+            afterFileId -- (optional) the identification of the last DBFile()
+                of the previous page, only the DBFile()s ordered after it are
+                returned (keyset pagination)
+
         """
         # }}}
 
@@ -68,6 +95,13 @@ def __init__(self, fileId = _UNDEFINED, fileName = _UNDEFINED,
         self.md1        = md1
         self.md5        = md5
         self.ed2k       = ed2k
+        self.minFileSize    = minFileSize
+        self.maxFileSize    = maxFileSize
+        self.orderBy        = orderBy
+        self.descending     = descending
+        self.limit          = limit
+        self.offset         = offset
+        self.afterFileId    = afterFileId
         # }}}
 
 
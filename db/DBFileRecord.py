@@ -0,0 +1,34 @@
+##
+## DBFileRecord.py
+##      - A compact read-only record of a row in the "file" table (with its
+##        group and comment) for the paths that only read the DBFile()s.
+##
+
+
+# import of required modules {{{
+import collections
+# }}}
+
+
+# class DBFileRecord() {{{
+class DBFileRecord(collections.namedtuple('DBFileRecord',
+        ('fileId', 'fileName', 'group', 'comment', 'fileSize', 'md1', 'md5', 'ed2k', 'groupId', 'commentId',))):
+    # DOC {{{
+    """A compact read-only record of a row in the "file" table having the
+    attributes of DBFile() (including the group and the comment).
+
+    It is a plain tuple without any instance dictionary or ORM state, so it
+    takes a fraction of the memory of a DBFile() and is created much faster.
+    The queries return it on the paths that only read the DBFile()s
+    (listing, exporting, comparing, see DBFileRegister.iterateQuery()). The
+    attributes that were not loaded are None. A changed copy is returned by
+    _replace().
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # no instance dictionary
+    __slots__ = ()
+    # }}}
+# }}}
@@ -8,8 +8,20 @@
 # import of required modules {{{
 import re
 
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import null
+from sqlalchemy import select
+from sqlalchemy import tuple_
+
+from .DBComment import DBComment
 from .DBFile import DBFile
+from .DBGroup import DBGroup
 from .DBFileQueryArguments import DBFileQueryArguments
+from .DBFileRecord import DBFileRecord
+from .DBFileSearchIndex import DBFileSearchIndex
 # }}}
 
 
@@ -26,6 +38,21 @@ class DBFileRegister(object):
     # a compiled regular expression that matches the begining, the end, all spaces and
     # percent signs of a string to replace these parts of that string with a single percent sign
     _LIKELIZE_VALUE_RE           = re.compile(r'(%|^|$|\s)+')
+
+    # the number of values looked up in one query (safely below SQLite's limit of variables)
+    LOOKUP_BATCH_SIZE            = 500
+
+    # the columns the DBFile()s can be ordered by (all of them are indexed) by their keys {{{
+    # NOTE: not by the group, it is a correlated subquery of the "filegroup"
+    # NOTE: table, so every page would be sorted in full
+    ORDER_BY_COLUMNS = {
+            'id'    : DBFile.fileId,
+            'name'  : DBFile.fileName,
+            'size'  : DBFile.fileSize,
+            'md5'   : DBFile.md5,
+            'ed2k'  : DBFile.ed2k,
+    }
+    # }}}
     # }}}
 
     # METHODS {{{
@@ -123,6 +150,211 @@ def queryExists(cls, session, dbFileQueryArguments = None, **kwargs):
         # }}}
 
 
+    @classmethod
+    def iterateQuery(cls, session, dbFileQueryArguments = None, batchSize = 1000, columns = None, **kwargs):
+        # DOC {{{
+        """Returns an iterator of all DBFile()s matching the specified
+        DBFileQueryArguments(). The DBFile()s are loaded from the database in
+        batches of the specified size rather than all at once. If columns are
+        specified only they are loaded and the iterator yields read-only
+        DBFileRecord()s (the other attributes are None) instead of DBFile()s,
+        which is much lighter for the paths that only read them. Any surplus
+        keyword arguments are added to the DBFileQueryArguments() or used to
+        build it if it was not specified.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+
+            dbFileQueryArguments -- (optional) an instance of
+                DBFileQueryArguments()
+
+            batchSize -- (optional) the number of DBFile()s loaded at once
+
+            columns -- (optional) an iterable of names of DBFile()'s
+                attributes to load (e.g. ('fileId', 'fileName',))
+
+            **kwargs -- any surplus keyword arguments are added to the
+                specified DBFileQueryArguments() or used to build a new one.
+        """
+        # }}}
+
+        # CODE {{{
+        # build the SQLAlchemy's Query() from the specified DBFileQueryArguments() in the Session()
+        query = cls._buildQuery(session, dbFileQueryArguments, **kwargs)
+
+        # load only the specified columns as DBFileRecord()s if there are any {{{
+        if (columns is not None):
+            return map(DBFileRecord._make, cls._selectRecordColumns(query, columns).yield_per(batchSize))
+        # }}}
+
+        # return an iterator loading the matching DBFile()s in batches
+        return iter(query.yield_per(batchSize))
+        # }}}
+
+
+    @classmethod
+    def count(cls, session, dbFileQueryArguments = None, **kwargs):
+        # DOC {{{
+        """Returns the number of DBFile()s matching the specified
+        DBFileQueryArguments() (including the limit and offset if defined)
+        without loading them. Any surplus keyword arguments are added to the
+        DBFileQueryArguments() or used to build it if it was not specified.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+
+            dbFileQueryArguments -- (optional) an instance of
+                DBFileQueryArguments()
+
+            **kwargs -- any surplus keyword arguments are added to the
+                specified DBFileQueryArguments() or used to build a new one.
+        """
+        # }}}
+
+        # CODE {{{
+        # build the SQLAlchemy's Query() from the specified DBFileQueryArguments() in the Session()
+        query = cls._buildQuery(session, dbFileQueryArguments, **kwargs)
+
+        # count the matching DBFile()s
+        return query.count()
+        # }}}
+
+
+    @staticmethod
+    def iterateDuplicates(session, batchSize = 1000, columns = None, minFileSize = None):
+        # DOC {{{
+        """Returns an iterator of all DBFile()s whose content (size, MD5 and
+        ED2K) is registered more than once. The DBFile()s of the same content
+        come one after another ordered by fileId, the contents are ordered by
+        MD5. The duplicate contents are found by grouping the content index
+        and the DBFile()s are loaded in batches of the specified size. If
+        columns are specified only they are loaded and the iterator yields
+        read-only DBFileRecord()s (the other attributes are None) instead of
+        DBFile()s.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+
+            batchSize -- (optional) the number of DBFile()s loaded at once
+
+            columns -- (optional) an iterable of names of DBFile()'s
+                attributes to load (e.g. ('fileId', 'fileName',))
+
+            minFileSize -- (optional) the smallest size of the duplicates to
+                look for
+        """
+        # }}}
+
+        # CODE {{{
+        # the contents registered more than once (grouped in the order of the content index) {{{
+        duplicates = session.query(DBFile.md5, DBFile.fileSize, DBFile.ed2k).group_by(
+                DBFile.md5, DBFile.fileSize, DBFile.ed2k).having(func.count() > 1)
+
+        if (minFileSize is not None):
+            duplicates = duplicates.filter(DBFile.fileSize >= minFileSize)
+
+        duplicates = duplicates.subquery()
+        # }}}
+
+        # all the DBFile()s of these contents, one content after another {{{
+        query = session.query(DBFile).join(duplicates, and_(
+                DBFile.md5 == duplicates.c.md5,
+                DBFile.fileSize == duplicates.c.size,
+                DBFile.ed2k == duplicates.c.ed2k,
+        )).order_by(DBFile.md5, DBFile.fileSize, DBFile.ed2k, DBFile.fileId)
+        # }}}
+
+        # load only the specified columns as DBFileRecord()s if there are any {{{
+        if (columns is not None):
+            return map(DBFileRecord._make, DBFileRegister._selectRecordColumns(query, columns).yield_per(batchSize))
+        # }}}
+
+        # return an iterator loading the DBFile()s in batches
+        return iter(query.yield_per(batchSize))
+        # }}}
+
+
+    @staticmethod
+    def lookup(session, attributeName, values, columns = ('fileId',)):
+        # DOC {{{
+        """Returns a dictionary of lists of rows by the values of the
+        specified attribute of all DBFile()s whose attribute equals any of
+        the specified values. The values are looked up in batches of
+        LOOKUP_BATCH_SIZE using the attribute's index, the values that
+        nothing matches are missing in the dictionary. Every row has the
+        specified columns only (and the attribute itself).
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+
+            attributeName -- the name of DBFile()'s attribute to look up
+                (e.g. 'md5')
+
+            values -- an iterable of the values to look up
+
+            columns -- (optional) an iterable of names of DBFile()'s
+                attributes to load (e.g. ('fileId', 'fileSize',))
+        """
+        # }}}
+
+        # CODE {{{
+        attribute = getattr(DBFile, attributeName)
+        values = list(set(values))
+        rowsByValues = dict()
+
+        # build the statement once, the batch of values is expanded to the IN
+        # clause on execution (building the IN clause of every batch is slow) {{{
+        statement = select(
+                [attribute.label(attributeName)] + [getattr(DBFile, column).label(column) for column in columns]
+        ).where(attribute.in_(bindparam('values', expanding = True)))
+        # }}}
+
+        # query the values batch by batch and collect the matching rows {{{
+        for start in range(0, len(values), DBFileRegister.LOOKUP_BATCH_SIZE):
+            for row in session.execute(statement, {'values' : values[start:start + DBFileRegister.LOOKUP_BATCH_SIZE]}):
+                rowsByValues.setdefault(row[0], []).append(row)
+        # }}}
+
+        return rowsByValues
+        # }}}
+
+
+    @staticmethod
+    def _selectRecordColumns(query, columns):
+        # DOC {{{
+        """Returns the query selecting the columns of DBFileRecord() in its
+        order, the specified columns are loaded and the others are NULL.
+        Raises AttributeError() if a column is not an attribute of
+        DBFileRecord().
+
+        Parameters
+
+            query -- an instance of SQLAlchemy's Query() of DBFile()s
+
+            columns -- an iterable of names of DBFile()'s attributes to load
+                (e.g. ('fileId', 'fileName',))
+        """
+        # }}}
+
+        # CODE {{{
+        columns = set(columns)
+
+        # check that the columns exist {{{
+        for column in columns.difference(DBFileRecord._fields):
+            raise AttributeError("'DBFileRecord' object has no attribute '{}'".format(column))
+        # }}}
+
+        return query.with_entities(*(
+                getattr(DBFile, column) if (column in columns) else null().label(column)
+                for column in DBFileRecord._fields
+        ))
+        # }}}
+
+
     @staticmethod
     def _buildQuery(session, dbFileQueryArguments = None, **kwargs):
         # DOC {{{
@@ -178,19 +410,33 @@ def _buildQuery(session, dbFileQueryArguments = None, **kwargs):
             query = query.filter(DBFile.fileId == dbFileQueryArguments.fileId)
         # }}}
 
+        # narrow the query down using the full text search index (if present)
+        # over fileName if it is defined {{{
+        if (DBFileSearchIndex.isUsable(session) and isDefined(dbFileQueryArguments.fileName) and dbFileQueryArguments.fileName):
+            searchIndexFilter = DBFileSearchIndex.buildFilter(DBFile.fileId, {'name' : dbFileQueryArguments.fileName})
+
+            if (searchIndexFilter is not None):
+                query = query.filter(searchIndexFilter)
+        # }}}
+
         # add a 'like' filter over fileName if the corresponding query argument is defined {{{
         if (isDefined(dbFileQueryArguments.fileName)):
             query = query.filter(DBFile.fileName.ilike(DBFileRegister._likelizeString(dbFileQueryArguments.fileName)))
         # }}}
 
-        # add a 'like' filter over group if the corresponding query argument is defined {{{
+        # add a filter over groupId matching the groups in 'like' fashion if
+        # the corresponding query argument is defined (the few groups are
+        # matched first, then the DBFile()s are looked up by the index) {{{
         if (isDefined(dbFileQueryArguments.group)):
-            query = query.filter(DBFile.group.ilike(DBFileRegister._likelizeString(dbFileQueryArguments.group)))
+            query = query.filter(DBFile.groupId.in_(
+                    select([DBGroup.groupId]).where(DBGroup.name.ilike(DBFileRegister._likelizeString(dbFileQueryArguments.group)))))
         # }}}
 
-        # add a 'like' filter over comment if the corresponding query argument is defined {{{
+        # add a filter over commentId matching the comments in 'like' fashion
+        # if the corresponding query argument is defined {{{
         if (isDefined(dbFileQueryArguments.comment)):
-            query = query.filter(DBFile.comment.ilike(DBFileRegister._likelizeString(dbFileQueryArguments.comment)))
+            query = query.filter(DBFile.commentId.in_(
+                    select([DBComment.commentId]).where(DBComment.text.ilike(DBFileRegister._likelizeString(dbFileQueryArguments.comment)))))
         # }}}
 
         # add an equality filter over fileSize if the corresponding query argument is defined {{{
@@ -213,6 +459,63 @@ def _buildQuery(session, dbFileQueryArguments = None, **kwargs):
             query = query.filter(DBFile.ed2k == dbFileQueryArguments.ed2k)
         # }}}
 
+        # add range filters over fileSize if the corresponding query arguments are defined {{{
+        if (isDefined(dbFileQueryArguments.minFileSize)):
+            query = query.filter(DBFile.fileSize >= dbFileQueryArguments.minFileSize)
+
+        if (isDefined(dbFileQueryArguments.maxFileSize)):
+            query = query.filter(DBFile.fileSize <= dbFileQueryArguments.maxFileSize)
+        # }}}
+
+        # determine the ordering, order by fileId within the same values of the
+        # ordering column so the order (and therefore any page) is stable {{{
+        orderByColumn = DBFile.fileId
+        if (isDefined(dbFileQueryArguments.orderBy)):
+            orderByColumn = DBFileRegister.ORDER_BY_COLUMNS[dbFileQueryArguments.orderBy]
+
+        descending = (isDefined(dbFileQueryArguments.descending) and dbFileQueryArguments.descending)
+
+        orderByColumns = (orderByColumn,) if (orderByColumn is DBFile.fileId) else (orderByColumn, DBFile.fileId,)
+        # }}}
+
+        # add a keyset filter skipping all DBFile()s up to the specified one
+        # (inclusive) in the order if the corresponding query argument is defined {{{
+        # NOTE: DBFile()s with NULL in the ordering column can't be compared,
+        # NOTE: so they are never returned after the specified one
+        if (isDefined(dbFileQueryArguments.afterFileId)):
+            # compare (value, fileId) pairs with the one of the specified DBFile() {{{
+            if (len(orderByColumns) > 1):
+                keyset = tuple_(*orderByColumns)
+                afterKeyset = tuple_(
+                        session.query(orderByColumn).filter(DBFile.fileId == dbFileQueryArguments.afterFileId).as_scalar(),
+                        dbFileQueryArguments.afterFileId,
+                )
+            # }}}
+            # compare just the fileId when ordering by fileId {{{
+            else:
+                keyset = DBFile.fileId
+                afterKeyset = dbFileQueryArguments.afterFileId
+            # }}}
+
+            query = query.filter((keyset < afterKeyset) if descending else (keyset > afterKeyset))
+        # }}}
+
+        # order the query {{{
+        if (descending):
+            orderByColumns = tuple(column.desc() for column in orderByColumns)
+
+        query = query.order_by(None).order_by(*orderByColumns)
+        # }}}
+
+        # limit the query and skip the specified number of the first DBFile()s
+        # if the corresponding query arguments are defined {{{
+        if (isDefined(dbFileQueryArguments.limit)):
+            query = query.limit(dbFileQueryArguments.limit)
+
+        if (isDefined(dbFileQueryArguments.offset)):
+            query = query.offset(dbFileQueryArguments.offset)
+        # }}}
+
         # return the prepared query
         return query
         # }}}
@@ -239,10 +542,68 @@ def _likelizeString(value):
 
 
     @staticmethod
-    def insert(session, *dbfs, commit=True):
+    def _determineId(session, idAttribute, valueAttribute, value, ids = None):
+        # DOC {{{
+        """Returns the ID of the specified value (a group or a comment) in
+        its table, the value is stored first if it is not there yet. Returns
+        None for no (None or empty) value.
+
+        A new value is inserted unless it is there already and then looked
+        up again, so a process storing the same value at the same time does
+        not make the insert fail on the unique value.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+
+            idAttribute -- the ID's attribute (DBGroup.groupId or
+                DBComment.commentId)
+
+            valueAttribute -- the value's attribute (DBGroup.name or
+                DBComment.text)
+
+            value -- the value to determine the ID of
+
+            ids -- (optional) a dictionary of already determined IDs by the
+                values, the ID is added to it
+        """
+        # }}}
+
+        # CODE {{{
+        # no value has no ID {{{
+        if (not value):
+            return None
+        # }}}
+
+        # return the already determined ID if any {{{
+        if ((ids is not None) and (value in ids)):
+            return ids[value]
+        # }}}
+
+        # look the ID up
+        valueId = session.query(idAttribute).filter(valueAttribute == value).scalar()
+
+        # store the value if it is new (unless another process has just stored it) and look the ID up again {{{
+        if (valueId is None):
+            session.execute(insert(valueAttribute.class_.__table__).prefix_with("OR IGNORE").values({valueAttribute.expression: value}))
+            valueId = session.query(idAttribute).filter(valueAttribute == value).scalar()
+        # }}}
+
+        # remember the ID if requested {{{
+        if (ids is not None):
+            ids[value] = valueId
+        # }}}
+
+        return valueId
+        # }}}
+
+
+    @classmethod
+    def insert(cls, session, *dbfs, commit=True):
         # DOC {{{
         """Inserts the specified DBFile()s  into the database. The session is
-        commited after the insert if commit is True.
+        commited after the insert if commit is True. The groups and the
+        comments of the DBFile()s are stored as well if they are new.
         """
         # }}}
 
@@ -250,7 +611,13 @@ def insert(session, *dbfs, commit=True):
         if not dbfs:
             raise ValueError("No DBFiles() specified!")
 
+        # the IDs of the groups and the comments determined during this insert
+        groupIds = dict()
+        commentIds = dict()
+
         for dbf in dbfs:
+            dbf.groupId = cls._determineId(session, DBGroup.groupId, DBGroup.name, dbf.group, groupIds)
+            dbf.commentId = cls._determineId(session, DBComment.commentId, DBComment.text, dbf.comment, commentIds)
             session.add(dbf)
             session.flush()     # this will refresh the fileId
 
@@ -260,13 +627,14 @@ def insert(session, *dbfs, commit=True):
 
 
     @classmethod
-    def update(cls, session, dbf, setall=False):
+    def update(cls, session, dbf, setall=False, commit=True):
         # DOC {{{
         """Updates a DBFile() persisted in the database specified by the given
         DBFile()'s fileId with the properties from the specified DBFile().
         Only filename, group and comment are updated. Returns True if the
         update was successfull, returns False if the record doesnt exists or
-        nothing was set.
+        nothing was set. The session is commited after the update if commit
+        is True.
         """
         # }}}
 
@@ -287,10 +655,12 @@ def update(cls, session, dbf, setall=False):
 
         if dbf.group or setall:
             persistedDBFile.group = dbf.group if dbf.group != "" else None
+            persistedDBFile.groupId = cls._determineId(session, DBGroup.groupId, DBGroup.name, persistedDBFile.group)
             changed = True
 
         if dbf.comment or setall:
             persistedDBFile.comment = dbf.comment if dbf.comment != "" else None
+            persistedDBFile.commentId = cls._determineId(session, DBComment.commentId, DBComment.text, persistedDBFile.comment)
             changed = True
 
         if changed:
@@ -303,8 +673,10 @@ def update(cls, session, dbf, setall=False):
             # remove the instance from the session so attributes will not expire and would not need to be refreshed
             session.expunge(persistedDBFile)
 
-            # commit the session
-            session.commit()
+            # commit the session if requested {{{
+            if commit:
+                session.commit()
+            # }}}
 
             # NOTE: another approach to the add-flush-expunge-commit would be
             # NOTE: to add-commit-refresh but:
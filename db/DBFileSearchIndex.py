@@ -0,0 +1,221 @@
+##
+## DBFileSearchIndex.py
+##      - Maintains the optional SQLite FTS5 full text search index of the
+##        names of the DBFile()s and builds the filters that use it.
+##
+
+
+# import of required modules {{{
+import re
+
+from sqlalchemy import literal_column
+from sqlalchemy import select
+from sqlalchemy import text
+# }}}
+
+
+# class DBFileSearchIndex() {{{
+class DBFileSearchIndex(object):
+    # DOC {{{
+    """Maintains the optional SQLite FTS5 full text search index of the
+    names of the DBFile()s and builds the filters that use it. (The groups
+    and the comments are few distinct values in their own tables, see
+    DBGroup() and DBComment(), matching them needs no index.)
+
+    The index is an external content FTS5 table over the "file" table using
+    the trigram tokenizer, so it can find any substring (of at least three
+    characters) of the indexed values. Triggers keep it in sync with the
+    "file" table on insert, update and delete.
+
+    The index only narrows the candidates down, the filters built from it are
+    meant to be used together with the original 'like' filters which keep
+    the exact semantics of the query.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the name of the FTS5 table
+    TABLE_NAME                  = "file_fts"
+
+    # the beginnings of the SQLite's error messages meaning it does not support FTS5 or the trigram tokenizer
+    _UNSUPPORTED_ERROR_MESSAGES = ("no such module", "no such tokenizer",)
+
+    # the key of Session().info telling whether the index is present
+    SESSION_INFO_KEY            = "fileSearchIndex"
+
+    # the shortest term the trigram tokenizer can search for
+    _MINIMAL_TERM_LENGTH        = 3
+
+    # a compiled regular expression that splits a 'like' pattern (or a query
+    # value) to the literal terms every matching value must contain
+    _SPLIT_TERMS_RE             = re.compile(r'[%_\s]+')
+
+    # the statements creating the index (the table, the triggers and the content) {{{
+    _CREATE_STATEMENTS = (
+            """CREATE VIRTUAL TABLE IF NOT EXISTS file_fts USING fts5(
+                name,
+                content = 'file', content_rowid = 'idno', tokenize = 'trigram'
+            )""",
+            """CREATE TRIGGER IF NOT EXISTS file_fts_insert AFTER INSERT ON file BEGIN
+                INSERT INTO file_fts(rowid, name) VALUES (new.idno, new.name);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS file_fts_delete AFTER DELETE ON file BEGIN
+                INSERT INTO file_fts(file_fts, rowid, name) VALUES ('delete', old.idno, old.name);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS file_fts_update AFTER UPDATE OF name ON file BEGIN
+                INSERT INTO file_fts(file_fts, rowid, name) VALUES ('delete', old.idno, old.name);
+                INSERT INTO file_fts(rowid, name) VALUES (new.idno, new.name);
+            END""",
+            """INSERT INTO file_fts(file_fts) VALUES ('rebuild')""",
+    )
+    # }}}
+
+    # the statements dropping the index {{{
+    _DROP_STATEMENTS = (
+            """DROP TRIGGER IF EXISTS file_fts_insert""",
+            """DROP TRIGGER IF EXISTS file_fts_delete""",
+            """DROP TRIGGER IF EXISTS file_fts_update""",
+            """DROP TABLE IF EXISTS file_fts""",
+    )
+    # }}}
+    # }}}
+
+
+    # METHODS {{{
+    @staticmethod
+    def exists(connection):
+        # DOC {{{
+        """Returns True if the index exists in the database, False otherwise.
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        return (connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                name = DBFileSearchIndex.TABLE_NAME,
+        ).scalar() is not None)
+        # }}}
+
+
+    @staticmethod
+    def create(connection):
+        # DOC {{{
+        """Creates the index and fills it with the current content of the
+        "file" table in one transaction.
+
+        Raises SQLAlchemy's OperationalError() if the SQLite does not support
+        FTS5 or the trigram tokenizer (SQLite 3.34.0+).
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        with connection.begin():
+            for statement in DBFileSearchIndex._CREATE_STATEMENTS:
+                connection.execute(statement)
+        # }}}
+
+
+    @staticmethod
+    def isUnsupportedError(error):
+        # DOC {{{
+        """Returns True if the specified SQLAlchemy's OperationalError() (of
+        create()) has been caused by the SQLite not supporting FTS5 or the
+        trigram tokenizer, False otherwise.
+
+        Parameters
+
+            error -- an OperationalError()
+        """
+        # }}}
+
+        # CODE {{{
+        return str(getattr(error, "orig", error)).startswith(DBFileSearchIndex._UNSUPPORTED_ERROR_MESSAGES)
+        # }}}
+
+
+    @staticmethod
+    def drop(connection):
+        # DOC {{{
+        """Drops the index (if it exists) in one transaction.
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        with connection.begin():
+            for statement in DBFileSearchIndex._DROP_STATEMENTS:
+                connection.execute(statement)
+        # }}}
+
+
+    @staticmethod
+    def isUsable(session):
+        # DOC {{{
+        """Returns True if the index is present in the database of the
+        specified session (see DBConnection()), False otherwise.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+        """
+        # }}}
+
+        # CODE {{{
+        return session.info.get(DBFileSearchIndex.SESSION_INFO_KEY, False)
+        # }}}
+
+
+    @staticmethod
+    def buildFilter(keyColumn, valuesByColumnNames):
+        # DOC {{{
+        """Returns a filter limiting the keyColumn (DBFile.fileId) to the rows
+        whose indexed columns contain all the terms of the respective values
+        or None if no value contains a term long enough to be searched for.
+
+        Parameters
+
+            keyColumn -- the SQLAlchemy's column to filter (DBFile.fileId)
+
+            valuesByColumnNames -- a dictionary of query values (or 'like'
+                patterns) by the names of the indexed columns ('name')
+        """
+        # }}}
+
+        # CODE {{{
+        # build a term query for every term long enough for the trigram tokenizer {{{
+        terms = []
+
+        for columnName, value in valuesByColumnNames.items():
+            for term in DBFileSearchIndex._SPLIT_TERMS_RE.split(value):
+                if (len(term) >= DBFileSearchIndex._MINIMAL_TERM_LENGTH):
+                    terms.append('{{{}}} : "{}"'.format(columnName, term.replace('"', '""')))
+        # }}}
+
+        # return None if there is nothing to search for {{{
+        if (not terms):
+            return None
+        # }}}
+
+        # return the filter limiting the key to the rows matching all the terms {{{
+        match = select([literal_column("rowid")]).select_from(text(DBFileSearchIndex.TABLE_NAME)).where(
+                text(DBFileSearchIndex.TABLE_NAME + " MATCH :match").bindparams(match = " AND ".join(terms)))
+
+        return keyColumn.in_(match)
+        # }}}
+        # }}}
+
+
+    # }}}
+# }}}
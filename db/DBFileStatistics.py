@@ -0,0 +1,190 @@
+##
+## DBFileStatistics.py
+##      - Maintains the statistics of the DBFile()s (the files and bytes per
+##        group, the totals and the duplicates) updated by triggers and
+##        provides means to read them.
+##
+
+
+# import of required modules {{{
+from sqlalchemy import text
+# }}}
+
+
+# class DBFileStatistics() {{{
+class DBFileStatistics(object):
+    # DOC {{{
+    """Maintains the statistics of the DBFile()s updated by triggers and
+    provides means to read them.
+
+    The "groupstats" table holds the number of files and their total size
+    per group (group_id 0 stands for no group). The single row "filestats"
+    table holds the totals and the duplicates: the number of contents (size,
+    MD5 and ED2K) registered more than once, the number of redundant files
+    (all but one of every such content) and their total size.
+
+    The triggers update the statistics in the same transaction as the
+    insert, update or delete of a DBFile(), so reading them takes time
+    proportional to the number of groups rather than to the number of
+    files. The duplicates of a content are counted using the content
+    index (MD5, size and ED2K).
+
+    NOTE: The duplicates are not updated when a size or a checksum of a
+    NOTE: DBFile() changes, which never happens (see DBFileRegister.update()).
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the name of the table with the totals
+    TABLE_NAME                  = "filestats"
+
+    # the number of the registered files with the same content as the row
+    # 'row' (new or old) of the "file" table (including it if it exists)
+    _CONTENT_FILES = """(SELECT count(*) FROM file
+            WHERE file.md5 = {row}.md5 AND file.size = {row}.size AND file.ed2k = {row}.ed2k)"""
+
+    # the statements creating the statistics (the tables, the triggers and the content) {{{
+    _CREATE_STATEMENTS = (
+            """CREATE TABLE IF NOT EXISTS groupstats (
+                group_id INTEGER NOT NULL PRIMARY KEY,
+                files INTEGER NOT NULL,
+                bytes INTEGER NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS filestats (
+                id INTEGER NOT NULL PRIMARY KEY CHECK (id = 1),
+                files INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                duplicatecontents INTEGER NOT NULL,
+                duplicatefiles INTEGER NOT NULL,
+                duplicatebytes INTEGER NOT NULL
+            )""",
+            """CREATE TRIGGER IF NOT EXISTS filestats_insert AFTER INSERT ON file BEGIN
+                INSERT INTO groupstats (group_id, files, bytes)
+                    VALUES (coalesce(new.group_id, 0), 1, coalesce(new.size, 0))
+                    ON CONFLICT (group_id) DO UPDATE SET files = files + 1, bytes = bytes + excluded.bytes;
+                UPDATE filestats SET
+                    files = files + 1,
+                    bytes = bytes + coalesce(new.size, 0),
+                    duplicatecontents = duplicatecontents + (""" + _CONTENT_FILES.format(row = "new") + """ = 2),
+                    duplicatefiles = duplicatefiles + (""" + _CONTENT_FILES.format(row = "new") + """ > 1),
+                    duplicatebytes = duplicatebytes + (""" + _CONTENT_FILES.format(row = "new") + """ > 1) * coalesce(new.size, 0);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS filestats_delete AFTER DELETE ON file BEGIN
+                UPDATE groupstats SET files = files - 1, bytes = bytes - coalesce(old.size, 0)
+                    WHERE group_id = coalesce(old.group_id, 0);
+                DELETE FROM groupstats WHERE group_id = coalesce(old.group_id, 0) AND files = 0;
+                UPDATE filestats SET
+                    files = files - 1,
+                    bytes = bytes - coalesce(old.size, 0),
+                    duplicatecontents = duplicatecontents - (""" + _CONTENT_FILES.format(row = "old") + """ = 1),
+                    duplicatefiles = duplicatefiles - (""" + _CONTENT_FILES.format(row = "old") + """ > 0),
+                    duplicatebytes = duplicatebytes - (""" + _CONTENT_FILES.format(row = "old") + """ > 0) * coalesce(old.size, 0);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS filestats_update AFTER UPDATE OF group_id ON file
+                    WHEN coalesce(old.group_id, 0) != coalesce(new.group_id, 0) BEGIN
+                UPDATE groupstats SET files = files - 1, bytes = bytes - coalesce(old.size, 0)
+                    WHERE group_id = coalesce(old.group_id, 0);
+                DELETE FROM groupstats WHERE group_id = coalesce(old.group_id, 0) AND files = 0;
+                INSERT INTO groupstats (group_id, files, bytes)
+                    VALUES (coalesce(new.group_id, 0), 1, coalesce(new.size, 0))
+                    ON CONFLICT (group_id) DO UPDATE SET files = files + 1, bytes = bytes + excluded.bytes;
+            END""",
+            """INSERT INTO groupstats (group_id, files, bytes)
+                SELECT coalesce(group_id, 0), count(*), coalesce(sum(size), 0) FROM file GROUP BY coalesce(group_id, 0)""",
+            """INSERT INTO filestats (id, files, bytes, duplicatecontents, duplicatefiles, duplicatebytes)
+                SELECT 1, totals.files, totals.bytes,
+                       coalesce(duplicates.contents, 0), coalesce(duplicates.files, 0), coalesce(duplicates.bytes, 0)
+                FROM (SELECT count(*) AS files, coalesce(sum(size), 0) AS bytes FROM file) AS totals,
+                     (SELECT count(*) AS contents, sum(files - 1) AS files, sum((files - 1) * size) AS bytes
+                        FROM (SELECT count(*) AS files, size FROM file
+                              WHERE md5 IS NOT NULL AND size IS NOT NULL AND ed2k IS NOT NULL
+                              GROUP BY size, md5, ed2k HAVING count(*) > 1)) AS duplicates""",
+    )
+    # }}}
+    # }}}
+
+
+    # METHODS {{{
+    @staticmethod
+    def exists(connection):
+        # DOC {{{
+        """Returns True if the statistics exist in the database, False
+        otherwise.
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        return (connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                name = DBFileStatistics.TABLE_NAME,
+        ).scalar() is not None)
+        # }}}
+
+
+    @staticmethod
+    def create(connection):
+        # DOC {{{
+        """Creates the statistics and computes them from the current content
+        of the "file" table in one transaction.
+
+        Parameters
+
+            connection -- an SQLAlchemy's Connection() to the database
+        """
+        # }}}
+
+        # CODE {{{
+        with connection.begin():
+            for statement in DBFileStatistics._CREATE_STATEMENTS:
+                connection.execute(statement)
+        # }}}
+
+
+    @staticmethod
+    def queryTotals(session):
+        # DOC {{{
+        """Returns a row with the totals: files, bytes, duplicatecontents,
+        duplicatefiles and duplicatebytes.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+        """
+        # }}}
+
+        # CODE {{{
+        return session.execute(
+                "SELECT files, bytes, duplicatecontents, duplicatefiles, duplicatebytes FROM filestats"
+        ).first()
+        # }}}
+
+
+    @staticmethod
+    def queryGroups(session):
+        # DOC {{{
+        """Returns a list of rows with the statistics of every group: group
+        (the name, None for no group), files and bytes ordered by bytes in the
+        descending order.
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+        """
+        # }}}
+
+        # CODE {{{
+        return session.execute(
+                """SELECT filegroup.name AS "group", groupstats.files, groupstats.bytes
+                FROM groupstats LEFT JOIN filegroup ON filegroup.id = groupstats.group_id
+                ORDER BY groupstats.bytes DESC, filegroup.name"""
+        ).fetchall()
+        # }}}
+
+
+    # }}}
+# }}}
@@ -0,0 +1,56 @@
+##
+## DBGroup.py
+##      - SQLAlchemy ORM object representing a row in the "filegroup" table,
+##        i.e. a distinct group of DBFile()s.
+##
+
+
+# import of required modules {{{
+import sqlalchemy
+
+from .DBBase import DBBase
+# }}}
+
+
+# class DBGroup() {{{
+class DBGroup(DBBase):
+    # DOC {{{
+    """SQLAlchemy ORM object representing a row in the "filegroup" table, i.e.
+    a distinct group of DBFile()s. Every group is stored just once and the
+    DBFile()s refer to it by its ID.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # SQLAlchemy table name
+    __tablename__ = "filegroup"
+
+    # SQLAlchemy columns {{{
+    # id (primary key)
+    groupId         = sqlalchemy.Column(name = 'id', type_ = sqlalchemy.Integer, primary_key = True)
+
+    # the group (unique)
+    name            = sqlalchemy.Column(type_ = sqlalchemy.String, nullable = False, unique = True)
+    # }}}
+    # }}}
+
+
+    # METHODS {{{
+    def __init__(self, name):
+        # DOC {{{
+        """Initializes the instance of the ORM representation of a group.
+
+        Parameters
+
+            name -- the group
+        """
+        # }}}
+
+        # CODE {{{
+        self.name           = name
+        # }}}
+
+
+    # }}}
+# }}}
@@ -0,0 +1,340 @@
+##
+## SQLiteFileRegister.py
+##      - Provides the methods of DBFileRegister() that query, store and
+##        update DBFile()s on the hot paths using the sqlite3 connection of
+##        the session directly (prepared statements and plain rows).
+##
+
+
+# import of required modules {{{
+from .DBFileQueryArguments import DBFileQueryArguments
+from .DBFileRecord import DBFileRecord
+from .DBFileRegister import DBFileRegister
+# }}}
+
+
+# class SQLiteFileRegister() {{{
+class SQLiteFileRegister(DBFileRegister):
+    # DOC {{{
+    """Provides the methods of DBFileRegister() that query, store and update
+    DBFile()s on the hot paths (matching the files by size and checksums,
+    registering and updating them) using the sqlite3 connection of the
+    session directly, without the ORM's query building, identity map and
+    unit of work. DBFileRegister() stays the reference implementation: the
+    semantics are the same and anything not implemented here (the 'like'
+    filters, ordering and paging, counting, streaming, ...) is done by it.
+
+    The statements are constant, so sqlite3 prepares each of them just once
+    (it caches the prepared statements by their text). The queries return
+    read-only DBFileRecord()s instead of DBFile()s.
+
+    The session's connection is used, so the statements run in the
+    session's transaction and the session commits or rolls them back as
+    usual. The busy errors are sqlite3's OperationalError()s (see
+    DBConnection.retryOnBusy()).
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the query arguments the statements are built from (the equalities and the size range) by the columns {{{
+    _QUERY_COLUMNS = (
+            ('fileId',      'file.idno = ?',),
+            ('fileSize',    'file.size = ?',),
+            ('md1',         'file.md1 = ?',),
+            ('md5',         'file.md5 = ?',),
+            ('ed2k',        'file.ed2k = ?',),
+            ('minFileSize', 'file.size >= ?',),
+            ('maxFileSize', 'file.size <= ?',),
+    )
+    # }}}
+
+    # the query arguments that are not supported, the query is done by DBFileRegister() if any of them is defined
+    _UNSUPPORTED_QUERY_ARGUMENTS = ('fileName', 'group', 'comment', 'orderBy', 'descending', 'limit', 'offset', 'afterFileId',)
+
+    # the statements {{{
+    _SELECT_STATEMENT = """SELECT file.idno, file.name, filegroup.name, filecomment.text,
+                file.size, file.md1, file.md5, file.ed2k, file.group_id, file.comment_id
+            FROM file
+                LEFT JOIN filegroup ON filegroup.id = file.group_id
+                LEFT JOIN filecomment ON filecomment.id = file.comment_id
+            WHERE {} ORDER BY file.idno{}"""
+
+    _INSERT_STATEMENT = """INSERT INTO file (idno, name, group_id, comment_id, size, md1, md5, ed2k)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+    _UPDATE_STATEMENT = """UPDATE file SET name = ?, group_id = ?, comment_id = ? WHERE idno = ?"""
+
+    _SELECT_GROUP_ID_STATEMENT = """SELECT id FROM filegroup WHERE name = ?"""
+
+    _INSERT_GROUP_STATEMENT = """INSERT OR IGNORE INTO filegroup (name) VALUES (?)"""
+
+    _SELECT_COMMENT_ID_STATEMENT = """SELECT id FROM filecomment WHERE text = ?"""
+
+    _INSERT_COMMENT_STATEMENT = """INSERT OR IGNORE INTO filecomment (text) VALUES (?)"""
+    # }}}
+    # }}}
+
+
+    # METHODS {{{
+    @classmethod
+    def query(cls, session, dbFileQueryArguments = None, **kwargs):
+        # DOC {{{
+        """Returns a list of all DBFileRecord()s matching the specified
+        DBFileQueryArguments() or None if no such rows were found (see
+        DBFileRegister.query()).
+        """
+        # }}}
+
+        # CODE {{{
+        statement = cls._buildStatement(dbFileQueryArguments, kwargs, first = False)
+
+        # let the reference implementation do the unsupported queries {{{
+        if (statement is None):
+            return super().query(session, dbFileQueryArguments, **kwargs)
+        # }}}
+
+        dbFileRecords = [DBFileRecord._make(row) for row in cls._determineConnection(session).execute(*statement)]
+
+        return dbFileRecords if (dbFileRecords) else None
+        # }}}
+
+
+    @classmethod
+    def queryFirst(cls, session, dbFileQueryArguments = None, **kwargs):
+        # DOC {{{
+        """Returns the first DBFileRecord() matching the specified
+        DBFileQueryArguments() or None if no such row was found (see
+        DBFileRegister.queryFirst()).
+        """
+        # }}}
+
+        # CODE {{{
+        statement = cls._buildStatement(dbFileQueryArguments, kwargs, first = True)
+
+        # let the reference implementation do the unsupported queries {{{
+        if (statement is None):
+            return super().queryFirst(session, dbFileQueryArguments, **kwargs)
+        # }}}
+
+        row = cls._determineConnection(session).execute(*statement).fetchone()
+
+        return DBFileRecord._make(row) if (row is not None) else None
+        # }}}
+
+
+    @classmethod
+    def insert(cls, session, *dbfs, commit=True):
+        # DOC {{{
+        """Inserts the specified DBFile()s into the database and sets their
+        fileId, groupId and commentId (see DBFileRegister.insert()).
+        """
+        # }}}
+
+        # CODE {{{
+        if not dbfs:
+            raise ValueError("No DBFiles() specified!")
+
+        connection = cls._determineConnection(session)
+
+        # the IDs of the groups and the comments determined during this insert
+        groupIds = dict()
+        commentIds = dict()
+
+        for dbf in dbfs:
+            dbf.groupId = cls._determineValueId(connection, cls._SELECT_GROUP_ID_STATEMENT, cls._INSERT_GROUP_STATEMENT, dbf.group, groupIds)
+            dbf.commentId = cls._determineValueId(connection, cls._SELECT_COMMENT_ID_STATEMENT, cls._INSERT_COMMENT_STATEMENT, dbf.comment, commentIds)
+            dbf.fileId = connection.execute(cls._INSERT_STATEMENT,
+                    (dbf.fileId, dbf.fileName, dbf.groupId, dbf.commentId, dbf.fileSize, dbf.md1, dbf.md5, dbf.ed2k,)).lastrowid
+
+        if commit:
+            session.commit()
+        # }}}
+
+
+    @classmethod
+    def update(cls, session, dbf, setall=False, commit=True):
+        # DOC {{{
+        """Updates the filename, group and comment of the DBFile() in the
+        database specified by the given DBFile()'s fileId and returns the
+        updated DBFileRecord() or None if the record does not exist or nothing
+        was set (see DBFileRegister.update()).
+        """
+        # }}}
+
+        # CODE {{{
+        persistedDBFileRecord = cls.queryFirst(
+                session = session,
+                fileId  = dbf.fileId,
+        )
+
+        if (persistedDBFileRecord is None):
+            return None
+
+        connection = cls._determineConnection(session)
+        changes = dict()
+
+        if dbf.fileName or setall:
+            changes['fileName'] = dbf.fileName if dbf.fileName != "" else None
+
+        if dbf.group or setall:
+            changes['group'] = dbf.group if dbf.group != "" else None
+            changes['groupId'] = cls._determineValueId(connection, cls._SELECT_GROUP_ID_STATEMENT, cls._INSERT_GROUP_STATEMENT, changes['group'])
+
+        if dbf.comment or setall:
+            changes['comment'] = dbf.comment if dbf.comment != "" else None
+            changes['commentId'] = cls._determineValueId(connection, cls._SELECT_COMMENT_ID_STATEMENT, cls._INSERT_COMMENT_STATEMENT, changes['comment'])
+
+        if not changes:
+            return None
+
+        persistedDBFileRecord = persistedDBFileRecord._replace(**changes)
+        connection.execute(cls._UPDATE_STATEMENT,
+                (persistedDBFileRecord.fileName, persistedDBFileRecord.groupId, persistedDBFileRecord.commentId, persistedDBFileRecord.fileId,))
+
+        if commit:
+            session.commit()
+
+        return persistedDBFileRecord
+        # }}}
+
+
+    @staticmethod
+    def _determineConnection(session):
+        # DOC {{{
+        """Returns the sqlite3 connection of the session (the session's
+        transaction is begun if it has not been yet).
+
+        Parameters
+
+            session -- an instance of SQLAlchemy's Session()
+        """
+        # }}}
+
+        # CODE {{{
+        return session.connection().connection
+        # }}}
+
+
+    @classmethod
+    def _buildStatement(cls, dbFileQueryArguments, kwargs, first):
+        # DOC {{{
+        """Returns a (statement, parameters,) tuple of the query of the
+        specified DBFileQueryArguments() and surplus keyword arguments (see
+        DBFileRegister._buildQuery()) or None if the query is not supported.
+
+        Parameters
+
+            dbFileQueryArguments -- an instance of DBFileQueryArguments() or
+                None
+
+            kwargs -- a dictionary of the surplus keyword arguments
+
+            first -- True if just the first row is requested
+        """
+        # }}}
+
+        # CODE {{{
+        # merge the query arguments and the surplus keyword arguments {{{
+        isDefined = DBFileQueryArguments.isDefined
+        values = dict()
+
+        if (dbFileQueryArguments is not None):
+            for attributeName in DBFileQueryArguments.__slots__:
+                value = getattr(dbFileQueryArguments, attributeName)
+
+                if (isDefined(value)):
+                    values[attributeName] = value
+
+        for attributeName, value in kwargs.items():
+            # check that the attribute exists in DBFileQueryArguments (raises AttributeError)
+            if (attributeName not in DBFileQueryArguments.__slots__):
+                raise AttributeError("'DBFileQueryArguments' object has no attribute '{}'".format(attributeName))
+
+            values[attributeName] = value
+        # }}}
+
+        # the unsupported query {{{
+        if (any((attributeName in values) for attributeName in cls._UNSUPPORTED_QUERY_ARGUMENTS)):
+            return None
+        # }}}
+
+        # build the conditions and their parameters in a constant order (to reuse the prepared statements) {{{
+        conditions = []
+        parameters = []
+
+        for attributeName, condition in cls._QUERY_COLUMNS:
+            if (attributeName in values):
+                value = values[attributeName]
+
+                # NULL is matched by 'IS NULL' as SQLAlchemy does for '== None'
+                if ((value is None) and (condition.endswith(" = ?"))):
+                    conditions.append(condition[:-len(" = ?")] + " IS NULL")
+                else:
+                    conditions.append(condition)
+                    parameters.append(value)
+        # }}}
+
+        statement = cls._SELECT_STATEMENT.format(" AND ".join(conditions) if (conditions) else "1", " LIMIT 1" if (first) else "")
+
+        return (statement, tuple(parameters),)
+        # }}}
+
+
+    @staticmethod
+    def _determineValueId(connection, selectStatement, insertStatement, value, ids = None):
+        # DOC {{{
+        """Returns the ID of the specified value (a group or a comment) in
+        its table, the value is stored first if it is not there yet. Returns
+        None for no (None or empty) value. A new value is inserted unless it
+        is there already and then looked up again (see
+        DBFileRegister._determineId()).
+
+        Parameters
+
+            connection -- the sqlite3 connection
+
+            selectStatement -- the statement selecting the ID of the value
+
+            insertStatement -- the statement inserting the value unless it
+                is there already
+
+            value -- the value to determine the ID of
+
+            ids -- (optional) a dictionary of already determined IDs by the
+                values, the ID is added to it
+        """
+        # }}}
+
+        # CODE {{{
+        # no value has no ID {{{
+        if (not value):
+            return None
+        # }}}
+
+        # return the already determined ID if any {{{
+        if ((ids is not None) and (value in ids)):
+            return ids[value]
+        # }}}
+
+        # look the ID up, store the value if it is new (unless another process has just stored it) and look the ID up again {{{
+        row = connection.execute(selectStatement, (value,)).fetchone()
+
+        if (row is None):
+            connection.execute(insertStatement, (value,))
+            row = connection.execute(selectStatement, (value,)).fetchone()
+
+        valueId = row[0]
+        # }}}
+
+        # remember the ID if requested {{{
+        if (ids is not None):
+            ids[value] = valueId
+        # }}}
+
+        return valueId
+        # }}}
+
+
+    # }}}
+# }}}
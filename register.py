@@ -1,41 +1,72 @@
+import contextlib
 import datetime
-import fnmatch
 import functools
-import glob
+import itertools
 import os
 import os.path
 import re
+import shutil
+import sys
 import threading
 import time
 
+from DigestBloomFilter import DigestBloomFilter
+from DigestCatalog import DigestCatalog
+from DuplicateFinder import DuplicateFinder
+from FileDiscovery import FileDiscovery
+from IgnoreRules import IgnoreRules
 from MySum import MySum
 from PathTemplates import PathTemplates
 from RegfileConfiguration import RegfileConfiguration
-from db.DBConnection import DBConnection
-from db.DBFile import DBFile
-from db.DBFileQueryArguments import DBFileQueryArguments
-from db.DBFileRegister import DBFileRegister
+from RegfileConstants import RegfileConstants
+from RegfileLog import RegfileLog
 from progressbar import progressbar
 
+# the db modules (and SQLAlchemy) are imported on the first connection (see importdb), so the operations
+# without the database (-D, -QLOG, -FINDDUPES) start faster
+DBConnection = DBFile = DBFileQueryArguments = DBFileRegister = DBFileStatistics = SQLiteFileRegister = None
+
+def importdb():
+    """
+    import the db modules (and SQLAlchemy) to the module's globals
+    """
+    global DBConnection, DBFile, DBFileQueryArguments, DBFileRegister, DBFileStatistics, SQLiteFileRegister
+    from db.DBConnection import DBConnection
+    from db.DBFile import DBFile
+    from db.DBFileQueryArguments import DBFileQueryArguments
+    from db.DBFileRegister import DBFileRegister
+    from db.DBFileStatistics import DBFileStatistics
+    from db.SQLiteFileRegister import SQLiteFileRegister
+
 class Register(object):
 
     DEFAULTFILES = ["_.regfiledefaults", ".regfiledefaults"]
-    LOGCOMMENT="# "
-    LOGADD="+  "
-    LOGUPDATE="!  "
-    LOGUPDATED="!! "
     RULER=" - - - - - - - - - - - - - - - - - - - - - - - - - - - - - "
 
-    LOG_DBFILE_RE = re.compile(
-                r"^DBF(?P<fileId>\d*)\|" +
-                r"n:(?P<fileName>.*)\|" +
-                r"g:(?P<group>.*)\|" +
-                r"c:(?P<comment>.*)\|" +
-                r"s:(?P<fileSize>\d*)\|" +
-                r"md1:(?P<md1>.*)\|" +
-                r"md5:(?P<md5>.*)\|" +
-                r"ed2k:(?P<ed2k>.*)\|$"
-    )
+    # the DBFile columns needed by the formatters (_formatDBFileXXX)
+    FORMAT_COLUMNS = ("fileId", "fileName", "fileSize", "group", "comment")
+    FORMAT_VERBOSE_COLUMNS = FORMAT_COLUMNS + ("md1", "md5", "ed2k")
+    FORMAT_AS_MYSUM_COLUMNS = ("fileName", "fileSize", "md5", "md1", "ed2k")
+    FORMAT_AS_ED2K_COLUMNS = ("fileName", "fileSize", "ed2k")
+
+    # the DBFile columns needed by the log (RegfileLog.formatDBFile)
+    FORMAT_LOG_COLUMNS = ("fileId", "fileName", "group", "comment", "fileSize", "md1", "md5", "ed2k")
+
+    # the number of rows a query loads and writes at once
+    QUERY_BATCH_SIZE = 1000
+
+    # the number of bytes read at once from the file with the input filenames (-filesfrom)
+    FILES_FROM_CHUNK_SIZE = 65536
+
+    # the number of imported entries matched at once (-I, see _determineMatchingDBFiles)
+    IMPORT_BATCH_SIZE = 10000
+
+    # the number of input lines looked up at once (-LOOKUP)
+    LOOKUP_CHUNK_SIZE = 50000
+
+    # an ed2k link and a bare checksum (MD5 or ED2K) for -LOOKUP
+    ED2K_LINK_RE = re.compile(r"ed2k://\|file\|[^|]*\|(?P<fileSize>\d+)\|(?P<ed2k>[0-9a-fA-F]{32})\|")
+    CHECKSUM_RE = re.compile(r"[0-9a-fA-F]{32}")
 
     def __init__(self, args):
         """
@@ -45,6 +76,9 @@ def __init__(self, args):
         self.configuration  = RegfileConfiguration()
         self.dbFilePath     = self.configuration[RegfileConfiguration.DB]
         self.logfile        = self.configuration[RegfileConfiguration.LOG]
+        self.catalogFilePath = self.dbFilePath + DigestCatalog.SUFFIX
+        self.bloomFilterPath = self.dbFilePath + DigestBloomFilter.SUFFIX
+        self.useBloomFilter = (self.configuration[RegfileConfiguration.BLOOM_FILTER] == RegfileConstants.BLOOM_FILTER_YES)
         # }}}
 
         # arguments
@@ -52,20 +86,44 @@ def __init__(self, args):
         self.group = args.group
         self.comment = args.comment
         self.files = args.filenames
+        self.filesfrom = args.filesfrom
+        self.nulseparated = args.nulseparated
         self.queryasmysum = args.queryasmysum
         self.queryverbose = args.queryverbose
         self.queryed2k = args.queryed2k
+        self.since = args.since
+        self.until = args.until
+        self.minsize = args.minsize
+        self.maxsize = args.maxsize
+        self.minage = args.minage
+        self.maxage = args.maxage
+        self.extensions = args.extensions
+        self.md1 = args.md1
+        self.md5 = args.md5
+        self.ed2k = args.ed2k
+        self.orderby = args.orderby
+        self.descending = args.descending
+        self.limit = args.limit
+        self.offset = args.offset
+        self.after = args.after
+        self.querycount = args.querycount
+        self.merge = args.merge
+        self.catalogfile = args.catalogfile
         self.auto= args.auto
         self.defaults = args.defaults
         self.determineconfirm(args)
 
         # defaults
         self.dbConnection = None # database connection
+        self.dbFileRegister = None # the storage backend (DBFileRegister or SQLiteFileRegister, see the backend configuration)
+        self.digestCatalog = None # the catalog the files are matched against before the db (see opencatalog)
+        self.bloomFilter = None # the filter ruling out the files that are definitely not registered (see openbloomfilter)
         self.op = None # operation function
-        self.logf = None # log file
+        self.regfileLog = RegfileLog(self.logfile) # log
         self.pathTemplates = None  # path templates
-        self.totalsize = 0 # the size of all the files to register/check in bytes
+        self.fileDiscovery = None # discovery of the files to register/check/import (their count and total size grow as it goes)
         self.defaultcache = dict() # cache with default values
+        self.pendingDBFiles = dict() # DBFiles about to be registered by (size, md1, md5, ed2k)
         self.cols = 80 # terminal columns (accurate where supported - Linux/Unix)
 
         if (not self.configuration.fromConfigFile):
@@ -79,15 +137,24 @@ def __init__(self, args):
                 , initial_indent="!!!   ", subsequent_indent="!!!   "))
             return
 
-        # key: the op code, value: op function, thorough for processfiles
+        # key: the op code, value: op function, thorough for processfiles, db connection profile (None - no connection)
         dd = { \
-                "r" : (self.register, True),\
-                "c" : (self.check, True),\
-                "i": (self.batchimport, True),\
-                "s" : (self.setdata, False),\
-                "q" : (self.query, False),\
-                "l" : (self.resetfromlog, False),\
-                "d" : (self.makedefaults, False),\
+                "r" : (self.register, True, RegfileConstants.DB_PROFILE_DEFAULT),\
+                "c" : (self.check, True, RegfileConstants.DB_PROFILE_READ),\
+                "i": (self.batchimport, True, RegfileConstants.DB_PROFILE_BULK),\
+                "s" : (self.setdata, False, RegfileConstants.DB_PROFILE_DEFAULT),\
+                "q" : (self.query, False, RegfileConstants.DB_PROFILE_READ),\
+                "l" : (self.resetfromlog, False, None),\
+                "v" : (self.verifylog, False, RegfileConstants.DB_PROFILE_READ),\
+                "t" : (self.querylog, False, None),\
+                "m" : (self.maintain, False, RegfileConstants.DB_PROFILE_DEFAULT),\
+                "k" : (self.lookup, False, RegfileConstants.DB_PROFILE_READ),\
+                "u" : (self.migrate, False, RegfileConstants.DB_PROFILE_DEFAULT),\
+                "n" : (self.stats, False, RegfileConstants.DB_PROFILE_READ),\
+                "x" : (self.dupes, False, RegfileConstants.DB_PROFILE_READ),\
+                "f" : (self.finddupes, False, None),\
+                "d" : (self.makedefaults, False, None),\
+                "g" : (self.catalog, False, RegfileConstants.DB_PROFILE_READ),\
                 }
         if not args.op in dd:
             raise ValueError(
@@ -95,16 +162,134 @@ def __init__(self, args):
                     .format(args.op))
 
         self.op = dd[args.op][0]
+        profile = dd[args.op][2]
+
+        # check against the given catalog alone, without the db
+        if self.op == self.check and self.catalogfile is not None:
+            importdb()
+            profile = None
+
+        if profile is not None:
+            self.dbConnection = self.connect(self.dbFilePath, profile)
+            if self.dbConnection.isOutdated and self.op != self.migrate:
+                print("The database '{}' has an old structure, migrate it first (-MIGRATE)!".format(self.dbFilePath))
+                self.op = None
 
-        if self.op != self.resetfromlog:
-            self.dbConnection = DBConnection(self.dbFilePath)
+        # the ops processing the files match them against the catalog first or rule the new ones out by the filter
+        if self.op and dd[args.op][1]:
+            self.opencatalog()
+            if self.op and self.digestCatalog is None and self.useBloomFilter:
+                self.openbloomfilter()
 
         self.processfiles(thorough=dd[args.op][1])
 
+        self.cols = shutil.get_terminal_size((self.cols, 24)).columns
+
+    def connect(self, dbFilePath, profile):
+        """
+        connect to the given db using the connection profile (RegfileConstants.DB_PROFILE_XXX)
+
+        only the writing profiles set the db up (see DBConnection._setUp)
+        """
+        importdb()
+        if self.configuration[RegfileConfiguration.BACKEND] == RegfileConstants.BACKEND_SQLITE3:
+            self.dbFileRegister = SQLiteFileRegister
+        else:
+            self.dbFileRegister = DBFileRegister
+        return DBConnection(
+                dbFilePath,
+                pragmas=self.configuration.determineSQLitePragmas(profile),
+                busyRetries=int(self.configuration[RegfileConfiguration.BUSY_RETRIES]),
+                fileSearchIndex=(self.configuration[RegfileConfiguration.SEARCH_INDEX] == RegfileConstants.SEARCH_INDEX_YES),
+                upgrade=(profile != RegfileConstants.DB_PROFILE_READ)) # the read-only ops never change the db
+
+    def opencatalog(self):
+        """
+        open the digest catalog the files are matched against before the db (see DigestCatalog)
+
+        the catalog given by -catalog is used alone (without the db), the one next to the db is used
+        only if it is up to date and complete (otherwise every lookup goes to the db as usual)
+        """
+        if self.dbConnection is None:
+            try:
+                self.digestCatalog = DigestCatalog(self.catalogfile)
+            except (OSError, ValueError) as error:
+                print("The catalog can't be used: {}".format(error))
+                self.op = None
+                return
+            print("Checking against the catalog '{}' of {:,} entries (the database is not used).".format(
+                    self.catalogfile, self.digestCatalog.dbFiles))
+            if not self.digestCatalog.isComplete():
+                print("The catalog misses {:,} entries without a valid size or md1, their files are reported as unregistered!".format(
+                        self.digestCatalog.dbFiles - self.digestCatalog.records))
+            return
+        if not os.path.exists(self.catalogFilePath):
+            return
         try:
-            self.cols = int(os.popen('stty size', 'r').read().split()[1])
-        except:
-            pass
+            digestCatalog = DigestCatalog(self.catalogFilePath)
+        except (OSError, ValueError) as error:
+            print("The catalog can't be used: {}".format(error))
+            return
+        with self.dbConnection.getSessionContext() as session:
+            dbFiles, maxFileId = self._determinedbstate(session)
+        if not digestCatalog.isUpToDate(dbFiles, maxFileId):
+            print("The catalog '{}' is out of date, it is not used (refresh it by -CATALOG)!".format(self.catalogFilePath))
+            digestCatalog.close()
+        elif not digestCatalog.isComplete():
+            print("The catalog '{}' misses some entries, it is not used!".format(self.catalogFilePath))
+            digestCatalog.close()
+        else:
+            self.digestCatalog = digestCatalog
+
+    def openbloomfilter(self):
+        """
+        open the Bloom filter of the db, the files it rules out are not looked up in the db (see DigestBloomFilter)
+
+        the filter is built from the db (and written next to it) if it is missing or out of date
+        """
+        with self.dbConnection.getSessionContext() as session:
+            dbFiles, maxFileId = self._determinedbstate(session)
+            try:
+                bloomFilter = DigestBloomFilter.read(self.bloomFilterPath)
+            except (OSError, ValueError):
+                bloomFilter = None
+            if bloomFilter is None or not bloomFilter.isUpToDate(dbFiles, maxFileId):
+                print("Building the Bloom filter of the database ...")
+                bloomFilter = self.buildbloomfilter(session, dbFiles)
+                self.writebloomfilter(bloomFilter)
+        self.bloomFilter = bloomFilter
+
+    def buildbloomfilter(self, session, dbFiles):
+        """
+        build the Bloom filter of the db (in the given session) of the given number of entries
+        """
+        return DigestBloomFilter.build(
+                self.dbFileRegister.iterateQuery(session, columns=DigestBloomFilter.COLUMNS, batchSize=self.QUERY_BATCH_SIZE),
+                dbFiles)
+
+    def writebloomfilter(self, bloomFilter):
+        """
+        write the Bloom filter next to the db (it is just used from the memory if it can't be written)
+        """
+        try:
+            bloomFilter.write(self.bloomFilterPath)
+        except OSError as error:
+            print("The Bloom filter can't be written: {}".format(error))
+
+    def _determinedbstate(self, session):
+        """
+        return the number of entries in the db and their highest id (None if there are none)
+
+        the sidecars of the db (the catalog and the Bloom filter) are up to date while these don't change
+        the entries are counted if the statistics have not been set up yet (see DBConnection._setUp)
+        """
+        if self.dbConnection.hasStatistics:
+            totals = DBFileStatistics.queryTotals(session)
+            files = totals.files if totals else 0
+        else:
+            files = self.dbFileRegister.count(session)
+        last = next(self.dbFileRegister.iterateQuery(session, orderBy="id", descending=True, limit=1, columns=("fileId",)), None)
+        return (files, last.fileId if last else None)
 
     def go(self):
         """
@@ -114,8 +299,9 @@ def go(self):
             if self.op:
                 self.op()
         finally:
-            if self.logf:
-                self.logf.close()
+            self.regfileLog.close()
+            if self.digestCatalog:
+                self.digestCatalog.close()
             if self.dbConnection:
                 self.dbConnection.close()
 
@@ -133,7 +319,12 @@ def determineconfirm(self, args):
     def docommit(self, problems):
         if self.confirm or (self.confirmproblem and problems):
             while True:
-                response = input("Do you wish to commit these changes? [YES/no] ").lower().strip()
+                try:
+                    response = input("Do you wish to commit these changes? [YES/no] ").lower().strip()
+                except EOFError: # e.g. the filenames have been read from stdin (-filesfrom -)
+                    print()
+                    print("No answer, the input has ended.")
+                    return False
                 if (response not in ["", "yes", "y", "no", "n"]):
                     print("Only yes or no (or just Enter) is a valid choice.")
                     continue
@@ -154,9 +345,16 @@ def registercheck(self, register):
         tstart = time.time()
         ii = 0
         failfiles = []
+        linkedfiles = 0 # hardlinks of the new entries (not registered again)
         dbFilesToStore = []
-        with self.dbConnection.getSessionContext() as session:
-            for ff in self.files:
+        # [MySum, paths seen, new DBFile] of the files with hardlinks by (st_dev, st_ino), each inode is hashed once
+        # (and forgotten when all its hardlinks have been seen)
+        hashedinodes = dict()
+        # the discovery provides the stats of the files
+        files = self.fileDiscovery.iterateFilesAndStats() if self.fileDiscovery else ((ff, None) for ff in self.files)
+        # no session when checking against the catalog alone
+        with self.dbConnection.getSessionContext() if self.dbConnection else contextlib.nullcontext() as session:
+            for ff, st in files:
                 ii = ii + 1
                 fileMightBeRegistered = False
                 cdir = os.path.dirname(ff) # directory
@@ -176,9 +374,20 @@ def registercheck(self, register):
                         dbf.group, dbf.comment = gr, com
                     self.printstatus(ii, sff, "Quick")
 
-                    # stage 1 - silent
-                    ms = MySum(ff)
-                    ms.upgrade(1)
+                    # stage 1 - silent (unless the inode has been hashed already via another hardlink)
+                    if st is None:
+                        st = os.stat(ff)
+                    inode = hashedinodes.get((st.st_dev, st.st_ino))
+                    if inode is None:
+                        ms = MySum(ff)
+                        ms.upgrade(1)
+                        if st.st_nlink > 1:
+                            inode = hashedinodes[(st.st_dev, st.st_ino)] = [ms, 1, None]
+                    else:
+                        ms = inode[0]
+                        inode[1] = inode[1] + 1
+                        if inode[1] >= st.st_nlink: # the last hardlink
+                            del hashedinodes[(st.st_dev, st.st_ino)]
                     dbf.fileSize = ms.fileSize
                     dbf.md1 = ms.md1
 
@@ -194,20 +403,21 @@ def registercheck(self, register):
                         print()
                         continue
 
-                    tt = threading.Thread(target=ms.upgrade,args=[2])
-                    tt.start()
-                    while tt.is_alive():
-                        try:
-                            self.printstatus(ii, sff, self.msgpgs(ms,psize,tstart,fileMightBeRegistered))
-                            time.sleep(0.25)
-                        except KeyboardInterrupt:
-                            ms.requestStop()
-                            tt.join()
-                            raise
+                    if ms.state < MySum.STATE_COMPLETE:
+                        tt = threading.Thread(target=ms.upgrade,args=[2])
+                        tt.start()
+                        while tt.is_alive():
+                            try:
+                                self.printstatus(ii, sff, self.msgpgs(ms,psize,tstart,fileMightBeRegistered))
+                                time.sleep(0.25)
+                            except KeyboardInterrupt:
+                                ms.requestStop()
+                                tt.join()
+                                raise
 
-                    tt.join()
+                        tt.join()
 
-                    psize = psize + ms.fileSize
+                        psize = psize + ms.fileSize
 
                     dbf.md5     = ms.md5
                     dbf.ed2k    = ms.ed2k
@@ -229,14 +439,19 @@ def registercheck(self, register):
 
                     if register:
                         if (matchingDBFile is None):
-                            DBFileRegister.insert(session, dbf, commit=False)
-                            self.printstatus(ii, sff, "New entry " + str(dbf.fileId))
+                            self.printstatus(ii, sff, "New entry")
                             dbFilesToStore.append(dbf)
+                            self._addPendingDBFile(dbf)
+                            if inode is not None:
+                                inode[2] = dbf
+                        elif (inode is not None) and (matchingDBFile is inode[2]):
+                            self.printstatus(ii, sff, "Hardlink of the new entry " + matchingDBFile.fileName)
+                            linkedfiles = linkedfiles + 1
                         else:
                             if (fullMatch):
-                                self.printstatus(ii, sff, "Already registered (full match) as " + str(matchingDBFile.fileId))
+                                self.printstatus(ii, sff, "Already registered (full match) as " + self._formatFileId(matchingDBFile))
                             else:
-                                self.printstatus(ii, sff, "Already registered (data match) as " + str(matchingDBFile.fileId))
+                                self.printstatus(ii, sff, "Already registered (data match) as " + self._formatFileId(matchingDBFile))
                             failfiles.append(ff)
                     else:
                         if (matchingDBFile is None):
@@ -244,7 +459,7 @@ def registercheck(self, register):
                             failfiles.append(ff)
                         else:
                             stat = "OK"
-                            if (dbf.fileName != matchingDBFile.fileName):
+                            if (matchingDBFile.fileName is not None) and (dbf.fileName != matchingDBFile.fileName):
                                 stat = "(as " + matchingDBFile.fileName + ") OK"
                             stat = "id:" + str(matchingDBFile.fileId) + " " + stat
                             self.printstatus(ii, sff, stat)
@@ -253,11 +468,15 @@ def registercheck(self, register):
                     self.printstatus(ii, sff, "Interrupted")
                     failfiles.append(ff + "    (Interrupted)")
                     print()
+                    files.close() # stop the discovery
                     break
 
             print(self.RULER)
+            self.printskipped()
             if register:
-                print("About to register {} files out of {}".format(ii-len(failfiles),ii))
+                print("About to register {} files out of {}".format(ii-len(failfiles)-linkedfiles,ii))
+                if linkedfiles:
+                    print("Skipped {} hardlinks of the new entries".format(linkedfiles))
             else:
                 print("Passed {} files out of {}.{}".format(ii-len(failfiles), ii, "ALL OK" if not len(failfiles) else "" ))
             if len(failfiles) > 0:
@@ -265,23 +484,22 @@ def registercheck(self, register):
                 for ff in failfiles:
                     print("    " + ff)
             if register:
-                if len(failfiles) == ii:
+                if len(failfiles) + linkedfiles == ii:
                     print("No files were registered!")
                 elif self.docommit(failfiles):
-                    session.commit()
-                    for storedDBFile in dbFilesToStore:
-                        self.log(Register.LOGADD + self._formatDBFileForLog(storedDBFile))
+                    self.store(session, dbFilesToStore)
                     print("Done.")
                 else:
                     print("Aborted!")
 
 
-    @staticmethod
-    def _determineFileMightBeRegistered(session, fileSize, md1):
+    def _determineFileMightBeRegistered(self, session, fileSize, md1):
         # DOC {{{
         """Returns True if there is a registered file of the size and the MD5
         sum of the first megabyte specified in the provided DBFile(), False
-        otherwise.
+        otherwise. The digest catalog answers instead of the database if it
+        is used (see opencatalog()), the files ruled out by the Bloom filter
+        are not looked up in the database (see openbloomfilter()).
 
         Parameters
 
@@ -294,22 +512,32 @@ def _determineFileMightBeRegistered(session, fileSize, md1):
         # }}}
 
         # CODE {{{
-        dbfs = DBFileRegister.query(
+        # the catalog is up to date (or used alone)
+        if (self.digestCatalog is not None):
+            return self.digestCatalog.containsSizeAndMD1(fileSize, md1)
+
+        # the file is definitely not registered if the filter rules it out
+        if ((self.bloomFilter is not None) and (not self.bloomFilter.mightContainSizeAndMD1(fileSize, md1))):
+            return False
+
+        return self.dbFileRegister.queryExists(
                 session     = session,
                 fileSize    = fileSize,
                 md1         = md1,
         )
-
-        return (dbfs is not None)
-         # }}}
+        # }}}
 
 
-    @staticmethod
-    def _determineMatchingDBFile(session, fileSize, md1, md5, ed2k):
+    def _determineMatchingDBFile(self, session, fileSize, md1, md5, ed2k):
         # DOC {{{
         """Returns the DBFile() that matches the size, the MD5 sum of the first
         megabyte, the MD5 sum of the entire file and the ED2K sum of the
-        specified DBFile() and is already registered in the register.
+        specified DBFile() and is already registered in the register or is
+        about to be registered (see _addPendingDBFile()). The contents missing
+        in the digest catalog are not looked up in the database, the ones
+        found in it are returned as DBFileRecord()s with the fileId and the
+        checksums only if the catalog is used alone (see opencatalog()). The
+        contents ruled out by the Bloom filter are not looked up either.
 
         Parameters
 
@@ -326,7 +554,27 @@ def _determineMatchingDBFile(session, fileSize, md1, md5, ed2k):
         # }}}
 
         # CODE {{{
-        dbfs = DBFileRegister.query(
+        # return the DBFile() about to be registered if there is one {{{
+        pendingDBFile = self.pendingDBFiles.get((fileSize, md1, md5, ed2k))
+
+        if (pendingDBFile is not None):
+            return pendingDBFile
+        # }}}
+
+        # return None if the content is not in the catalog or the catalog's record if it is used alone {{{
+        if (self.digestCatalog is not None):
+            dbFileRecord = self.digestCatalog.findContent(fileSize, md1, md5, ed2k)
+
+            if ((dbFileRecord is None) or (self.dbConnection is None)):
+                return dbFileRecord
+        # }}}
+
+        # return None if the filter rules the content out {{{
+        if ((self.bloomFilter is not None) and (not self.bloomFilter.mightContainContent(fileSize, md1, md5, ed2k))):
+            return None
+        # }}}
+
+        dbfs = self.dbFileRegister.query(
                 session     = session,
                 fileSize    = fileSize,
                 md1         = md1,
@@ -341,6 +589,133 @@ def _determineMatchingDBFile(session, fileSize, md1, md5, ed2k):
         # }}}
 
 
+    def _determineMatchingDBFiles(self, session, dbFiles):
+        # DOC {{{
+        """Returns a list of the DBFile()s (or None) matching the specified
+        DBFile()s in their order (see _determineMatchingDBFile()). If the
+        digest catalog is used, all the contents are matched against it at
+        once (by NumPy if it is installed, see DigestCatalog.findContents())
+        and the found entries are loaded from the database at once.
+        Otherwise every DBFile() is matched on its own.
+
+        Parameters
+
+            session -- an instance of the SQLAlchemy's Session()
+
+            dbFiles -- a list of DBFile()s to match
+        """
+        # }}}
+
+        # CODE {{{
+        # match one by one without the catalog {{{
+        if (self.digestCatalog is None):
+            return [
+                    self._determineMatchingDBFile(session, dbf.fileSize, dbf.md1, dbf.md5, dbf.ed2k)
+                    for dbf in dbFiles
+            ]
+        # }}}
+
+        contents = [(dbf.fileSize, dbf.md1, dbf.md5, dbf.ed2k) for dbf in dbFiles]
+        matchingDBFiles = self.digestCatalog.findContents(contents)
+
+        # load the entries found in the catalog (with their names, groups and comments) from the database {{{
+        if (self.dbConnection is not None):
+            rowsByFileIds = self.dbFileRegister.lookup(
+                    session,
+                    'fileId',
+                    (dbFileRecord.fileId for dbFileRecord in matchingDBFiles if (dbFileRecord is not None)),
+                    columns = ('fileName', 'group', 'comment',),
+            )
+
+            matchingDBFiles = [
+                    rowsByFileIds[dbFileRecord.fileId][0] if ((dbFileRecord is not None) and (dbFileRecord.fileId in rowsByFileIds)) else None
+                    for dbFileRecord in matchingDBFiles
+            ]
+        # }}}
+
+        # the DBFile()s about to be registered come first (see _determineMatchingDBFile())
+        return [
+                self.pendingDBFiles.get(content, matchingDBFile)
+                for content, matchingDBFile in zip(contents, matchingDBFiles)
+        ]
+        # }}}
+
+
+    def _addPendingDBFile(self, dbFile):
+        # DOC {{{
+        """Remembers the DBFile() that is about to be registered (when the
+        changes are commited), so the same data is not registered twice.
+
+        Parameters
+
+            dbFile -- the DBFile() to be registered
+        """
+        # }}}
+
+        # CODE {{{
+        self.pendingDBFiles[(dbFile.fileSize, dbFile.md1, dbFile.md5, dbFile.ed2k)] = dbFile
+        # }}}
+
+
+    @staticmethod
+    def _formatFileId(dbFile):
+        # DOC {{{
+        """Returns the ID of the specified DBFile() as a string or 'new' if
+        the DBFile() is about to be registered (has no ID yet).
+
+        Parameters
+
+            dbFile -- a DBFile()
+        """
+        # }}}
+
+        # CODE {{{
+        return str(dbFile.fileId) if (dbFile.fileId is not None) else "new"
+        # }}}
+
+
+    def store(self, session, dbFilesToStore):
+        """
+        insert the given DBFiles in one short write transaction, log them and commit
+
+        the DBFiles are matched against the db again at the beginning of the transaction (at once),
+        so the contents registered meanwhile by another process are not registered twice
+
+        the inserts are retried while another process writes (see DBConnection.retryOnBusy)
+        the log is written ahead of the commit while the transaction holds the write lock of
+        the db, so parallel processes log their entries in the order of their ids
+        """
+        newDBFiles = []
+
+        def insert():
+            # lock the db first and skip the entries registered meanwhile by another process (unseen by an older catalog or filter)
+            self.dbConnection.beginImmediate(session)
+            registered = set(
+                    (row.fileSize, row.md1, row.md5, row.ed2k)
+                    for rows in self.dbFileRegister.lookup(session, 'md5', (dbf.md5 for dbf in dbFilesToStore),
+                        columns=('fileSize', 'md1', 'ed2k')).values()
+                    for row in rows)
+            newDBFiles[:] = [dbf for dbf in dbFilesToStore if (dbf.fileSize, dbf.md1, dbf.md5, dbf.ed2k) not in registered]
+            for dbf in newDBFiles:
+                dbf.fileId = None # let the db assign a new id (again if retrying)
+            if newDBFiles:
+                self.dbFileRegister.insert(session, *newDBFiles, commit=False)
+
+        if dbFilesToStore:
+            self.dbConnection.retryOnBusy(session, insert)
+            if len(newDBFiles) < len(dbFilesToStore):
+                print("Skipped {} entries registered meanwhile by another process".format(len(dbFilesToStore) - len(newDBFiles)))
+            if newDBFiles:
+                self.log(*RegfileLog.formatLines(RegfileLog.ADD, newDBFiles))
+        session.commit()
+
+        # add the stored entries to the Bloom filter (it is built again if this fails, see openbloomfilter)
+        if newDBFiles and self.useBloomFilter:
+            try:
+                DigestBloomFilter.addToFile(self.bloomFilterPath, newDBFiles)
+            except OSError as error:
+                print("The Bloom filter can't be updated: {}".format(error))
+
     def batchimport(self):
         """
         store all data stored in the provided files (usually named like sumlog.txt)
@@ -374,6 +749,7 @@ def batchimport(self):
                     fail = False
 
                     dbFilesToStoreFromImportFile = []
+                    parsedLines = [] # (line number, DBFile) tuples of the lines parsed since the last match
                     for line in fsum:
                         ll = ll + 1
                         self.printstatus(ii, ff, "L" + str(ll))
@@ -396,30 +772,17 @@ def batchimport(self):
                                 ed2k        = ms.ed2k,
                         )
 
-                        matchingDBFile = self._determineMatchingDBFile(
-                                session     = session,
-                                fileSize    = dbf.fileSize,
-                                md1         = dbf.md1,
-                                md5         = dbf.md5,
-                                ed2k        = dbf.ed2k,
-                        )
-
-                        fullMatch = ((matchingDBFile is not None) and
-                                     (dbf.fileName == matchingDBFile.fileName) and
-                                     (dbf.group == matchingDBFile.group) and
-                                     (dbf.comment == matchingDBFile.comment))
-
-                        if (matchingDBFile):
-                            warn = warn + 1
-
-                            if (fullMatch):
-                                self.printstatus(ii, ff, "Already registered (full match) as {} L{}".format(matchingDBFile.fileId, ll))
-                            else:
-                                self.printstatus(ii, ff, "Already registered (data match) as {} L{}".format(matchingDBFile.fileId, ll))
-                            print()
-                            continue
-                        jj = jj + 1
-                        dbFilesToStoreFromImportFile.append(dbf)
+                        # the parsed lines are matched in batches
+                        parsedLines.append((ll, dbf))
+                        if len(parsedLines) >= self.IMPORT_BATCH_SIZE:
+                            newDBFiles, warnings = self._matchimportedlines(session, ii, ff, parsedLines)
+                            dbFilesToStoreFromImportFile.extend(newDBFiles)
+                            warn = warn + warnings
+                            parsedLines = []
+                    if not fail:
+                        newDBFiles, warnings = self._matchimportedlines(session, ii, ff, parsedLines)
+                        dbFilesToStoreFromImportFile.extend(newDBFiles)
+                        warn = warn + warnings
                     if fail:
                         if ll == 1:
                             self.printstatus(ii, ff, "FAILED")
@@ -431,24 +794,49 @@ def batchimport(self):
                             failfiles.append(ff + "       (" + sll + ")")
                             print()
                     else:
+                        jj = jj + len(dbFilesToStoreFromImportFile)
                         for dbf in dbFilesToStoreFromImportFile:
-                            DBFileRegister.insert(session, dbf, commit=False)
+                            self._addPendingDBFile(dbf)
                         allDBFilesToStore.extend(dbFilesToStoreFromImportFile)
                     print()
             print(self.RULER)
-            print("About to import {} entries ({} warnings) from {} files out of {}".format(jj, warn, len(self.files) - len(failfiles), len(self.files)))
+            self.printskipped()
+            print("About to import {} entries ({} warnings) from {} files out of {}".format(jj, warn, ii - len(failfiles), ii))
             if len(failfiles) > 0:
                 print("A list of files that failed:")
                 for ff in failfiles:
                     print("    " + ff)
             if self.docommit(failfiles):
-                session.commit()
-                for storedDBFile in allDBFilesToStore:
-                    self.log(Register.LOGADD + self._formatDBFileForLog(storedDBFile))
+                self.store(session, allDBFilesToStore)
                 print("Done.")
             else:
                 print("Aborted!")
 
+    def _matchimportedlines(self, session, ii, ff, parsedLines):
+        """
+        match the DBFiles parsed from the lines of the import file at once (see _determineMatchingDBFiles),
+        print the already registered ones and return a tuple (a list of the new DBFiles, the number of warnings)
+
+        parsedLines is a list of (line number, DBFile) tuples
+        """
+        newDBFiles = []
+        warnings = 0
+        matchingDBFiles = self._determineMatchingDBFiles(session, [dbf for ll, dbf in parsedLines])
+        for (ll, dbf), matchingDBFile in zip(parsedLines, matchingDBFiles):
+            if matchingDBFile is None:
+                newDBFiles.append(dbf)
+                continue
+            warnings = warnings + 1
+            fullMatch = ((dbf.fileName == matchingDBFile.fileName) and
+                         (dbf.group == matchingDBFile.group) and
+                         (dbf.comment == matchingDBFile.comment))
+            if (fullMatch):
+                self.printstatus(ii, ff, "Already registered (full match) as {} L{}".format(self._formatFileId(matchingDBFile), ll))
+            else:
+                self.printstatus(ii, ff, "Already registered (data match) as {} L{}".format(self._formatFileId(matchingDBFile), ll))
+            print()
+        return (newDBFiles, warnings)
+
     def setdata(self):
         """
         Change some details of the entries given by IDs. IDs are required.
@@ -470,13 +858,17 @@ def setdata(self):
         self.fileId = int(self.fileId)
 
         dbf = DBFile(fileId=self.fileId, fileName=ff, group=self.group, comment=self.comment)
-        self.log(Register.LOGUPDATE + self._formatDBFileForLog(dbf))
         with self.dbConnection.getSessionContext() as session:
-            dbf = DBFileRegister.update(session, dbf)
-        if not dbf:
-            print("Error updating the entry!")
-        else:
-            self.log(Register.LOGUPDATED + self._formatDBFileForLog(dbf))
+            updatedDBFile = self.dbConnection.retryOnBusy(session, self.dbFileRegister.update, session, dbf, commit=False)
+            if not updatedDBFile:
+                print("Error updating the entry!")
+                return
+            # log ahead of the commit
+            self.log(
+                    RegfileLog.UPDATE + RegfileLog.formatDBFile(dbf),
+                    RegfileLog.UPDATED + RegfileLog.formatDBFile(updatedDBFile),
+            )
+            session.commit()
 
     def query(self):
         """
@@ -515,71 +907,464 @@ def query(self):
             dbFileQueryArguments.comment = self.comment
         # }}}
 
-        with self.dbConnection.getSessionContext() as session:
-            ll = DBFileRegister.query(session, dbFileQueryArguments)
+        # add query arguments limiting the file's size if they are specified {{{
+        if (self.minsize is not None):
+            dbFileQueryArguments.minFileSize = self.minsize
+        if (self.maxsize is not None):
+            dbFileQueryArguments.maxFileSize = self.maxsize
+        # }}}
+
+        # add query arguments matching the file's checksums if they are specified {{{
+        if (self.md1 is not None):
+            dbFileQueryArguments.md1 = self.md1.lower()
+        if (self.md5 is not None):
+            dbFileQueryArguments.md5 = self.md5.lower()
+        if (self.ed2k is not None):
+            dbFileQueryArguments.ed2k = self.ed2k.lower()
+        # }}}
 
-        if (ll is None):
+        # add query arguments ordering and paging the entries if they are specified {{{
+        if (self.orderby is not None):
+            dbFileQueryArguments.orderBy = self.orderby
+        dbFileQueryArguments.descending = self.descending
+        if (self.limit is not None):
+            dbFileQueryArguments.limit = self.limit
+        if (self.offset is not None):
+            dbFileQueryArguments.offset = self.offset
+        if (self.after is not None):
+            dbFileQueryArguments.afterFileId = self.after
+        # }}}
+
+        # just count the matching entries if requested
+        if self.querycount:
+            with self.dbConnection.getSessionContext() as session:
+                print(self.dbFileRegister.count(session, dbFileQueryArguments))
+            return
+
+        # pick the formatter and the columns it needs
+        formatDBFileMethod, columns = self._formatDBFile, self.FORMAT_COLUMNS
+        if self.queryasmysum:
+            formatDBFileMethod, columns = self._formatDBFileAsMysum, self.FORMAT_AS_MYSUM_COLUMNS
+        elif self.queryed2k:
+            formatDBFileMethod, columns = self._formatDBFileAsED2K, self.FORMAT_AS_ED2K_COLUMNS
+        elif self.queryverbose:
+            formatDBFileMethod, columns = functools.partial(self._formatDBFile, verbose = True), self.FORMAT_VERBOSE_COLUMNS
+
+        # stream the matching rows (only the needed columns) and write the output in batches
+        count = 0
+        batch = []
+        with self.dbConnection.getSessionContext() as session:
+            for row in self.dbFileRegister.iterateQuery(session, dbFileQueryArguments, columns=columns, batchSize=self.QUERY_BATCH_SIZE):
+                batch.append(formatDBFileMethod(row))
+                count = count + 1
+                if len(batch) >= self.QUERY_BATCH_SIZE:
+                    self._writelines(batch)
+                    batch = []
+        self._writelines(batch)
+
+        if count == 0:
             print("No record matches the query!")
-        else:
-            formatDBFileMethod = self._formatDBFile
-            if self.queryasmysum:
-                formatDBFileMethod = self._formatDBFileAsMysum
-            elif self.queryed2k:
-                formatDBFileMethod = self._formatDBFileAsED2K
-            elif self.queryverbose:
-                formatDBFileMethod = functools.partial(self._formatDBFile, verbose = True)
 
-            for dbf in ll:
-                print(formatDBFileMethod(dbf))
+    @staticmethod
+    def _writelines(lines):
+        """
+        write the lines to the standard output at once
+        """
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+
+    def lookup(self):
+        """
+        look up checksums (MD5 or ED2K), MYSUM entries or ed2k links given one per line
+        in the files (or the standard input if there are none or for '-')
+
+        print a tab separated line for every one of them: HIT/MISS/INVALID, the
+        comma separated matching ids and the line itself, the summary goes to stderr
+
+        the lines are resolved in large batches (see DBFileRegister.lookup)
+        """
+        counts = {"HIT" : 0, "MISS" : 0, "INVALID" : 0}
+        with self.dbConnection.getSessionContext() as session:
+            for ff in (self.files or ["-"]):
+                stream = sys.stdin if ff == "-" else open(ff, "r")
+                try:
+                    chunk = []
+                    for line in stream:
+                        line = line.strip()
+                        if (not line) or line.startswith("#"):
+                            continue
+                        chunk.append(line)
+                        if len(chunk) >= self.LOOKUP_CHUNK_SIZE:
+                            self._lookupchunk(session, chunk, counts)
+                            chunk = []
+                    self._lookupchunk(session, chunk, counts)
+                finally:
+                    if stream is not sys.stdin:
+                        stream.close()
+        sys.stderr.write("{HIT} hits, {MISS} misses, {INVALID} invalid\n".format(**counts))
+
+    def _lookupchunk(self, session, lines, counts):
+        """
+        look up the lines at once, print the results and add them to the counts
+        """
+        parsed = [self._parselookupline(line) for line in lines]
+
+        # look every checksum up just once
+        valuesByAttributes = {"md5" : set(), "ed2k" : set()}
+        for alternatives, size in filter(None, parsed):
+            for attributeName, value in alternatives:
+                valuesByAttributes[attributeName].add(value)
+        rowsByAttributes = {
+                attributeName : self.dbFileRegister.lookup(session, attributeName, values, columns=("fileId", "fileSize"))
+                for attributeName, values in valuesByAttributes.items()
+                }
+
+        output = []
+        for line, item in zip(lines, parsed):
+            if item is None:
+                status, fileIds = "INVALID", []
+            else:
+                alternatives, size = item
+                fileIds = sorted(set(
+                        row.fileId
+                        for attributeName, value in alternatives
+                        for row in rowsByAttributes[attributeName].get(value, ())
+                        if (size is None) or (row.fileSize == size)))
+                status = "HIT" if fileIds else "MISS"
+            counts[status] = counts[status] + 1
+            output.append("\t".join((status, ",".join(str(fileId) for fileId in fileIds), line)))
+        self._writelines(output)
+
+    @classmethod
+    def _parselookupline(cls, line):
+        """
+        parse a -LOOKUP line to a list of alternative (attribute name, value) to match
+        and the size to match (None if any), return None if the line is not valid
+        """
+        match = MySum.STRING_RE.match(line)
+        if match:
+            return [("md5", match.group("md5").lower())], int(match.group("fileSize"))
+        match = cls.ED2K_LINK_RE.match(line)
+        if match:
+            return [("ed2k", match.group("ed2k").lower())], int(match.group("fileSize"))
+        if cls.CHECKSUM_RE.fullmatch(line):
+            return [("md5", line.lower()), ("ed2k", line.lower())], None
+        return None
 
 
     def resetfromlog(self):
         """
-        drop the db and reinsert (and update) all the entries from log to the empty db
+        rebuild the db from the log in a shadow file next to it, validate it
+        against the log and atomically replace the content of the db with it
+
+        the rebuilt db is copied page by page into the db under the lock of the log, and only if
+        nothing has been logged since the rebuild (see DBConnection.replaceContent), the db file
+        stays in place, so the processes using it (and its write ahead log) stay valid
+
+        the old db is backed up (dbFilePath + "~") before and stays usable until the very replacement
+
+        the catalog (if any) describes the old content and is removed
         """
         if not os.path.exists(self.logfile):
             print("The logfile " + self.logfile + " doesn't exist!")
             return
-        # backup the old one
-        if os.path.exists(self.dbFilePath):
-            bak = self.dbFilePath + "~"
-            if os.path.exists(bak):
-                if input("A backup already exists. Remove it (only Yes is accepted)? ") != "Yes":
-                    return
-                os.remove(bak)
-            os.rename(self.dbFilePath, bak)
-        # read new one
+        bak = self.dbFilePath + "~"
+        if os.path.exists(self.dbFilePath) and os.path.exists(bak):
+            if input("A backup already exists. Remove it (only Yes is accepted)? ") != "Yes":
+                return
+        regfileLog = self.regfileLog
+        logSize = os.path.getsize(self.logfile) # the log must not change until the replacement
+        # build the new one in the shadow file (remove any leftover of an interrupted rebuild)
+        shadow = self.dbFilePath + ".rebuild"
+        if os.path.exists(shadow):
+            os.remove(shadow)
         print("This might take a while depending on the log size. Please wait ...")
-        self.dbConnection = DBConnection(self.dbFilePath)
-        with self.dbConnection.getSessionContext() as session:
-            with open(self.logfile, "r") as self.logf:
-                for ll in self.logf:
-                    if ll.startswith(Register.LOGADD):
-                        dbf = self._dbFileFromLog(ll[len(Register.LOGADD):])
-                        DBFileRegister.insert(session, dbf, commit=False)
-                    elif ll.startswith(Register.LOGUPDATED):
-                        dbf = self._dbFileFromLog(ll[len(Register.LOGUPDATED):])
+        shadowConnection = self.connect(shadow, RegfileConstants.DB_PROFILE_BULK)
+        try:
+            with shadowConnection.getSessionContext() as session:
+                for prefix, dbf in regfileLog.iterateReplayedDBFiles():
+                    if prefix == RegfileLog.ADD:
+                        self.dbFileRegister.insert(session, dbf, commit=False)
+                    elif prefix == RegfileLog.UPDATED:
                         session.commit()
-                        DBFileRegister.update(session,dbf, setall=True)
-                    # TODO display progress (line, items, date)
-            session.commit()
-        print("Done")
+                        self.dbFileRegister.update(session, dbf, setall=True)
+                session.commit()
+
+                # validate the shadow db against the final state of the log
+                print("Validating the rebuilt database ...")
+                dbCount, dbChecksum = RegfileLog.determineCountAndChecksum(
+                        self.dbFileRegister.iterateQuery(session, columns=self.FORMAT_LOG_COLUMNS, batchSize=self.QUERY_BATCH_SIZE))
+
+                # build the Bloom filter of the new db (written when it is swapped in)
+                bloomFilter = self.buildbloomfilter(session, dbCount) if self.useBloomFilter else None
+            logCount, logChecksum = RegfileLog.determineCountAndChecksum(regfileLog.iterateFinalDBFiles())
+        except:
+            shadowConnection.close()
+            os.remove(shadow)
+            raise
+        shadowConnection.close()
+        if (dbCount, dbChecksum) != (logCount, logChecksum):
+            print("The rebuilt database ({} entries, checksum {}) doesn't match the log ({} entries, checksum {})!".format(
+                dbCount, dbChecksum, logCount, logChecksum))
+            print("The database has been left untouched.")
+            os.remove(shadow)
+            return
+        if not os.path.exists(self.dbFilePath):
+            # nobody uses a missing db, move the new one in (without the write ahead log left by an old one)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.dbFilePath + suffix):
+                    os.remove(self.dbFilePath + suffix)
+            os.replace(shadow, self.dbFilePath)
+        else:
+            # back the old db up first (without any lock), then copy the new one in under the lock of the log
+            liveConnection = self.connect(self.dbFilePath, RegfileConstants.DB_PROFILE_DEFAULT)
+            def replace():
+                with open(self.logfile, "rb") as logFile:
+                    RegfileLog.lock(logFile) # nobody logs (and commits) until the log is closed, also when retrying
+                    if os.fstat(logFile.fileno()).st_size != logSize:
+                        return False
+                    liveConnection.replaceContent(shadow)
+                    return True
+            try:
+                liveConnection.backUp(bak)
+                replaced = liveConnection.retryOnBusy(None, replace)
+            finally:
+                liveConnection.close()
+            os.remove(shadow)
+            if not replaced:
+                print("The log has changed during the rebuild, run -RESETFROMLOG again!")
+                print("The database has been left untouched.")
+                return
+        if bloomFilter is not None:
+            self.writebloomfilter(bloomFilter)
+        # the catalog describes the old content (its ids may have changed), so it is dropped
+        if os.path.exists(self.catalogFilePath):
+            os.remove(self.catalogFilePath)
+            print("The catalog '{}' has been removed, refresh it by -CATALOG.".format(self.catalogFilePath))
+        print("Done ({} entries, checksum {})".format(dbCount, dbChecksum))
+
+    def verifylog(self):
+        """
+        compare the db with the final state of the log in one merge pass over both
+        (ordered by id) and report entries missing in the db, extra entries in the db
+        and entries that differ
+        """
+        if not os.path.exists(self.logfile):
+            print("The logfile " + self.logfile + " doesn't exist!")
+            return
+        print("This might take a while depending on the log size. Please wait ...")
+        missing, extra, divergent, ok = 0, 0, 0, 0
+        with self.dbConnection.getSessionContext() as session:
+            logDBFiles = self.regfileLog.iterateFinalDBFiles()
+            dbDBFiles = self.dbFileRegister.iterateQuery(session, columns=self.FORMAT_LOG_COLUMNS, batchSize=self.QUERY_BATCH_SIZE)
+            logDBFile = next(logDBFiles, None)
+            dbDBFile = next(dbDBFiles, None)
+            while logDBFile is not None or dbDBFile is not None:
+                if dbDBFile is None or (logDBFile is not None and logDBFile.fileId < dbDBFile.fileId):
+                    print("Missing in the database: " + RegfileLog.formatDBFile(logDBFile))
+                    missing = missing + 1
+                    logDBFile = next(logDBFiles, None)
+                elif logDBFile is None or dbDBFile.fileId < logDBFile.fileId:
+                    print("Missing in the log:      " + RegfileLog.formatDBFile(dbDBFile))
+                    extra = extra + 1
+                    dbDBFile = next(dbDBFiles, None)
+                else:
+                    logLine = RegfileLog.formatDBFile(logDBFile)
+                    dbLine = RegfileLog.formatDBFile(dbDBFile)
+                    if logLine != dbLine:
+                        print("Differs in the log:      " + logLine)
+                        print("           database:     " + dbLine)
+                        divergent = divergent + 1
+                    else:
+                        ok = ok + 1
+                    logDBFile = next(logDBFiles, None)
+                    dbDBFile = next(dbDBFiles, None)
+        print(self.RULER)
+        print("{} entries match, {} missing in the database, {} missing in the log, {} differ.{}".format(
+            ok, missing, extra, divergent, " ALL OK" if not (missing or extra or divergent) else ""))
+
+    def maintain(self):
+        """
+        maintain the db (update statistics, free unused space, check integrity)
+        """
+        print("This might take a while depending on the database size. Please wait ...")
+        problems = self.dbConnection.maintain()
+        if problems:
+            print("The database integrity check failed:")
+            for problem in problems:
+                print("    " + problem)
+        else:
+            print("Done. The database is OK.")
+
+    def catalog(self):
+        """
+        write (refresh) the digest catalog of the db next to it or to the file given by -catalog (see DigestCatalog)
+
+        the catalog replaces the old one at once, so it can be refreshed while the others are using it
+        """
+        path = self.catalogfile if self.catalogfile is not None else self.catalogFilePath
+        print("Writing the catalog '{}' ...".format(path))
+        with self.dbConnection.getSessionContext() as session:
+            dbFileRecords = self.dbFileRegister.iterateQuery(
+                    session, orderBy="size", columns=DigestCatalog.COLUMNS, batchSize=self.QUERY_BATCH_SIZE)
+            records, dbFiles = DigestCatalog.write(path, dbFileRecords)
+        print("Done ({:,} entries{}).".format(records,
+                ", {:,} entries without a valid size or md1 left out (the catalog is not used next to the database)".format(
+                    dbFiles - records) if dbFiles != records else ""))
+
+    def stats(self):
+        """
+        print the number of files and bytes per group, the totals and the duplicates
+
+        the statistics are maintained by the db, nothing is counted here (see DBFileStatistics)
+        """
+        if not self.dbConnection.hasStatistics:
+            print("The database '{}' has no statistics yet, set it up first (-MAINTAIN)!".format(self.dbFilePath))
+            return
+        with self.dbConnection.getSessionContext() as session:
+            groups = DBFileStatistics.queryGroups(session)
+            totals = DBFileStatistics.queryTotals(session)
+        print("{:<40} {:>12} {:>20}".format("Group", "Files", "Bytes"))
+        for group in groups:
+            name = group.group if group.group is not None else "(no group)"
+            print("{:<40} {:>12,} {:>20,}".format(name, group.files, group.bytes))
+        print(self.RULER)
+        print("{:<40} {:>12,} {:>20,}".format("Total", totals.files, totals.bytes))
+        print("Duplicates: {:,} contents registered more than once, {:,} redundant files, {:,} redundant bytes".format(
+                totals.duplicatecontents, totals.duplicatefiles, totals.duplicatebytes))
+
+    def dupes(self):
+        """
+        print the entries sharing the same content (size, md5 and ed2k) one content after another
+        or just a tab separated merge suggestion for every content (-merge): MERGE, the id to keep
+        (the lowest one) and the comma separated ids of the redundant entries
+
+        the entries are streamed, so any size of the register is fine (see DBFileRegister.iterateDuplicates)
+        """
+        contents = redundant = redundantsize = 0
+        batch = []
+        with self.dbConnection.getSessionContext() as session:
+            rows = self.dbFileRegister.iterateDuplicates(
+                    session,
+                    batchSize=self.QUERY_BATCH_SIZE,
+                    columns=self.FORMAT_COLUMNS + ("md5", "ed2k"),
+                    minFileSize=self.minsize)
+            for content, entries in itertools.groupby(rows, key=lambda row: (row.md5, row.fileSize, row.ed2k)):
+                entries = list(entries)
+                contents = contents + 1
+                redundant = redundant + len(entries) - 1
+                redundantsize = redundantsize + (len(entries) - 1) * (content[1] or 0)
+                if self.merge:
+                    batch.append("\t".join(("MERGE", str(entries[0].fileId), ",".join(str(entry.fileId) for entry in entries[1:]))))
+                else:
+                    batch.append("Content md5:{} s:{} ed2k:{} registered {} times:".format(content[0], content[1], content[2], len(entries)))
+                    batch.extend(self._formatDBFile(entry) for entry in entries)
+                    batch.append("")
+                if len(batch) >= self.QUERY_BATCH_SIZE:
+                    self._writelines(batch)
+                    batch = []
+        self._writelines(batch)
+
+        summary = "{:,} contents registered more than once, {:,} redundant entries, {:,} redundant bytes".format(contents, redundant, redundantsize)
+        if self.merge:
+            sys.stderr.write(summary + "\n")
+        else:
+            print(self.RULER)
+            print(summary)
+
+    def finddupes(self):
+        """
+        find the files with the same content in the given directories (no db involved)
+
+        only the files sharing size are read partially (md1) and only the files sharing md1
+        are read completely, hardlinks count as one file, the ignored files are skipped
+        (see DuplicateFinder)
+        """
+        if not self.files:
+            print("Please provide the directories to search!")
+            return
+        finder = DuplicateFinder(
+                self.files,
+                ignoreRules = IgnoreRules.fromConfig(self.configuration[RegfileConfiguration.IGNORE]),
+                ignoredNames = self.DEFAULTFILES + [IgnoreRules.FILE_NAME])
+        contents = redundant = redundantsize = 0
+        for fileSize, files in finder.iterateDuplicates():
+            contents = contents + 1
+            redundant = redundant + len(files) - 1
+            redundantsize = redundantsize + (len(files) - 1) * fileSize
+            print("Same content (s:{}) in {} files:".format(fileSize, len(files)))
+            for paths in files:
+                print("    " + " = ".join(paths))
+        print(self.RULER)
+        print("Found {:,} files ({:,} distinct, {:,} bytes), read {:,} bytes".format(
+                finder.foundFiles, finder.foundInodes, finder.foundBytes, finder.readBytes))
+        if finder.skippedEntries:
+            print("Skipped {} ignored files and directories".format(finder.skippedEntries))
+        print("{:,} contents found more than once, {:,} redundant files, {:,} redundant bytes".format(contents, redundant, redundantsize))
+        if finder.failedPaths:
+            print("A list of files that failed:")
+            for path in finder.failedPaths:
+                print("    " + path)
+
+    def migrate(self):
+        """
+        migrate the db of an old structure to the current one
+        """
+        if not self.dbConnection.isOutdated:
+            print("The database is up to date.")
+            return
+        print("This might take a while depending on the database size. Please wait ...")
+        self.dbConnection.migrate()
+        print("Done.")
 
-    def log(self, line):
+    def querylog(self):
         """
-        log the line to log file
-        if this is late commit op, store line for later (in self.latelog buffer)
-        to write stored lines set op to eg. None and call it again
+        print the log lines logged between -since and -until
+        or the state of the entry given by ID (-i) as of -until
+
+        only the part of the log in the time range is read (see RegfileLog)
         """
-        if not self.logf:
-            self.logfile = os.path.expanduser(self.logfile)
-            if not os.path.exists(self.logfile):
-                self.logf = open(self.logfile, "w")
+        if not os.path.exists(self.logfile):
+            print("The logfile " + self.logfile + " doesn't exist!")
+            return
+        try:
+            since = self._parsetime(self.since)
+            until = self._parsetime(self.until, end=True)
+        except ValueError as error:
+            print(error)
+            return
+        if self.fileId is not None:
+            dbf = self.regfileLog.determineDBFileAsOf(int(self.fileId), until)
+            if dbf is None:
+                print("The entry {} was not registered by then!".format(self.fileId))
             else:
-                self.logf = open(self.logfile, "a")
-            self.logf.write(self.LOGCOMMENT+datetime.datetime.now().ctime()+"\n")
-        if line:
-            self.logf.write(line+"\n")
+                print(self._formatDBFile(dbf, verbose=True))
+        else:
+            for line in self.regfileLog.iterateLines(since, until):
+                print(line)
+
+    @staticmethod
+    def _parsetime(value, end=False):
+        """
+        parse the time given as YYYY-MM-DD[ HH:MM[:SS]], None stays None
+
+        if end is True a date alone means the end of that day
+        """
+        if value is None:
+            return None
+        try:
+            tt = datetime.datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError("The time '{}' is not in the format YYYY-MM-DD[ HH:MM[:SS]]!".format(value))
+        if end and len(value.strip()) == 10:
+            tt = tt + datetime.timedelta(days=1, seconds=-1)
+        return tt
+
+    def log(self, *lines):
+        """
+        log the lines to log file at once (and sync it to the disk)
+        """
+        self.regfileLog.writeGroup(lines)
 
     def printstatus(self, no, ff, msg, totalItems = None):
         """
@@ -592,9 +1377,11 @@ def printstatus(self, no, ff, msg, totalItems = None):
         """
 
         if (totalItems is None):
-            totalItems = len(self.files)
+            totalItems = self.fileDiscovery.foundFiles
+            if (not self.fileDiscovery.isComplete):
+                totalItems = "{}+".format(totalItems) # still discovering
 
-        stat = str(len(self.files))
+        stat = str(totalItems)
         stat = "[{}/{}] ".format(str(no).rjust(len(stat)), totalItems)
         # filename has all the space that's left by message and current stat
         lff = self.cols - len(msg) - len(stat) - 5 # 1 (before) + 3 (after) + 1 (end)
@@ -604,6 +1391,54 @@ def printstatus(self, no, ff, msg, totalItems = None):
         ff = ff.ljust(lff)
         print("\r{} {}   {}".format(stat, ff, msg), end="")
 
+    @staticmethod
+    def _determinecwd():
+        """
+        return the current working directory as the shell sees it ($PWD, keeps the symlinks in the path)
+        if it is the process' one, otherwise the process' one
+        """
+        cwd = os.getcwd()
+        pwd = os.environ.get("PWD")
+        if pwd and pwd != cwd and os.path.isabs(pwd):
+            try:
+                if os.path.samefile(pwd, cwd):
+                    return pwd
+            except OSError:
+                pass
+        return cwd
+
+    def _readfilesfrom(self):
+        """
+        return an iterator of the filenames read lazily from the -filesfrom file (or stdin for -), one per line
+        (or separated by NUL characters with -0), empty ones are skipped
+        """
+        separator = b"\0" if self.nulseparated else b"\n"
+        fin = sys.stdin.buffer if self.filesfrom == "-" else open(os.path.expanduser(self.filesfrom), "rb")
+        try:
+            rest = b""
+            for chunk in iter(functools.partial(fin.read, self.FILES_FROM_CHUNK_SIZE), b""):
+                names = (rest + chunk).split(separator)
+                rest = names.pop()
+                for name in names:
+                    if not self.nulseparated:
+                        name = name.rstrip(b"\r")
+                    if name:
+                        yield os.fsdecode(name)
+            if rest and not self.nulseparated:
+                rest = rest.rstrip(b"\r")
+            if rest:
+                yield os.fsdecode(rest)
+        finally:
+            if fin is not sys.stdin.buffer:
+                fin.close()
+
+    def printskipped(self):
+        """
+        print the number of the files and directories skipped by the discovery (ignored or filtered out)
+        """
+        if self.fileDiscovery.skippedEntries:
+            print("Skipped {} ignored or filtered out files and directories".format(self.fileDiscovery.skippedEntries))
+
     def msgpgs(self, ms, psize, tstart, fileMightBeRegistered=False):
         """
         create a progress message from the given info
@@ -626,7 +1461,7 @@ def msgpgs(self, ms, psize, tstart, fileMightBeRegistered=False):
             speed = 0
             eta = " --:--"
         else:
-            eta = int((self.totalsize - psize - pgs) / (1024*1024*speed))
+            eta = int(max(self.fileDiscovery.foundBytes - psize - pgs, 0) / (1024*1024*speed))
             speed = int(speed)
             if eta != 0:
                 eta = " {:02d}:{:02d}".format(int(eta/60), eta % 60)
@@ -638,45 +1473,39 @@ def processfiles(self, thorough=True):
         """
         parse the files from arguments to a useable list
 
-        if thorough is True the list of directories, files and wildcards is turned into a list of real filenames (and total size is computed)
+        if thorough is True the list of directories, files and wildcards is turned into an iterator of real filenames
+        (discovered in the background, see self.fileDiscovery for their count and total size so far)
         """
         if (isinstance(self.files, str)):
             self.files = [ self.files ]
         elif self.files is None:
-            return
+            if not (thorough and self.filesfrom):
+                return
+            self.files = []
         elif (not isinstance(self.files, list)):
             raise ValueError("The files is not a list nor a string")
 
         if not thorough:
             return
 
-        rf = [] # real files
-        ts = 0 # total size
-        if (os.name == 'posix'):
-            cwd = os.popen('pwd').read().strip('\n')
-        else:
-            cwd = os.getcwd()
-
-        for ff in self.files:
-            # the file could be: a file, a directory (then add everything recursively), or a wildcard
-            ff = os.path.expanduser(ff)
-
-            if (not os.path.isabs(ff)):
-                ff = os.path.normpath(os.path.join(cwd, ff))
-
-            if (os.path.exists(ff) and os.path.isdir(ff)):
-                for root, dirnames, filenames in os.walk(ff):
-                    for filename in fnmatch.filter(filenames, '*'):
-                        fn = os.path.join(root, filename)
-                        ts = ts + os.stat(fn)[6]
-                        rf.append(fn)
-            else:
-                for fn in glob.iglob(ff):
-                    fn = os.path.join(cwd, fn)
-                    ts = ts + os.stat(fn)[6]
-                    rf.append(fn)
-        self.totalsize = ts
-        self.files = rf
+        cwd = self._determinecwd()
+
+        # the files could be: files, directories (then everything recursively), or wildcards
+        # they are discovered while being processed, the ignored (and regfile's own) files and the filtered out ones are skipped
+        now = time.time()
+        self.fileDiscovery = FileDiscovery(
+                self.files,
+                self._readfilesfrom() if self.filesfrom else None,
+                cwd,
+                ignoreRules = IgnoreRules.fromConfig(self.configuration[RegfileConfiguration.IGNORE]),
+                ignoredNames = self.DEFAULTFILES + [IgnoreRules.FILE_NAME],
+                recordedNames = self.DEFAULTFILES if self.defaults else (), # popped by getgroupcomment()
+                minSize = self.minsize,
+                maxSize = self.maxsize,
+                minMTime = (now - self.maxage * 86400) if (self.maxage is not None) else None,
+                maxMTime = (now - self.minage * 86400) if (self.minage is not None) else None,
+                extensions = self.extensions)
+        self.files = self.fileDiscovery.iterateFiles()
 
     def makedefaults(self):
         """
@@ -719,10 +1548,14 @@ def getgroupcomment(self, ff, imp=False):
                 if (grcom is not None): # None means "use arg values"
                     gr, com = grcom
             else:
-                # not in cache - read the defaults file
+                # not in cache - read the defaults file (the scanned directories tell which of them are present)
+                present = self.fileDiscovery.popRecordedNames(dirname) if self.fileDiscovery else None
                 for df in self.DEFAULTFILES:
                     fdf = os.path.join(dirname, df)
-                    if not os.path.exists(fdf) or not os.path.isfile(fdf):
+                    if present is not None:
+                        if df not in present:
+                            continue
+                    elif not os.path.exists(fdf) or not os.path.isfile(fdf):
                         continue
                     try:
                         dd = open(fdf, 'r')
@@ -765,7 +1598,7 @@ def _formatDBFileAsMysum(dbFile):
 
         Parameters
 
-            dbFile -- a DBFile() to format
+            dbFile -- a DBFile() or a DBFileRecord() to format
         """
         # }}}
 
@@ -788,7 +1621,7 @@ def _formatDBFileAsED2K(dbFile):
 
         Parameters
 
-            dbFile -- a DBFile() to format
+            dbFile -- a DBFile() or a DBFileRecord() to format
         """
         # }}}
 
@@ -809,7 +1642,7 @@ def _formatDBFile(dbFile, verbose = False):
 
         Parameters
 
-            dbFile -- a DBFile() to format
+            dbFile -- a DBFile() or a DBFileRecord() to format
 
             verbose -- (optional) if True checksums are included
         """
@@ -851,57 +1684,6 @@ def _formatDBFile(dbFile, verbose = False):
         # }}}
 
 
-    @staticmethod
-    def _formatDBFileForLog(dbFile):
-        # DOC {{{
-        """Returns a string representation of the specified dbFile for the log.
-
-        Parameters
-
-            dbFile -- a DBFile() to format
-        """
-        # }}}
-
-        # CODE {{{
-        return ("DBF{fileId:06d}|n:{fileName}|" +
-                "g:{group}|c:{comment}|s:{fileSize}|" +
-                "md1:{md1}|md5:{md5}|ed2k:{ed2k}|").format(
-                    fileId      = dbFile.fileId if (dbFile.fileId is not None) else 0,
-                    fileName    = dbFile.fileName,
-                    group       = dbFile.group if (dbFile.group is not None) else "",
-                    comment     = dbFile.comment if (dbFile.comment is not None) else "",
-                    fileSize    = dbFile.fileSize,
-                    md1         = dbFile.md1,
-                    md5         = dbFile.md5,
-                    ed2k        = dbFile.ed2k,
-        )
-        # }}}
-
-
-    @staticmethod
-    def _dbFileFromLog(ls):
-        rr = Register.LOG_DBFILE_RE.match(ls)
-        if not rr:
-            raise ValueError("The string " + ls + " doesnt match the logline!")
-
-        matchGroups = rr.groupdict()
-
-        dbf = DBFile(
-                fileId      = int(matchGroups['fileId']),
-                fileName    = matchGroups['fileName'],
-                fileSize    = int(matchGroups['fileSize']),
-                group       = matchGroups['group'],
-                comment     = matchGroups['comment'],
-                md1         = matchGroups['md1'],
-                md5         = matchGroups['md5'],
-                ed2k        = matchGroups['ed2k'],
-        )
-
-        assert (Register._formatDBFileForLog(dbf).strip() == ls.strip())
-
-        return dbf
-
-
 def runop(args):
     Register(args).go()
 
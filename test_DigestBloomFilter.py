@@ -0,0 +1,193 @@
+##
+## test_DigestBloomFilter.py
+##      - Tests the Bloom filter of the registered contents: the contents
+##        added to it (also through its file) are never ruled out, the other
+##        ones mostly are.
+##
+##      Run: python -m unittest test_DigestBloomFilter
+##
+
+
+# import of required modules {{{
+import hashlib
+import os
+import tempfile
+import unittest
+
+from DigestBloomFilter import DigestBloomFilter
+from db.DBFileRecord import DBFileRecord
+# }}}
+
+
+# class DigestBloomFilterTest() {{{
+class DigestBloomFilterTest(unittest.TestCase):
+    # DOC {{{
+    """Tests DigestBloomFilter() built from RECORDS entries and written to a
+    temporary directory.
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the number of the entries the filter is built from
+    RECORDS             = 1000
+
+    # the number of the contents never added the false positives are counted of
+    PROBES              = 10000
+    # }}}
+
+
+    # METHODS {{{
+    def setUp(self):
+        # DOC {{{
+        """Builds the filter of the entries 1 to RECORDS and writes it.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temporaryDirectory.name, "dbfile.sqlite" + DigestBloomFilter.SUFFIX)
+
+        self.bloomFilter = DigestBloomFilter.build(
+                (self._makeDBFileRecord(fileId) for fileId in range(1, DigestBloomFilterTest.RECORDS + 1)),
+                DigestBloomFilterTest.RECORDS)
+        self.bloomFilter.write(self.path)
+        # }}}
+
+
+    def tearDown(self):
+        # DOC {{{
+        """Removes the filter.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory.cleanup()
+        # }}}
+
+
+    def testAddedContentsAreNeverRuledOut(self):
+        # DOC {{{
+        """The size and md1 and the whole content of every added entry might
+        be contained.
+        """
+        # }}}
+
+        # CODE {{{
+        for fileId in range(1, DigestBloomFilterTest.RECORDS + 1):
+            dbFileRecord = self._makeDBFileRecord(fileId)
+
+            self.assertTrue(self.bloomFilter.mightContainSizeAndMD1(dbFileRecord.fileSize, dbFileRecord.md1))
+            self.assertTrue(self.bloomFilter.mightContainContent(dbFileRecord.fileSize, dbFileRecord.md1, dbFileRecord.md5, dbFileRecord.ed2k))
+        # }}}
+
+
+    def testOtherContentsAreMostlyRuledOut(self):
+        # DOC {{{
+        """The contents never added might be contained with about the
+        FALSE_POSITIVE_RATE at most (twice of it is tolerated).
+        """
+        # }}}
+
+        # CODE {{{
+        falsePositives = 0
+
+        for fileId in range(DigestBloomFilterTest.RECORDS + 1, DigestBloomFilterTest.RECORDS + DigestBloomFilterTest.PROBES + 1):
+            dbFileRecord = self._makeDBFileRecord(fileId)
+
+            if (self.bloomFilter.mightContainContent(dbFileRecord.fileSize, dbFileRecord.md1, dbFileRecord.md5, dbFileRecord.ed2k)):
+                falsePositives = falsePositives + 1
+
+        self.assertLessEqual(falsePositives, 2 * DigestBloomFilter.FALSE_POSITIVE_RATE * DigestBloomFilterTest.PROBES)
+        # }}}
+
+
+    def testRoundTripThroughFile(self):
+        # DOC {{{
+        """The filter read from its file has the same header and bits, it is
+        up to date only with the same entries.
+        """
+        # }}}
+
+        # CODE {{{
+        bloomFilter = DigestBloomFilter.read(self.path)
+
+        self.assertEqual((bloomFilter.capacity, bloomFilter.dbFiles, bloomFilter.maxFileId,),
+                (DigestBloomFilter.MIN_CAPACITY, DigestBloomFilterTest.RECORDS, DigestBloomFilterTest.RECORDS,))
+        self.assertEqual(bloomFilter.bits, self.bloomFilter.bits)
+        self.assertTrue(bloomFilter.isUpToDate(DigestBloomFilterTest.RECORDS, DigestBloomFilterTest.RECORDS))
+        self.assertFalse(bloomFilter.isUpToDate(DigestBloomFilterTest.RECORDS + 1, DigestBloomFilterTest.RECORDS + 1))
+        # }}}
+
+
+    def testAddToFile(self):
+        # DOC {{{
+        """The entries added to the file are in the filter read from it
+        again, the header counts them.
+        """
+        # }}}
+
+        # CODE {{{
+        addedDBFileRecords = [self._makeDBFileRecord(fileId) for fileId in range(2001, 2011)]
+
+        DigestBloomFilter.addToFile(self.path, addedDBFileRecords)
+        bloomFilter = DigestBloomFilter.read(self.path)
+
+        self.assertTrue(bloomFilter.isUpToDate(DigestBloomFilterTest.RECORDS + 10, 2010))
+
+        for dbFileRecord in addedDBFileRecords + [self._makeDBFileRecord(1)]:
+            self.assertTrue(bloomFilter.mightContainContent(dbFileRecord.fileSize, dbFileRecord.md1, dbFileRecord.md5, dbFileRecord.ed2k))
+
+        # the filter in the memory has not changed
+        self.assertFalse(self.bloomFilter.isUpToDate(DigestBloomFilterTest.RECORDS + 10, 2010))
+        # }}}
+
+
+    def testAddToMissingOrInvalidFile(self):
+        # DOC {{{
+        """Nothing is added to a missing file (it is not created) nor to a
+        file that is not a filter (it is left for building again).
+        """
+        # }}}
+
+        # CODE {{{
+        missingPath = self.path + ".missing"
+
+        DigestBloomFilter.addToFile(missingPath, [self._makeDBFileRecord(2001)])
+        self.assertFalse(os.path.exists(missingPath))
+
+        with open(self.path, "r+b") as file_:
+            file_.truncate(DigestBloomFilter.HEADER_STRUCT.size + 1)
+
+        DigestBloomFilter.addToFile(self.path, [self._makeDBFileRecord(2001)])
+        self.assertEqual(os.path.getsize(self.path), DigestBloomFilter.HEADER_STRUCT.size + 1)
+
+        with self.assertRaises(ValueError):
+            DigestBloomFilter.read(self.path)
+        # }}}
+
+
+    @staticmethod
+    def _makeDBFileRecord(fileId):
+        # DOC {{{
+        """Returns a DBFileRecord() of a made up content of the fileId.
+
+        Parameters
+
+            fileId -- the ID of the entry
+        """
+        # }}}
+
+        # CODE {{{
+        md1, md5, ed2k = (hashlib.md5("{}{}".format(name, fileId).encode("utf-8")).hexdigest() for name in ("md1", "md5", "ed2k"))
+
+        return DBFileRecord(fileId, None, None, None, 1000 + fileId % 7, md1, md5, ed2k, None, None)
+        # }}}
+
+
+    # }}}
+# }}}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,267 @@
+##
+## test_DigestCatalog.py
+##      - Tests the digest catalog: the contents written from the records
+##        are found (also in batches, with and without NumPy), the others
+##        and the partial records are not.
+##
+##      Run: python -m unittest test_DigestCatalog
+##
+
+
+# import of required modules {{{
+import hashlib
+import os
+import tempfile
+import unittest
+
+from DigestCatalog import DigestCatalog
+from db.DBFileRecord import DBFileRecord
+# }}}
+
+
+# class DigestCatalogTest() {{{
+class DigestCatalogTest(unittest.TestCase):
+    # DOC {{{
+    """Tests DigestCatalog() written from these records:
+
+        1 -- a complete content of the size 10
+
+        2 -- a partial one of the size 10 (missing md5 and ed2k)
+
+        3 -- the content of 1 again
+
+        4 -- a complete content of the size 20 (the same md1 as 1)
+
+        5 -- an entry missing the size (not written)
+    """
+    # }}}
+
+
+    # METHODS {{{
+    def setUp(self):
+        # DOC {{{
+        """Writes the catalog to a temporary directory and opens it.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temporaryDirectory.name, "dbfile.sqlite" + DigestCatalog.SUFFIX)
+
+        self.dbFileRecords = [
+                self._makeDBFileRecord(1, 10, "a"),
+                self._makeDBFileRecord(2, 10, "b", md5 = None, ed2k = None),
+                self._makeDBFileRecord(3, 10, "a"),
+                self._makeDBFileRecord(4, 20, "a"),
+                self._makeDBFileRecord(5, None, "c"),
+        ]
+
+        self.assertEqual(DigestCatalog.write(self.path, sorted(self.dbFileRecords, key = lambda record: record.fileSize or 0)), (4, 5,))
+
+        self.digestCatalog = DigestCatalog(self.path)
+
+        # the lookups without NumPy unless a test imports it
+        self._numpy = DigestCatalog._numpy
+        DigestCatalog._numpy = False
+        # }}}
+
+
+    def tearDown(self):
+        # DOC {{{
+        """Closes and removes the catalog.
+        """
+        # }}}
+
+        # CODE {{{
+        DigestCatalog._numpy = self._numpy
+
+        self.digestCatalog.close()
+        self.temporaryDirectory.cleanup()
+        # }}}
+
+
+    def testHeader(self):
+        # DOC {{{
+        """The catalog knows the number of its records and of the entries
+        and the highest fileId, it is not complete without the entry 5.
+        """
+        # }}}
+
+        # CODE {{{
+        self.assertEqual(self.digestCatalog.records, 4)
+        self.assertTrue(self.digestCatalog.isUpToDate(5, 5))
+        self.assertFalse(self.digestCatalog.isUpToDate(6, 6))
+        self.assertFalse(self.digestCatalog.isComplete())
+        # }}}
+
+
+    def testContentHit(self):
+        # DOC {{{
+        """A registered content is found as the record of its first entry.
+        """
+        # }}}
+
+        # CODE {{{
+        record = self.digestCatalog.findContent(*self._makeContent(10, "a"))
+
+        self.assertEqual(record.fileId, 1)
+        self.assertEqual((record.fileSize, record.md1, record.md5, record.ed2k,), self._makeContent(10, "a"))
+        self.assertEqual(self.digestCatalog.findContent(*self._makeContent(20, "a")).fileId, 4)
+        self.assertTrue(self.digestCatalog.containsSizeAndMD1(10, self._makeDigest("a", "md1")))
+        # }}}
+
+
+    def testContentMiss(self):
+        # DOC {{{
+        """A content differing in the size or in any checksum is not found,
+        nor are the invalid checksums.
+        """
+        # }}}
+
+        # CODE {{{
+        fileSize, md1, md5, ed2k = self._makeContent(10, "a")
+
+        self.assertIsNone(self.digestCatalog.findContent(30, md1, md5, ed2k))
+        self.assertIsNone(self.digestCatalog.findContent(fileSize, md1, md5, self._makeDigest("x", "ed2k")))
+        self.assertIsNone(self.digestCatalog.findContent(fileSize, md1, "not a digest", ed2k))
+        self.assertIsNone(self.digestCatalog.findContent(*self._makeContent(10, "c")))
+        self.assertFalse(self.digestCatalog.containsSizeAndMD1(30, md1))
+        self.assertFalse(self.digestCatalog.containsSizeAndMD1(10, self._makeDigest("c", "md1")))
+        # }}}
+
+
+    def testPartialRecord(self):
+        # DOC {{{
+        """A partial record answers for its size and md1, but it never
+        matches a content (not even the zero checksums it is written with).
+        """
+        # }}}
+
+        # CODE {{{
+        fileSize, md1, md5, ed2k = self._makeContent(10, "b")
+
+        self.assertTrue(self.digestCatalog.containsSizeAndMD1(fileSize, md1))
+        self.assertIsNone(self.digestCatalog.findContent(fileSize, md1, md5, ed2k))
+        self.assertIsNone(self.digestCatalog.findContent(fileSize, md1, "0" * 32, "0" * 32))
+        # }}}
+
+
+    def testBatchMatchesSingleLookups(self):
+        # DOC {{{
+        """A batch of contents is matched the same as one by one, with NumPy
+        too if it is installed.
+        """
+        # }}}
+
+        # CODE {{{
+        contents = [
+                self._makeContent(10, "a"),
+                self._makeContent(10, "b"),
+                (10, self._makeDigest("b", "md1"), "0" * 32, "0" * 32),
+                self._makeContent(20, "a"),
+                self._makeContent(30, "a"),
+                (10, "not a digest", None, None),
+        ]
+        expected = [self.digestCatalog.findContent(*content) for content in contents]
+
+        self.assertEqual([(record.fileId if (record is not None) else None) for record in expected], [1, None, None, 4, None, None])
+        self.assertEqual(self.digestCatalog.findContents(contents), expected)
+
+        DigestCatalog._numpy = None
+
+        if (DigestCatalog._importNumPy() is None):
+            self.skipTest("NumPy is not installed")
+
+        self.assertEqual(self.digestCatalog.findContents(contents), expected)
+        # }}}
+
+
+    def testNotACatalog(self):
+        # DOC {{{
+        """A file that is not a catalog (or is truncated) is refused.
+        """
+        # }}}
+
+        # CODE {{{
+        with open(self.path, "rb") as file_:
+            content = file_.read()
+
+        for badContent in (b"", b"REGFCAT\x01" + content[8:], content[:-1]):
+            badPath = self.path + ".bad"
+
+            with open(badPath, "wb") as file_:
+                file_.write(badContent)
+
+            with self.assertRaises(ValueError):
+                DigestCatalog(badPath)
+        # }}}
+
+
+    @staticmethod
+    def _makeDigest(seed, name):
+        # DOC {{{
+        """Returns a made up checksum (a hex string) of the seed.
+
+        Parameters
+
+            seed -- the seed of the content
+
+            name -- the name of the checksum
+        """
+        # }}}
+
+        # CODE {{{
+        return hashlib.md5((seed + name).encode("utf-8")).hexdigest()
+        # }}}
+
+
+    @staticmethod
+    def _makeContent(fileSize, seed):
+        # DOC {{{
+        """Returns a (fileSize, md1, md5, ed2k,) tuple of a made up content.
+
+        Parameters
+
+            fileSize -- the size of the content
+
+            seed -- the seed of the checksums
+        """
+        # }}}
+
+        # CODE {{{
+        return (fileSize,) + tuple(DigestCatalogTest._makeDigest(seed, name) for name in ("md1", "md5", "ed2k"))
+        # }}}
+
+
+    @staticmethod
+    def _makeDBFileRecord(fileId, fileSize, seed, **checksums):
+        # DOC {{{
+        """Returns a DBFileRecord() of a made up content.
+
+        Parameters
+
+            fileId -- the ID of the entry
+
+            fileSize -- the size of the content
+
+            seed -- the seed of the checksums
+
+            checksums -- (optional) the checksums replacing the made up ones
+        """
+        # }}}
+
+        # CODE {{{
+        fileSize, md1, md5, ed2k = DigestCatalogTest._makeContent(fileSize, seed)
+        md5 = checksums.get("md5", md5)
+        ed2k = checksums.get("ed2k", ed2k)
+
+        return DBFileRecord(fileId, None, None, None, fileSize, md1, md5, ed2k, None, None)
+        # }}}
+
+
+    # }}}
+# }}}
+
+
+if __name__ == "__main__":
+    unittest.main()
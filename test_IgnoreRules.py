@@ -0,0 +1,251 @@
+##
+## test_IgnoreRules.py
+##      - Tests the gitignore-style rules of the .regfileignore files: the
+##        translation of the patterns, the negation and the precedence of the
+##        rules of the subdirectories.
+##
+##      Run: python -m unittest test_IgnoreRules
+##
+
+
+# import of required modules {{{
+import os
+import tempfile
+import unittest
+
+from FileDiscovery import FileDiscovery
+from IgnoreRules import IgnoreRules
+# }}}
+
+
+# class IgnoreRulesTest() {{{
+class IgnoreRulesTest(unittest.TestCase):
+    # DOC {{{
+    """Tests IgnoreRules() (see also FileDiscovery._isIgnored()).
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the directory the rules are relative to
+    DIRECTORY           = os.path.join(os.sep, "data")
+    # }}}
+
+
+    # METHODS {{{
+    def testNameMatchesInAnyDepth(self):
+        # DOC {{{
+        """A pattern without '/' matches the name in any depth, '*' does not
+        match '/'.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("*.tmp")
+
+        self.assertTrue(rules.match(self._path("z.tmp"), False))
+        self.assertTrue(rules.match(self._path("a/b/z.tmp"), False))
+        self.assertIsNone(rules.match(self._path("z.tmp.dat"), False))
+        self.assertIsNone(rules.match(os.path.join(os.sep, "elsewhere", "z.tmp"), False))
+        # }}}
+
+
+    def testAnchoredPatternMatchesRelativeToDirectory(self):
+        # DOC {{{
+        """A pattern with '/' matches only relative to the directory of the
+        rules.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("a/*.dat")
+
+        self.assertTrue(rules.match(self._path("a/x.dat"), False))
+        self.assertIsNone(rules.match(self._path("b/a/x.dat"), False))
+        self.assertIsNone(rules.match(self._path("a/b/x.dat"), False))
+        # }}}
+
+
+    def testDoubleStarMatchesEverythingInside(self):
+        # DOC {{{
+        """'a/**' matches everything inside a (in any depth), but not a
+        itself, '**/b' matches b in any depth.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("a/**")
+
+        self.assertTrue(rules.match(self._path("a/x"), False))
+        self.assertTrue(rules.match(self._path("a/b/c/x"), False))
+        self.assertTrue(rules.match(self._path("a/b"), True))
+        self.assertIsNone(rules.match(self._path("a"), True))
+        self.assertIsNone(rules.match(self._path("ab/x"), False))
+
+        rules = self._makeRules("**/b")
+
+        self.assertTrue(rules.match(self._path("b"), True))
+        self.assertTrue(rules.match(self._path("a/c/b"), False))
+        # }}}
+
+
+    def testDirectoryPatternDoesNotMatchFiles(self):
+        # DOC {{{
+        """'dir/' matches the directories named dir, not the files.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("dir/")
+
+        self.assertTrue(rules.match(self._path("dir"), True))
+        self.assertTrue(rules.match(self._path("a/dir"), True))
+        self.assertIsNone(rules.match(self._path("dir"), False))
+        self.assertIsNone(rules.match(self._path("a/dir"), False))
+        # }}}
+
+
+    def testLastMatchingRuleDecides(self):
+        # DOC {{{
+        """A negated pattern re-includes a path ignored by a previous rule of
+        the same file, a later rule ignores it again.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("*.log", "!keep.log")
+
+        self.assertTrue(rules.match(self._path("x.log"), False))
+        self.assertFalse(rules.match(self._path("keep.log"), False))
+
+        rules = self._makeRules("*.log", "!keep.log", "a/*.log")
+
+        self.assertFalse(rules.match(self._path("keep.log"), False))
+        self.assertTrue(rules.match(self._path("a/keep.log"), False))
+        # }}}
+
+
+    def testNegationOverridesParentDirectoryRule(self):
+        # DOC {{{
+        """A negated pattern of a subdirectory re-includes a path ignored by
+        the rules of its parent, the paths it does not match stay ignored.
+        """
+        # }}}
+
+        # CODE {{{
+        parentRules = self._makeRules("*.log")
+        childRules = IgnoreRules(self._path("sub"), ["!keep.log"])
+        ignoreRules = (parentRules, childRules,)
+
+        self.assertFalse(FileDiscovery._isIgnored(ignoreRules, self._path("sub/keep.log"), False))
+        self.assertTrue(FileDiscovery._isIgnored(ignoreRules, self._path("sub/other.log"), False))
+        self.assertTrue(FileDiscovery._isIgnored(ignoreRules, self._path("keep.log"), False))
+        self.assertFalse(FileDiscovery._isIgnored(ignoreRules, self._path("sub/keep.dat"), False))
+        # }}}
+
+
+    def testCommentsEscapesAndEmptyLinesAreHandled(self):
+        # DOC {{{
+        """Comments and empty lines are skipped, '\\#' and '\\!' match the
+        literal characters.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("# a comment", "", "   ", "\\#x", "\\!y")
+
+        self.assertEqual(len(rules.rules), 2)
+        self.assertTrue(rules.match(self._path("#x"), False))
+        self.assertTrue(rules.match(self._path("!y"), False))
+        self.assertIsNone(rules.match(self._path("y"), False))
+        # }}}
+
+
+    def testCharacterRanges(self):
+        # DOC {{{
+        """'[...]' matches a character of the range, '[!...]' a character out
+        of it, '?' any one character but '/'.
+        """
+        # }}}
+
+        # CODE {{{
+        rules = self._makeRules("f[0-2].dat", "g[!0-2].dat", "h?.dat")
+
+        self.assertTrue(rules.match(self._path("f1.dat"), False))
+        self.assertIsNone(rules.match(self._path("f3.dat"), False))
+        self.assertTrue(rules.match(self._path("g3.dat"), False))
+        self.assertIsNone(rules.match(self._path("g1.dat"), False))
+        self.assertTrue(rules.match(self._path("hx.dat"), False))
+        self.assertIsNone(rules.match(self._path("hxy.dat"), False))
+        # }}}
+
+
+    def testFileDiscoverySkipsIgnoredFiles(self):
+        # DOC {{{
+        """FileDiscovery() applies the .regfileignore files of the scanned
+        directories (the negation in a subdirectory included) and skips the
+        .regfileignore files themselves.
+        """
+        # }}}
+
+        # CODE {{{
+        with tempfile.TemporaryDirectory() as directory:
+            for path, content in (
+                    (IgnoreRules.FILE_NAME, "*.log\nbuild/\n"),
+                    ("a.dat", ""),
+                    ("a.log", ""),
+                    ("build/b.dat", ""),
+                    ("sub/" + IgnoreRules.FILE_NAME, "!keep.log\n"),
+                    ("sub/keep.log", ""),
+                    ("sub/other.log", ""),
+                    ("sub/build", ""),
+            ):
+                os.makedirs(os.path.dirname(os.path.join(directory, path)), exist_ok = True)
+
+                with open(os.path.join(directory, path), "w") as file_:
+                    file_.write(content)
+
+            fileDiscovery = FileDiscovery([directory], ignoredNames = [IgnoreRules.FILE_NAME])
+            files = sorted(os.path.relpath(path, directory) for path in fileDiscovery.iterateFiles())
+
+            self.assertEqual(files, ["a.dat", os.path.join("sub", "build"), os.path.join("sub", "keep.log")])
+            self.assertTrue(fileDiscovery.isComplete)
+        # }}}
+
+
+    def _makeRules(self, *lines):
+        # DOC {{{
+        """Returns IgnoreRules() of the lines relative to DIRECTORY.
+
+        Parameters
+
+            lines -- the lines with the patterns
+        """
+        # }}}
+
+        # CODE {{{
+        return IgnoreRules(IgnoreRulesTest.DIRECTORY, lines)
+        # }}}
+
+
+    def _path(self, relativePath):
+        # DOC {{{
+        """Returns the absolute path of the relative path in DIRECTORY.
+
+        Parameters
+
+            relativePath -- the path relative to DIRECTORY (with '/')
+        """
+        # }}}
+
+        # CODE {{{
+        return os.path.join(IgnoreRulesTest.DIRECTORY, *relativePath.split("/"))
+        # }}}
+
+
+    # }}}
+# }}}
+
+
+if __name__ == "__main__":
+    unittest.main()
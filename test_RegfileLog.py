@@ -0,0 +1,262 @@
+##
+## test_RegfileLog.py
+##      - Tests the reading of regfile's log: the time index of its
+##        segments, the lines of a time range, the state of an entry as of a
+##        time (found by bisecting the log) and the final state of all the
+##        entries.
+##
+##      Run: python -m unittest test_RegfileLog
+##
+
+
+# import of required modules {{{
+import datetime
+import os
+import tempfile
+import unittest
+
+from RegfileLog import RegfileLog
+# }}}
+
+
+# class RegfileLogTest() {{{
+class RegfileLogTest(unittest.TestCase):
+    # DOC {{{
+    """Tests RegfileLog() on a log of three segments:
+
+        10:00 -- the entries 1 to 40 are added
+
+        11:00 -- the entries 41 to 80 are added, the entry 5 is renamed
+
+        12:00 -- the entry 5 is renamed again, the entry 60 gets a group
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the times of the segments
+    SEGMENT_TIMES       = (
+            datetime.datetime(2024, 5, 1, 10, 0, 0),
+            datetime.datetime(2024, 5, 1, 11, 0, 0),
+            datetime.datetime(2024, 5, 1, 12, 0, 0),
+    )
+    # }}}
+
+
+    # METHODS {{{
+    def setUp(self):
+        # DOC {{{
+        """Writes the log to a temporary directory.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.logFilePath = os.path.join(self.temporaryDirectory.name, "dbfile.log")
+
+        segments = (
+                [RegfileLog.ADD + RegfileLog.formatDBFile(self._makeDBFile(fileId)) for fileId in range(1, 41)],
+                [RegfileLog.ADD + RegfileLog.formatDBFile(self._makeDBFile(fileId)) for fileId in range(41, 81)] + [
+                        RegfileLog.UPDATE + RegfileLog.formatDBFile(self._makeDBFile(5)),
+                        RegfileLog.UPDATED + RegfileLog.formatDBFile(self._makeDBFile(5, fileName = "renamed5.dat")),
+                ],
+                [
+                        RegfileLog.UPDATED + RegfileLog.formatDBFile(self._makeDBFile(5, fileName = "again5.dat")),
+                        RegfileLog.UPDATED + RegfileLog.formatDBFile(self._makeDBFile(60, group = "grp")),
+                ],
+        )
+
+        with open(self.logFilePath, "w") as logFile:
+            for segmentTime, lines in zip(RegfileLogTest.SEGMENT_TIMES, segments):
+                logFile.write(RegfileLog.COMMENT + segmentTime.ctime() + "\n")
+                logFile.writelines(line + "\n" for line in lines)
+
+        self.regfileLog = RegfileLog(self.logFilePath)
+        # }}}
+
+
+    def tearDown(self):
+        # DOC {{{
+        """Removes the log and its index.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory.cleanup()
+        # }}}
+
+
+    def testIndexIsBuiltFromLog(self):
+        # DOC {{{
+        """The index of a log without one has a segment per time comment, its
+        offset points at the comment.
+        """
+        # }}}
+
+        # CODE {{{
+        index = self.regfileLog.loadIndex()
+
+        self.assertEqual([segmentTime for segmentTime, segmentOffset in index], list(RegfileLogTest.SEGMENT_TIMES))
+        self.assertTrue(os.path.exists(self.regfileLog.indexFilePath))
+
+        with open(self.logFilePath, "rb") as logFile:
+            for segmentTime, segmentOffset in index:
+                logFile.seek(segmentOffset)
+                self.assertEqual(logFile.readline().decode("utf-8"), RegfileLog.COMMENT + segmentTime.ctime() + "\n")
+
+        # the saved index is read back the same
+        self.assertEqual(RegfileLog(self.logFilePath).loadIndex(), index)
+        # }}}
+
+
+    def testIndexIsRebuiltWhenLogIsReplaced(self):
+        # DOC {{{
+        """An index that does not fit the log (e.g. the log has been
+        replaced by a shorter one) is rebuilt.
+        """
+        # }}}
+
+        # CODE {{{
+        self.regfileLog.loadIndex()
+
+        with open(self.logFilePath, "w") as logFile:
+            logFile.write(RegfileLog.COMMENT + RegfileLogTest.SEGMENT_TIMES[2].ctime() + "\n")
+            logFile.write(RegfileLog.ADD + RegfileLog.formatDBFile(self._makeDBFile(1)) + "\n")
+
+        self.assertEqual(self.regfileLog.loadIndex(), [(RegfileLogTest.SEGMENT_TIMES[2], 0)])
+        # }}}
+
+
+    def testLinesOfTimeRange(self):
+        # DOC {{{
+        """Only the segments logged in the time range (inclusive) are read,
+        the range between the segments is empty.
+        """
+        # }}}
+
+        # CODE {{{
+        lines = list(self.regfileLog.iterateLines(since = RegfileLogTest.SEGMENT_TIMES[1], until = RegfileLogTest.SEGMENT_TIMES[1]))
+
+        self.assertEqual(lines[0], RegfileLog.COMMENT + RegfileLogTest.SEGMENT_TIMES[1].ctime())
+        self.assertEqual(len(lines), 1 + 40 + 2)
+        self.assertTrue(lines[1].startswith(RegfileLog.ADD + "DBF000041|"))
+
+        lines = list(self.regfileLog.iterateLines(since = RegfileLogTest.SEGMENT_TIMES[1] + datetime.timedelta(minutes = 30)))
+
+        self.assertEqual(lines[0], RegfileLog.COMMENT + RegfileLogTest.SEGMENT_TIMES[2].ctime())
+        self.assertEqual(len(lines), 1 + 2)
+
+        self.assertEqual(list(self.regfileLog.iterateLines(
+                since = RegfileLogTest.SEGMENT_TIMES[0] + datetime.timedelta(minutes = 1),
+                until = RegfileLogTest.SEGMENT_TIMES[1] - datetime.timedelta(minutes = 1),
+        )), [])
+        self.assertEqual(list(self.regfileLog.iterateLines(since = RegfileLogTest.SEGMENT_TIMES[2] + datetime.timedelta(hours = 1))), [])
+        self.assertEqual(len(list(self.regfileLog.iterateLines())), 3 + 80 + 4)
+        # }}}
+
+
+    def testBisectFindsEveryAddition(self):
+        # DOC {{{
+        """The addition of every entry is found by bisecting the log, the
+        entries never added are not.
+        """
+        # }}}
+
+        # CODE {{{
+        endOffset = os.path.getsize(self.logFilePath)
+
+        with open(self.logFilePath, "rb") as logFile:
+            for fileId in range(1, 81):
+                addedOffset = self.regfileLog._bisectAddedDBFile(logFile, fileId, 0, endOffset)
+
+                self.assertIsNotNone(addedOffset, fileId)
+                logFile.seek(addedOffset)
+                self.assertTrue(logFile.readline().decode("utf-8").startswith(RegfileLog.ADD + "DBF{:06d}|".format(fileId)))
+
+            for fileId in (0, 81, 1000):
+                self.assertIsNone(self.regfileLog._bisectAddedDBFile(logFile, fileId, 0, endOffset), fileId)
+        # }}}
+
+
+    def testDBFileAsOf(self):
+        # DOC {{{
+        """The state of an entry as of a time has only the updates logged by
+        then, an entry added later does not exist yet.
+        """
+        # }}}
+
+        # CODE {{{
+        self.assertEqual(self.regfileLog.determineDBFileAsOf(5, until = RegfileLogTest.SEGMENT_TIMES[0]).fileName, "file5.dat")
+        self.assertEqual(self.regfileLog.determineDBFileAsOf(5, until = RegfileLogTest.SEGMENT_TIMES[1]).fileName, "renamed5.dat")
+        self.assertEqual(self.regfileLog.determineDBFileAsOf(5).fileName, "again5.dat")
+
+        self.assertIsNone(self.regfileLog.determineDBFileAsOf(60, until = RegfileLogTest.SEGMENT_TIMES[0]))
+        self.assertEqual(self.regfileLog.determineDBFileAsOf(60, until = RegfileLogTest.SEGMENT_TIMES[1]).group, "")
+        self.assertEqual(self.regfileLog.determineDBFileAsOf(60).group, "grp")
+
+        self.assertIsNone(self.regfileLog.determineDBFileAsOf(81))
+        # }}}
+
+
+    def testFinalDBFiles(self):
+        # DOC {{{
+        """The final state of the entries has the last updates applied, the
+        same when the updates are spilled in chunks of one.
+        """
+        # }}}
+
+        # CODE {{{
+        finalDBFiles = [RegfileLog.formatDBFile(dbFile) for dbFile in self.regfileLog.iterateFinalDBFiles()]
+
+        self.assertEqual(len(finalDBFiles), 80)
+        self.assertEqual(finalDBFiles[4], RegfileLog.formatDBFile(self._makeDBFile(5, fileName = "again5.dat")))
+        self.assertEqual(finalDBFiles[59], RegfileLog.formatDBFile(self._makeDBFile(60, group = "grp")))
+
+        chunkSize = RegfileLog.UPDATES_CHUNK_SIZE
+        RegfileLog.UPDATES_CHUNK_SIZE = 1
+
+        try:
+            self.assertEqual([RegfileLog.formatDBFile(dbFile) for dbFile in self.regfileLog.iterateFinalDBFiles()], finalDBFiles)
+        finally:
+            RegfileLog.UPDATES_CHUNK_SIZE = chunkSize
+        # }}}
+
+
+    @staticmethod
+    def _makeDBFile(fileId, fileName = None, group = None):
+        # DOC {{{
+        """Returns a DBFile() of the fileId with made up checksums.
+
+        Parameters
+
+            fileId -- the ID of the DBFile()
+
+            fileName -- (optional) the name of the file ('file<fileId>.dat' if
+                None)
+
+            group -- (optional) the group of the file
+        """
+        # }}}
+
+        # CODE {{{
+        from db.DBFile import DBFile
+
+        return DBFile(
+                fileId      = fileId,
+                fileName    = fileName if (fileName is not None) else "file{}.dat".format(fileId),
+                group       = group,
+                comment     = None,
+                fileSize    = 1000 + fileId,
+                md1         = "{:032x}".format(fileId),
+                md5         = "{:032x}".format(fileId + 1),
+                ed2k        = "{:032x}".format(fileId + 2),
+        )
+        # }}}
+
+
+    # }}}
+# }}}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+##
+## test_startup.py
+##      - Guards the start of regfile: the operations without the database
+##        must not import SQLAlchemy (nor the optional NumPy) and regfile -D
+##        must start within a time budget.
+##
+##      Run: python -m unittest test_startup
+##
+
+
+# import of required modules {{{
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+# }}}
+
+
+# the directory of regfile
+REGFILE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+# class StartupTest() {{{
+class StartupTest(unittest.TestCase):
+    # DOC {{{
+    """Guards the start of regfile (see the lazy imports in register.py and
+    DigestCatalog.py).
+    """
+    # }}}
+
+
+    # STATIC VARIABLES {{{
+    # the modules that are imported only when they are needed
+    LAZY_MODULES        = ("sqlalchemy", "numpy",)
+
+    # the time regfile -D may take over the start of a bare interpreter (in seconds)
+    STARTUP_BUDGET      = 0.3
+
+    # the number of runs the fastest one is measured of
+    RUNS                = 3
+
+    # the code running regfile -D
+    _RUN_MAKE_DEFAULTS  = "import runpy, sys\nsys.argv = ['regfile', '-D']\nrunpy.run_path({!r}, run_name = '__main__')".format(
+            os.path.join(REGFILE_DIRECTORY, "regfile"))
+
+    # the code printing the lazy modules that have been imported after the code to run
+    _PRINT_LAZY_MODULES = "\nimport sys\nprint('imported:' + ','.join(module for module in {!r} if (module in sys.modules)))"
+    # }}}
+
+
+    # METHODS {{{
+    def setUp(self):
+        # DOC {{{
+        """Creates a home with the configuration and an empty working
+        directory for regfile.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory = tempfile.TemporaryDirectory()
+        self.environment = dict(os.environ, HOME = self.temporaryDirectory.name)
+        self.workingDirectory = os.path.join(self.temporaryDirectory.name, "work")
+
+        os.mkdir(self.workingDirectory)
+
+        # the first run creates the default configuration and does nothing else
+        self._runPython(StartupTest._RUN_MAKE_DEFAULTS)
+        # }}}
+
+
+    def tearDown(self):
+        # DOC {{{
+        """Removes the home and the working directory.
+        """
+        # }}}
+
+        # CODE {{{
+        self.temporaryDirectory.cleanup()
+        # }}}
+
+
+    def testImportRegisterDoesNotImportLazyModules(self):
+        # DOC {{{
+        """Importing register must not import SQLAlchemy nor NumPy.
+        """
+        # }}}
+
+        # CODE {{{
+        self.assertEqual(self._runPython("import register" + self._formatPrintLazyModules()), "imported:")
+        # }}}
+
+
+    def testMakeDefaultsDoesNotImportLazyModules(self):
+        # DOC {{{
+        """regfile -D must not import SQLAlchemy nor NumPy.
+        """
+        # }}}
+
+        # CODE {{{
+        output = self._runPython(StartupTest._RUN_MAKE_DEFAULTS + self._formatPrintLazyModules())
+
+        self.assertEqual(output.splitlines()[-1], "imported:")
+        # }}}
+
+
+    def testMakeDefaultsStartsWithinBudget(self):
+        # DOC {{{
+        """regfile -D must not take more than STARTUP_BUDGET over a bare
+        interpreter (the fastest of RUNS runs of each).
+        """
+        # }}}
+
+        # CODE {{{
+        bareDuration = min(self._measure([sys.executable, "-c", "pass"]) for ii in range(StartupTest.RUNS))
+        regfileDuration = min(self._measure([sys.executable, os.path.join(REGFILE_DIRECTORY, "regfile"), "-D"]) for ii in range(StartupTest.RUNS))
+
+        self.assertLessEqual(regfileDuration - bareDuration, StartupTest.STARTUP_BUDGET,
+                "regfile -D took {:.3f}s, a bare interpreter {:.3f}s".format(regfileDuration, bareDuration))
+        # }}}
+
+
+    def _formatPrintLazyModules(self):
+        # DOC {{{
+        """Returns the code printing the lazy modules that have been imported.
+        """
+        # }}}
+
+        # CODE {{{
+        return StartupTest._PRINT_LAZY_MODULES.format(StartupTest.LAZY_MODULES)
+        # }}}
+
+
+    def _runPython(self, code):
+        # DOC {{{
+        """Runs the code in a new interpreter (with regfile's directory in the
+        path) and returns its standard output.
+
+        Parameters
+
+            code -- the code to run
+        """
+        # }}}
+
+        # CODE {{{
+        return subprocess.run(
+                [sys.executable, "-c", "import sys\nsys.path.insert(0, {!r})\n".format(REGFILE_DIRECTORY) + code],
+                cwd = self.workingDirectory, env = self.environment, check = True,
+                stdout = subprocess.PIPE, universal_newlines = True,
+        ).stdout.strip()
+        # }}}
+
+
+    def _measure(self, command):
+        # DOC {{{
+        """Returns the duration of the command in seconds (any defaults file
+        made by a previous run is removed first).
+
+        Parameters
+
+            command -- the command to run
+        """
+        # }}}
+
+        # CODE {{{
+        for fileName in ("_.regfiledefaults", ".regfiledefaults"):
+            if (os.path.exists(os.path.join(self.workingDirectory, fileName))):
+                os.remove(os.path.join(self.workingDirectory, fileName))
+
+        start = time.perf_counter()
+        subprocess.run(command, cwd = self.workingDirectory, env = self.environment, check = True, stdout = subprocess.DEVNULL)
+
+        return time.perf_counter() - start
+        # }}}
+
+
+    # }}}
+# }}}
+
+
+if __name__ == "__main__":
+    unittest.main()